@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the custom_generator module
+
+Usage:
+
+python bench.py [--json PATH] [--only NAME ...]
+
+(--json writes the results as JSON to PATH or stdout if PATH is '-' so that runs can be compared;
+it exits with an error if any of the checks of the results fail e.g. see check_shapes)
+"""
+from timeit import default_timer
+from copy import copy,deepcopy
+from gc import collect
+from tempfile import mkdtemp
+from shutil import rmtree
+from argparse import ArgumentParser
+import platform
+import pickle
+import json
+import sys
+import os
+try:
+    from tracemalloc import start,stop,get_traced_memory
+except ImportError: ## i.e. python 2 ##
+    start=None
+try:
+    from .custom_generator import Generator,AsyncGenerator,frame,code,dump_many,parallel_map,state_cache,source_cache,stats,__version__
+except ImportError: ## i.e. ran as a script from within the repository ##
+    from custom_generator import Generator,AsyncGenerator,frame,code,dump_many,parallel_map,state_cache,source_cache,stats,__version__
+
+def generator_source(size):
+    """Creates the source code of a generator function with roughly 'size' lines"""
+    lines=["def gen(data):"]
+    for index in range(size//6):
+        lines+=["    a%s = 'string: %s; \\'quoted\\'' + \\" % (index,index),
+                "          'continued'",
+                "    for i in range(%s):" % index,
+                "        yield a%s" % index,
+                "    def inner%s(x): return x" % index,
+                "    total = yield from data"]
+    return "\n".join(lines)+"\n"
+
+def timer(FUNC,repeat=5):
+    """Gets the best time in seconds of calling FUNC repeat times"""
+    best=None
+    for _ in range(repeat):
+        start=default_timer()
+        FUNC()
+        end=default_timer()-start
+        if best is None or end < best:
+            best=end
+    return best
+
+def bench_clean(sizes=(100,200,400,800,1600)):
+    """
+    Times the source cleaning engines (e.g. 'source' and 'ast') at
+    different function sizes; returns a list of dicts with the time
+    per line to show how each engine scales
+    """
+    results=[]
+    for size in sizes:
+        gen=Generator.__new__(Generator)
+        gen.source=generator_source(size)
+        for engine,clean in (("source",gen._clean_source_lines),("ast",gen._ast_clean_source_lines)):
+            seconds=timer(clean)
+            results+=[{"engine":engine,"lines":size,"seconds":seconds,"us_per_line":seconds/size*1e6}]
+    return results
+
+def bench_copy(sizes=(100,1600),locals_sizes=(0,100,1000),number=1000):
+    """
+    Times copying and deepcopying a Generator with different function 
+    sizes and numbers of locals; returns a list of dicts with the time
+    per copy to show it only scales with the size of the locals
+    """
+    results=[]
+    for size in sizes:
+        gen=Generator.__new__(Generator)
+        gen.source=generator_source(size)
+        lines=tuple(gen._ast_clean_source_lines())
+        gen=Generator(dict(_module=None,_source_lines=lines,engine="ast",gi_code=code(),gi_frame=frame(),gi_running=False,
+                           gi_suspended=False,gi_yieldfrom=None,jump_positions=tuple(map(tuple,gen.jump_positions)),lineno=1,source=gen.source))
+        for locals_size in locals_sizes:
+            gen.gi_frame.f_locals=dict(("a%s" % index,[index]) for index in range(locals_size))
+            for name,FUNC in (("copy",copy),("deepcopy",deepcopy)):
+                seconds=timer(lambda:[FUNC(gen) for _ in range(number)])
+                results+=[{"copier":name,"lines":size,"locals":locals_size,"seconds":seconds,"us_per_copy":seconds/number*1e6}]
+    return results
+
+def example_generator():
+    """used for benchmarking generators made from a function"""
+    a=1
+    yield a
+    yield a+1
+
+def loop_generator(size):
+    """used for benchmarking yields in a loop"""
+    for index in range(size):
+        yield index
+
+def bench_drain(sizes=(1000,100000)):
+    """
+    Times Generator.drain (many yields within one state activation) 
+    against a native generator; returns a list of dicts with the time
+    per item
+    """
+    def drain(size):
+        gen=Generator(loop_generator)
+        gen.gi_frame.f_locals={"size":size} ## i.e. the arguements ##
+        return gen.drain()
+    results=[]
+    for size in sizes:
+        for name,FUNC in (("drain",lambda:drain(size)),("native",lambda:list(loop_generator(size)))):
+            seconds=timer(FUNC)
+            results+=[{"generator":name,"items":size,"seconds":seconds,"us_per_item":seconds/size*1e6}]
+    return results
+
+def bench_genexpr(sizes=(1000,100000)):
+    """
+    Times stepping and draining a generator expression (see GenexprGenerator)
+    against a native one; returns a list of dicts with the time per item of data
+    """
+    def make(size):
+        gen=Generator("(index*2 for index in data if index%3)")
+        gen.gi_frame.f_locals={"data":range(size)}
+        return gen
+    def step(gen):
+        for value in gen:
+            pass
+    results=[]
+    for size in sizes:
+        for name,FUNC in (("next",lambda:step(make(size))),("drain",lambda:make(size).drain()),
+                          ("native",lambda:list(index*2 for index in range(size) if index%3))):
+            seconds=timer(FUNC)
+            results+=[{"generator":name,"items":size,"seconds":seconds,"us_per_item":seconds/size*1e6}]
+    return results
+
+def bench_stats(steps=1000):
+    """
+    Times stepping a Generator with the stats disabled and enabled; 
+    returns a list of dicts with the time per step to show the cost
+    of the instrumentation (it should be near zero when disabled)
+    """
+    def step():
+        gen=Generator(loop_generator)
+        gen.gi_frame.f_locals={"size":steps}
+        for _ in range(steps):
+            next(gen)
+    results,enabled=[],stats.enabled
+    try:
+        for stats.enabled in (False,True):
+            seconds=timer(step)
+            results+=[{"stats":"enabled" if stats.enabled else "disabled","steps":steps,"seconds":seconds,"us_per_step":seconds/steps*1e6}]
+    finally:
+        stats.enabled=enabled
+    return results
+
+def nested_generator(size):
+    """used for benchmarking adopting a generator suspended in nested loops"""
+    for outer in range(size):
+        for index in range(size):
+            yield outer,index
+
+def bench_adopt(size=200,number=1000):
+    """
+    Times adopting a native generator that's suspended mid-way through nested 
+    loops as a Generator (e.g. at checkpoint time) and pickling it against a
+    native step; returns a list of dicts with the time per call
+    """
+    native=nested_generator(size)
+    for _ in range(size*size//2):
+        next(native)
+    Generator(native) ## i.e. so that the transformation and lasti mapping are cached ##
+    results=[]
+    for name,FUNC in (("native",lambda:next(native)),("adopt",lambda:Generator(native)),
+                      ("pickle",lambda:pickle.dumps(Generator(native)))):
+        seconds=timer(lambda:[FUNC() for _ in range(number)])
+        results+=[{"operation":name,"calls":number,"seconds":seconds,"us_per_call":seconds/number*1e6}]
+    return results
+
+def cpu_generator(size):
+    """used for benchmarking CPU-bound generator bodies"""
+    for index in range(size):
+        total=0
+        for item in range(1000):
+            total+=item*index
+        yield total
+
+def bench_parallel(number=8,size=1000,workers=None):
+    """
+    Times running number Generators with CPU-bound bodies to exhaustion 
+    in this process against parallel_map with 1, 2, 4, ... workers up 
+    to the number of cpus (or workers); returns a list of dicts with the
+    time per generator and the speedup over running them in this process
+    """
+    def generators():
+        for _ in range(number):
+            gen=Generator(cpu_generator)
+            gen.gi_frame.f_locals={"size":size}
+            yield gen
+    def single():
+        for gen in generators():
+            gen.drain()
+    def parallel(workers):
+        for index,values in parallel_map(generators(),workers):
+            pass
+    cpus=os.cpu_count() or 1
+    counts,count=[],1
+    while count < (workers or cpus):
+        counts+=[count]
+        count*=2
+    counts+=[workers or cpus]
+    results,single_seconds=[],timer(single,3)
+    results+=[{"mode":"single","workers":0,"cpus":cpus,"generators":number,"seconds":single_seconds,
+               "ms_per_generator":single_seconds/number*1e3,"speedup":1.0}]
+    for count in counts:
+        seconds=timer(lambda:parallel(count),3)
+        results+=[{"mode":"parallel","workers":count,"cpus":cpus,"generators":number,"seconds":seconds,
+                   "ms_per_generator":seconds/number*1e3,"speedup":single_seconds/seconds}]
+    return results
+
+def bench_memory(number=10000):
+    """
+    Measures the memory in bytes per Generator e.g. when fresh, 
+    suspended (after one step) and after its gi_frame is inspected
+    """
+    def suspended():
+        gen=Generator(example_generator)
+        next(gen)
+        return gen
+    def inspected():
+        gen=suspended()
+        gen.gi_frame
+        return gen
+    results=[]
+    if start is None:
+        return results
+    for name,FUNC in (("fresh",lambda:Generator(example_generator)),("suspended",suspended),("inspected",inspected)):
+        FUNC() ## so that the caches are populated beforehand ##
+        collect()
+        start()
+        before=get_traced_memory()[0]
+        generators=[FUNC() for _ in range(number)]
+        after=get_traced_memory()[0]
+        stop()
+        results+=[{"generator":name,"number":number,"bytes_per_instance":(after-before)/number}]
+    return results
+
+def bench_checkpoint(sizes=(10000,1000000)):
+    """
+    Times checkpointing an AsyncGenerator with large locals inside of an 
+    event loop (ticking every 1ms) by calling dump_many directly against 
+    AsyncGenerator.checkpoint; returns a list of dicts with the total 
+    time and the longest the event loop was stalled for
+    """
+    try:
+        from asyncio import new_event_loop,sleep
+    except ImportError: ## i.e. python 2 ##
+        return []
+    from io import BytesIO
+    results=[]
+    for size in sizes:
+        ## the checkpoint only depends on the locals (async def isn't used for backwards compatibility) ##
+        gen=AsyncGenerator(example_generator)
+        gen.gi_frame.f_locals={"data":[str(index) for index in range(size)]}
+        for name,FUNC in (("blocking",lambda:dump_many(gen,BytesIO())),("executor",lambda:gen.checkpoint(BytesIO()))):
+            loop=new_event_loop()
+            gaps,last,done=[],[default_timer()],loop.create_future()
+            def tick():
+                now=default_timer()
+                gaps.append(now-last[0])
+                last[0]=now
+                loop.call_later(0.001,tick)
+            def checkpoint():
+                future=FUNC()
+                if future is None:
+                    done.set_result(None)
+                else:
+                    future.add_done_callback(lambda future:done.set_result(None))
+            loop.call_soon(tick)
+            loop.run_until_complete(sleep(0.01))
+            del gaps[:]
+            start_time=default_timer()
+            loop.call_soon(checkpoint)
+            loop.run_until_complete(done)
+            seconds=default_timer()-start_time
+            loop.run_until_complete(sleep(0.01)) ## so that the gap of a blocking checkpoint is recorded ##
+            loop.close()
+            results+=[{"checkpoint":name,"locals":size,"seconds":seconds,"max_stall_ms":max(gaps)*1e3}]
+    return results
+
+def shape_source(shape,size):
+    """Creates the source code of a generator function of a shape repeated 'size' times"""
+    if shape=="lambda": ## i.e. a lambda source ##
+        return "lambda_%s = lambda: (yield from range(%s))" % (size,size)
+    lines=["def %s_%s():" % (shape,size)]
+    for index in range(size):
+        if shape=="straight":
+            lines+=["    a%s = %s" % (index,index),
+                    "    yield a%s" % index]
+        elif shape=="nested":
+            lines+=["    for i%s in range(2):" % index,
+                    "        for j%s in range(2):" % index,
+                    "            yield i%s + j%s" % (index,index)]
+        elif shape=="yield_from":
+            lines+=["    yield from range(2)"]
+        elif shape=="send":
+            lines+=["    a%s = yield %s" % (index,index)]
+    return "\n".join(lines)
+
+def load_shapes(shapes,sizes,directory):
+    """
+    Writes the shapes as a module in directory and imports it 
+    (the functions need to be in a file for inspect.getsource)
+    """
+    name="custom_generator_bench_shapes"
+    with open(os.path.join(directory,name+".py"),"w") as file:
+        for shape in shapes:
+            for size in sizes:
+                file.write(shape_source(shape,size)+"\n")
+    sys.path.insert(0,directory)
+    try:
+        return __import__(name)
+    finally:
+        sys.path.remove(directory)
+        del sys.modules[name]
+
+def bench_case(make,steps,number=5,repeat=3):
+    """
+    Times a Generator (made by make) with steps steps returning a dict of
+    the construction time (warm and cold e.g. with the source code and 
+    states transformed), the latency per step (warm and cold) and the 
+    copy/deepcopy/pickle latencies of a suspended Generator and its pickle size
+
+    Note: the cold timings are of one run since they clear the caches
+    """
+    def exhaust():
+        for _ in range(number):
+            for value in make():
+                pass
+    def cold():
+        source_cache.clear()
+        state_cache.clear()
+        return make()
+    suspended=make()
+    next(suspended)
+    data=pickle.dumps(suspended)
+    return {"steps":steps,
+            "construct_us":timer(lambda:[make() for _ in range(number)],repeat)/number*1e6,
+            "transform_us":timer(cold,repeat)*1e6,
+            "step_us":timer(exhaust,repeat)/number/steps*1e6,
+            "cold_step_us":timer(lambda:list(cold()),repeat)/steps*1e6,
+            "copy_us":timer(lambda:[copy(suspended) for _ in range(number)],repeat)/number*1e6,
+            "deepcopy_us":timer(lambda:[deepcopy(suspended) for _ in range(number)],repeat)/number*1e6,
+            "pickle_us":timer(lambda:[pickle.dumps(suspended) for _ in range(number)],repeat)/number*1e6,
+            "unpickle_us":timer(lambda:[pickle.loads(data) for _ in range(number)],repeat)/number*1e6,
+            "pickle_bytes":len(data)}
+
+def bench_native(native,steps,number=100):
+    """Times a native generator (made by native) returning a dict of the construction time and the latency per step"""
+    def exhaust():
+        for _ in range(number):
+            for value in native():
+                pass
+    return {"steps":steps,
+            "construct_us":timer(lambda:[native() for _ in range(number)])/number*1e6,
+            "step_us":timer(exhaust)/number/steps*1e6}
+
+def bench_shapes(sizes=(10,100),engines=("source","ast")):
+    """
+    Benchmarks Generators of different shapes (straight-line yields, 
+    nested loops, yield from, send, lambda sources and genexpr strings)
+    at different sizes against native generators (see bench_case and 
+    bench_native); returns a list of dicts (with the error if a case
+    isn't supported)
+    """
+    shapes=("straight","nested","yield_from","send","lambda")
+    directory=mkdtemp()
+    try:
+        module=load_shapes(shapes,sizes,directory)
+        cases=[]
+        for shape in shapes:
+            for size in sizes:
+                FUNC=getattr(module,"%s_%s" % (shape,size))
+                cases+=[(shape,size,lambda engine,FUNC=FUNC:Generator(FUNC,engine=engine),FUNC)]
+        for size in sizes:
+            source="(i * 2 for i in range(%s) if i != 1)" % size
+            code_obj=compile(source,"<genexpr>","eval")
+            cases+=[("genexpr",size,lambda engine,source=source:Generator(source,engine=engine),lambda code_obj=code_obj:eval(code_obj))]
+        results=[]
+        for shape,size,make,native in cases:
+            steps=len(list(native())) or 1
+            for engine in engines:
+                try:
+                    result=bench_case(lambda:make(engine),steps)
+                except Exception as error:
+                    result={"error":repr(error)}
+                result.update(shape=shape,size=size,generator=engine)
+                results+=[result]
+            result=bench_native(native,steps)
+            result.update(shape=shape,size=size,generator="native")
+            results+=[result]
+        return results
+    finally:
+        rmtree(directory)
+
+def check_shapes(results):
+    """
+    Checks that the warm per step latency of each shape grows at most 
+    linearly with its size (e.g. with the number of locals bound on 
+    each step) from its smallest to its largest size; returns a list
+    of the failures
+    """
+    steps={}
+    for result in results:
+        if result["generator"]!="native" and not "error" in result:
+            steps.setdefault((result["shape"],result["generator"]),[]).append((result["size"],result["step_us"]))
+    failures=[]
+    for (shape,generator),sizes in sorted(steps.items()):
+        (small,small_us),(large,large_us)=min(sizes),max(sizes)
+        if large_us > small_us*large/small:
+            failures+=["%s (%s): %.3fus/step at size %s is more than %s times the %.3fus/step at size %s"
+                       % (shape,generator,large_us,large,large//small,small_us,small)]
+    return failures
+
+def print_shape(result):
+    """prints a result of bench_shapes"""
+    if "error" in result:
+        print("%(shape)-10s size=%(size)-4s %(generator)-7s error: %(error)s" % result)
+    elif result["generator"]=="native":
+        print("%(shape)-10s size=%(size)-4s %(generator)-7s construct %(construct_us).2fus step %(step_us).3fus" % result)
+    else:
+        print(("%(shape)-10s size=%(size)-4s %(generator)-7s construct %(construct_us).2fus (cold %(transform_us).1fus) "
+               "step %(step_us).3fus (cold %(cold_step_us).1fus) copy %(copy_us).2fus deepcopy %(deepcopy_us).2fus "
+               "pickle %(pickle_us).2fus unpickle %(unpickle_us).2fus %(pickle_bytes)sB") % result)
+
+## name: (function, format of its results) ##
+benchmarks=(("clean",bench_clean,"%(engine)-8s lines=%(lines)-6s %(seconds).6fs %(us_per_line).3fus/line"),
+            ("copy",bench_copy,"%(copier)-8s lines=%(lines)-6s locals=%(locals)-6s %(us_per_copy).3fus/copy"),
+            ("shapes",bench_shapes,print_shape),
+            ("drain",bench_drain,"%(generator)-8s items=%(items)-6s %(us_per_item).3fus/item"),
+            ("genexpr",bench_genexpr,"%(generator)-8s items=%(items)-6s %(us_per_item).3fus/item"),
+            ("adopt",bench_adopt,"%(operation)-8s calls=%(calls)-6s %(us_per_call).3fus/call"),
+            ("stats",bench_stats,"%(stats)-8s steps=%(steps)-6s %(us_per_step).3fus/step"),
+            ("memory",bench_memory,"%(generator)-10s %(bytes_per_instance).1f bytes/generator"),
+            ("parallel",bench_parallel,"%(mode)-8s workers=%(workers)-3s cpus=%(cpus)-3s generators=%(generators)-4s "
+                                       "%(seconds).6fs %(ms_per_generator).3fms/generator speedup %(speedup).2fx"),
+            ("checkpoint",bench_checkpoint,"%(checkpoint)-8s locals=%(locals)-8s %(seconds).6fs max stall %(max_stall_ms).3fms"))
+
+def check_parallel(results):
+    """
+    checks that parallel_map scales e.g. that with 2 or more workers (on
+    as many cpus) it's at least half as many times faster as running the
+    generators in this process; returns a list of the failures
+    """
+    failures=[]
+    for result in results:
+        count=min(result["workers"],result["cpus"],result["generators"])
+        if result["mode"]=="parallel" and count > 1 and result["speedup"] < count/2:
+            failures+=["parallel_map with %s workers is only %.2f times faster than running in this process" % (result["workers"],result["speedup"])]
+    return failures
+
+## name: function that checks its results (returning a list of the failures) ##
+checks={"shapes":check_shapes,"parallel":check_parallel}
+
+def main(argv=None):
+    parser=ArgumentParser(description="Benchmarks for the custom_generator module")
+    parser.add_argument("--json",metavar="PATH",help="write the results as JSON to PATH ('-' for stdout)")
+    parser.add_argument("--only",metavar="NAME",nargs="+",choices=[name for name,FUNC,form in benchmarks],
+                        help="only run these benchmarks")
+    args=parser.parse_args(argv)
+    report={"python":platform.python_version(),"implementation":platform.python_implementation(),
+            "platform":platform.platform(),"version":__version__,"results":{},"failures":[]}
+    for name,FUNC,form in benchmarks:
+        if args.only and not name in args.only:
+            continue
+        report["results"][name]=results=FUNC()
+        if name in checks:
+            report["failures"]+=checks[name](results)
+        if args.json!="-":
+            print("### %s ###" % name)
+            for result in results:
+                if isinstance(form,str):
+                    print(form % result)
+                else:
+                    form(result)
+    if args.json=="-":
+        print(json.dumps(report,indent=1))
+    elif args.json:
+        with open(args.json,"w") as file:
+            json.dump(report,file,indent=1)
+    if report["failures"]:
+        raise SystemExit("failed checks:\n"+"\n".join(report["failures"]))
+
+if __name__=="__main__":
+    main()
@@ -24,11 +24,37 @@ For python 2:
  - builtin function 'next' was introduced in 2.6
 """
 
-from types import FunctionType
-from inspect import getsource,currentframe,findsource
+__version__="0.1.0"
+
+from types import FunctionType,CodeType,GeneratorType
+from inspect import getsource,getblock,currentframe,getgeneratorstate,GEN_CREATED,GEN_RUNNING
 import ctypes
 from copy import deepcopy,copy
-from sys import version_info
+from sys import version_info,modules,_getframe
+from os import environ
+from platform import python_implementation
+import os
+from hashlib import sha256
+from tempfile import mkstemp
+from pickle import PicklingError,UnpicklingError
+try:
+    from pickle import PickleBuffer
+except ImportError: ## i.e. python 3.7 and lower (protocol 5 was introduced in 3.8) ##
+    PickleBuffer=None
+import pickle
+import mmap
+from dis import opmap,hasfree,get_instructions
+from collections import OrderedDict,deque
+from itertools import islice
+import itertools
+from threading import Lock,local
+from io import BytesIO
+from traceback import format_exc
+from timeit import default_timer
+import marshal
+import zlib
+import linecache
+import ast
 #########################
 ### utility functions ###
 #########################
@@ -54,7 +80,7 @@ if version_info < (2,6):
 ################
 ### tracking ###
 ################
-def track_iter(obj):
+def track_iter(obj,hidden=None,key=None):
     """
     Tracks an iterator in the local scope initiated by a for loop
     
@@ -62,8 +88,14 @@ def track_iter(obj):
     of an iterator via a for loop implictely does not allow for 
     reliable extraction from the garbage collector and thus manually
     assigning the iterator for tracking is used
+
+    If hidden is given the iterator is tracked in it under key
+    instead (i.e. the hidden locals of a state; see track_loops)
     """
     obj=iter(obj)
+    if hidden is not None:
+        hidden[key]=obj
+        return obj
     f_locals=currentframe().f_back.f_locals
     if not isinstance(f_locals.get(".count",None),int):
         f_locals[".count"]=0
@@ -74,6 +106,15 @@ def track_iter(obj):
     f_locals[key]=obj
     return obj
 
+def track_aiter(obj,hidden,key):
+    """
+    The same as track_iter (with hidden) but for the async iterator 
+    of an async for loop (i.e. in an AsyncGenerator's states)
+    """
+    obj=obj.__aiter__()
+    hidden[key]=obj
+    return obj
+
 # if needed (generator expressions won't need this functions or other things in __main__ may)
 def untrack_iters():
     """removes all currently tracked iterators on the current frame"""
@@ -90,6 +131,10 @@ def decref(key):
         del f_locals[".count"]
     else:
         f_locals[".count"]-=1
+
+## the line the states close the generator with before returning (e.g. the returns ##
+## of the cleaned source lines that aren't after it are its yields; see yield_indexes) ##
+close_line="currentframe().f_back.f_locals['self'].close()"
 ############################
 ### cleaning source code ###
 ############################
@@ -227,59 +272,77 @@ def is_definition(line):
 ########################
 ### code adjustments ###
 ########################
-def skip_alternative_statements(line_iter):
-    """Skips all alternative statements for the control flow adjustment"""
-    for index,line in line_iter:
-        temp_indent=get_indent(line)
-        temp_line=line[temp_indent:]
-        if not is_alternative_statement(temp_line):
+def skip_alternative_statements(lines,index,blocks=None,offset=0):
+    """
+    Skips all alternative statements (and their bodies) 
+    for the control flow adjustment starting from index
+
+    (blocks is the block tree of the lines offset by offset
+    e.g. if given the bodies are skipped via their blocks)
+    """
+    while index < len(lines):
+        temp_indent=get_indent(lines[index])
+        if not is_alternative_statement(lines[index][temp_indent:]):
             break
-    return index,line,temp_indent
+        index+=1
+        if blocks and index+offset < len(blocks):
+            block=blocks[index+offset]
+            if block and block.start==index+offset-1:
+                index=min(block.end-offset,len(lines))
+                continue
+        while index < len(lines) and get_indent(lines[index]) > temp_indent:
+            index+=1
+    return index
 
-def control_flow_adjust(lines,indexes,reference_indent=4):
+def control_flow_adjust(lines,indexes,reference_indent=4,blocks=None):
     """
     removes unreachable control flow blocks that 
     will get in the way of the generators state
 
     Note: it assumes that the line is cleaned,
     in particular, that it starts with an 
-    indentation of 4
+    indentation of 4 (blocks is the block tree of
+    the source lines that lines is a slice of)
 
     It will also add 'try:' when there's an
     'except' line on the next minimum indent
     """
-    new_lines,flag,current_min=[],False,get_indent(lines[0])
-    line_iter=enumerate(lines)
-    for index,line in line_iter:
+    if not lines:
+        return False,[],[]
+    new_lines,new_indexes,flag,current_min=[],[],False,get_indent(lines[0])
+    ## exited: the blocks we started in have ended so their alternatives are unreachable ##
+    index,exited,in_try=0,True,False
+    while index < len(lines):
+        line=lines[index]
         temp_indent=get_indent(line)
         temp_line=line[temp_indent:]
-        ## skip over all alternative statements until it's not an alternative statement ##
-        if is_alternative_statement(temp_line):
-            end_index,line,temp_indent=skip_alternative_statements(line_iter)
-            del indexes[index:end_index]
-            index=end_index
         if temp_indent < current_min:
-            current_min=temp_indent
-            if current_min == reference_indent:
-                flag=True
-            if temp_line.startswith("except"):
-                new_lines=[" "*4+"try:"]+indent_lines(new_lines)+[line[current_min-4:]]
-                indexes=[indexes[0]]+indexes
-        ## add the line (adjust if indentation is not reference_indent) ##
-        if current_min != reference_indent:
-            ## adjust using the current_min until it's the same as reference_indent ##
-            new_lines+=[line[current_min-4:]]
-        else:
-            return flag,new_lines+indent_lines(lines[index:],4-reference_indent),indexes
-    return flag,new_lines,indexes
+            current_min,exited,in_try=temp_indent,True,False
+        if temp_indent == current_min and exited:
+            if temp_line.startswith("except") or temp_line.startswith("finally"):
+                if not in_try:
+                    new_lines,new_indexes,in_try=[" "*4+"try:"]+indent_lines(new_lines),[indexes[index]]+new_indexes,True
+            elif not (in_try and temp_line.startswith("else")):
+                if is_alternative_statement(temp_line):
+                    index=skip_alternative_statements(lines,index,blocks,indexes[0])
+                    continue
+                exited=False
+                if current_min == reference_indent:
+                    flag=True
+                    return flag,new_lines+indent_lines(lines[index:],4-reference_indent),new_indexes+list(indexes[index:])
+        ## add the line (adjust using the current_min until it's the same as reference_indent) ##
+        new_lines+=[line[current_min-4:]]
+        new_indexes+=[indexes[index]]
+        index+=1
+    return flag,new_lines,new_indexes
 
 def indent_lines(lines,indent=4):
     """indents a list of strings acting as lines"""
     if indent > 0:
         return [" "*indent+line for line in lines]
     if indent < 0:
-        return [line[get_indent(line)+indent:] for line in lines]
-    return lines
+        return [line[-indent:] for line in lines]
+    return list(lines)
 
 def temporary_loop_adjust(lines,indexes,outer_loop,*pos):
     """
@@ -293,32 +356,73 @@ def temporary_loop_adjust(lines,indexes,outer_loop,*pos):
     simple while loop and if statement
     """
     ## skip over for/while and definition blocks ##
-    new_lines,flag,lines=[],False,iter(lines)
-    for index,line in enumerate(lines):
+    new_lines,new_indexes,flag,index=[],[],False,0
+    while index < len(lines):
+        line=lines[index]
         indent=get_indent(line)
-        temp_line=line[indent:]
-        ## skip loop and definition blocks ##
-        while temp_line.startswith("for") or temp_line.startswith("while") or temp_line.startswith("def") or temp_line.startswith("async def") or temp_line.startswith("class") or temp_line.startswith("async class"):
-            for line in lines:
-                temp_indent=get_indent(line)
-                if temp_indent <= indent:
-                    break
-                new_lines+=[line]
-            indent=temp_indent
-            temp_line=line[indent:]
-        if temp_line.startswith("continue"):
+        temp_line=line[indent:].rstrip()
+        ## skip loop and definition blocks (their control flow is their own) ##
+        if temp_line.startswith("for ") or temp_line.startswith("async for ") or temp_line.startswith("while ") or\
+           temp_line.startswith("def ") or temp_line.startswith("async def ") or temp_line.startswith("class "):
+            end=index+1
+            while end < len(lines) and get_indent(lines[end]) > indent:
+                end+=1
+            new_lines+=lines[index:end]
+            new_indexes+=indexes[index:end]
+            index=end
+            continue
+        if temp_line=="continue":
             flag=True
-            new_lines+=["break"]
-        elif temp_line.startswith("break"):
+            new_lines+=[" "*indent+"break"]
+            new_indexes+=[indexes[index]]
+        elif temp_line=="break":
             flag=True
-            new_lines+=["locals()['.continue']=False","break"]
-            indexes=indexes[index:]+indexes[index]+indexes[:index]
+            new_lines+=[" "*indent+"__hidden__['.continue']=False"," "*indent+"break"]
+            new_indexes+=[indexes[index]]*2
         else:
             new_lines+=[line]
+            new_indexes+=[indexes[index]]
+        index+=1
     if flag: ## we can't adjust the indent during since it's determined only once it hits a line that requires adjusting ##
-        # for indexes, we can't have any internal code counted towards the linetable which means mapping to the relevant line number ##
-        return ["while True:"]+indent_lines(new_lines)+["if locals()['.continue']:"]+indent_lines(outer_loop),[0]+indexes+[len(indexes)+1]+list(range(*pos))
-    return new_lines+outer_loop,indexes+list(range(*pos))
+        ## the while/break/if lines aren't in the source so they're mapped to the loops header ##
+        return ["    while True:"]+indent_lines(new_lines+["    break"])+["    if __hidden__.pop('.continue',True):"]+indent_lines(outer_loop),\
+               [pos[0]]+new_indexes+[pos[0],pos[0]]+list(range(*pos))
+    return new_lines+outer_loop,new_indexes+list(range(*pos))
+
+def track_loops(lines,jump_positions):
+    """
+    adjusts the for loop headers so that their iterators get tracked 
+    in the hidden locals under '.<lineno>' (see track_iter) e.g.
+
+    for i in range(3): -> for i in track_iter(range(3),__hidden__,'.1'):
+
+    (async for loops use track_aiter instead)
+    """
+    lines=list(lines)
+    for start,end in jump_positions:
+        line=lines[start-1]
+        indent=get_indent(line)
+        if line[indent:].startswith("for ") or line[indent:].startswith("async for "):
+            try:
+                node=ast.parse(line[indent:]+"pass").body[0]
+            except SyntaxError: ## i.e. the loops body is on the same line ##
+                continue
+            if isinstance(node,ast.AsyncFor):
+                line=" "*indent+"async for %s in track_aiter(%s,__hidden__,'.%s'):"
+            else:
+                line=" "*indent+"for %s in track_iter(%s,__hidden__,'.%s'):"
+            lines[start-1]=line % (ast.unparse(node.target),ast.unparse(node.iter),start)
+    return lines
+
+def resume_loop(line):
+    """adjusts a tracked for loop header (see track_loops) to resume from its tracked iterator"""
+    indent=get_indent(line)
+    if line[indent:].startswith("for ") or line[indent:].startswith("async for "):
+        node=ast.parse(line[indent:]+"pass").body[0]
+        if isinstance(node.iter,ast.Call) and getattr(node.iter.func,"id",None) in ("track_iter","track_aiter"):
+            return " "*indent+"%sfor %s in __hidden__[%s]:" % ("async " if isinstance(node,ast.AsyncFor) else "",
+                                                              ast.unparse(node.target),ast.unparse(node.iter.args[2]))
+    return line
 
 def has_node(line,node):
     """Checks if a node has starting IDs that match"""
@@ -353,31 +457,311 @@ def send_adjust(line):
     if flag:
         reciever="="
         if flag == 2:
-            reciever+="locals()['.send']"
+            reciever+="__hidden__['.send']"
         ## indicator       yield statement            assignments
-        return flag,["=".join(parts[index:]),"=".join(parts[:index])+reciever]
+        return flag,["=".join(parts[index:]).lstrip(),"=".join(parts[:index])+reciever]
     return None,None
 
-def get_loops(lineno,jump_positions):
+def yield_from_adjust(indent,expr,reciever=""):
+    """
+    adjusts 'yield from expr' into a for loop over expr that returns
+    each value (sending to it if the yield from is being assigned)
+    """
+    lines=[indent+"__hidden__['.yieldfrom']="+expr,
+           indent+"for __hidden__['.i'] in __hidden__['.yieldfrom']:",
+           indent+"    return __hidden__['.i']"]
+    if reciever:
+        lines+=[indent+"    %s__hidden__['.yieldfrom'].send(__hidden__['.send'])" % reciever]
+    return lines
+
+class Block(object):
+    """
+    A compound statement in the cleaned source lines e.g. its kind ('for',
+    'if', 'try', etc.), the indexes of its header and the line after its 
+    body, its indent and the block it's nested in (None if it's not)
+    """
+    __slots__=('kind','start','end','indent','parent')
+    ## async first since they'd otherwise be taken for something else ##
+    kinds=("async for","async with","async def","for","while","if","elif","else","try",
+           "except","finally","with","def","class","match","case")
+    loops=("for","async for","while")
+
+    def __init__(self,kind,start,end,indent,parent):
+        self.kind,self.start,self.end,self.indent,self.parent=kind,start,end,indent,parent
+
+    def __repr__(self):
+        return "Block(%r,%s,%s,%s)" % (self.kind,self.start,self.end,self.indent)
+
+def block_kind(line):
+    """Gets the kind of block a (dedented) line is the header of (None if it's not a header)"""
+    if line.rstrip().endswith(":"):
+        for kind in Block.kinds:
+            if line.startswith(kind) and line[len(kind):len(kind)+1] in " :(":
+                return kind
+    return None
+
+def block_tree(lines):
     """
-    returns a list of tuples (start_lineno,end_lineno) for the loop 
-    positions in the source code that encapsulate the current lineno
+    Gets the innermost block (see Block) of each of the cleaned source 
+    lines (None if it's not in one) as a tuple where the enclosing blocks
+    of a line are then its innermost block followed by its parents
+
+    Note: the header of a block is in its parent (e.g. not in itself) and 
+    the first line of its body is in it so the block of the header at 
+    index is the innermost block of index+1
+    """
+    innermost,stack=[],[]
+    for index,line in enumerate(lines):
+        indent=get_indent(line)
+        while stack and indent <= stack[-1].indent:
+            stack.pop().end=index
+        innermost+=[stack[-1] if stack else None]
+        kind=block_kind(line[indent:])
+        if kind:
+            stack+=[Block(kind,index,None,indent,innermost[-1])]
+    for block in stack:
+        block.end=len(lines)
+    return tuple(innermost)
+
+def get_loops(index,blocks):
+    """
+    returns a list of the loops (see Block) that the line at index is
+    in the body of (outermost first) via the block tree (see block_tree)
     """
-    ## get the outer loops that contian the current lineno ##
     loops=[]
-    ## jump_positions are in the form (start_lineno,end_lineno) ##
-    for pos in jump_positions: ## importantly we go from start to finish to capture nesting loops ##
-        ## make sure the lineno is contained within the position for a ##
-        ## loop adjustment and because the jump positions are ordered we ##
-        ## can also break when the start lineno is beyond the current lineno ##
-        if lineno < pos[0]:
-            break
-        if lineno < pos[1]:
-            loops+=[pos]
-    return loops
-######################
-### expr_getsource ###
-######################
+    if 0 <= index < len(blocks):
+        block=blocks[index]
+        while block:
+            if block.kind in Block.loops:
+                loops+=[block]
+            block=block.parent
+    return loops[::-1]
+
+def yield_indexes(lines,blocks):
+    """
+    Gets the indexes of the yields of the cleaned source lines e.g. the returns 
+    that aren't preceded by closing the generator (see batch_adjust) nor in 
+    a definition (see block_tree) in the order they're in the source code
+    """
+    indexes,prev=[],""
+    for index,line in enumerate(lines):
+        temp_line=line[get_indent(line):]
+        if (temp_line=="return" or temp_line.startswith("return ")) and prev!=close_line:
+            block=blocks[index]
+            while block and not block.kind in ("def","async def","class"):
+                block=block.parent
+            if block is None:
+                indexes+=[index]
+        prev=temp_line
+    return tuple(indexes)
+
+def batch_adjust(lines):
+    """
+    adjusts the lines of a state so that its yields (e.g. the returns 
+    that aren't preceded by closing the generator) push their value 
+    to a buffer via __push__ and only return once it's full
+    """
+    new_lines,definition,prev=[],None,""
+    for line in lines:
+        indent=get_indent(line)
+        temp_line=line[indent:]
+        ## skip definition blocks since their returns are their own ##
+        if definition is not None and indent > definition:
+            new_lines+=[line]
+            continue
+        definition=None
+        if temp_line.startswith("def ") or temp_line.startswith("async def ") or temp_line.startswith("class ") or temp_line.startswith("@"):
+            definition=indent
+        elif (temp_line=="return" or temp_line.startswith("return ")) and prev!=close_line:
+            line=" "*indent+"if __push__((%s)): return" % (temp_line[7:] or "None")
+        new_lines+=[line]
+        prev=temp_line
+    return new_lines
+
+def state_args(f_locals,code_obj,start):
+    """
+    Gets the arguements of a next_state function after its first start 
+    arguements (see Generator.init) e.g. the hidden (dotted) names of the
+    locals as a dict followed by the values of the rest by position
+
+    Note: binding n locals as keyword arguements costs O(n) per name in
+    cpython (more so for the names that go into **kwargs) e.g. O(n^2) per
+    step whereas passing them by position is O(n)
+    """
+    hidden=dict(f_locals)
+    args=[hidden]
+    ## what's left are the hidden names ##
+    for name in code_obj.co_varnames[start+1:code_obj.co_argcount]:
+        args.append(hidden.pop(name))
+    return args
+
+## the helpers the source code of the states use (see compile_state) ##
+## e.g. a global of the generator function with one of these names is shadowed in its states ##
+state_helpers=("currentframe","_getframe","track_iter","track_aiter","decref")
+
+def compile_state(source):
+    """
+    compiles the source code of a state returning the code object of its next_state function
+
+    Note: next_state is compiled within a function taking the state_helpers
+    so that they're its free variables rather than globals e.g. it can be
+    ran with the globals of the generator function (see state_function)
+    """
+    ## next_state is indented by 1 so that its body doesn't have to be reindented ##
+    source="def helpers(%s):\n " % ",".join(state_helpers)+source
+    ## the compiled module only defines helpers and helpers only defines next_state ##
+    for const in compile(source,"<string>","exec").co_consts:
+        if hasattr(const,"co_name") and const.co_name=="helpers":
+            for const in const.co_consts:
+                if hasattr(const,"co_name") and const.co_name=="next_state":
+                    ## -1 for the line of helpers ##
+                    return const.replace(co_firstlineno=const.co_firstlineno-1)
+
+def state_function(code_obj,module_name):
+    """
+    Creates the next_state function of a compiled state with the globals 
+    of the module (the module's name given) the generator function is in
+    (i.e. this module's globals if it's not imported)
+
+    Note: the state_helpers it uses are given as its closure
+    """
+    module=modules.get(module_name)
+    closure=tuple(map(state_cells.__getitem__,code_obj.co_freevars)) or None
+    return FunctionType(code_obj,module.__dict__ if module else globals(),code_obj.co_name,None,closure)
+#######################
+### ast adjustments ###
+#######################
+def function_body(source):
+    """Gets the body of the first function definition in the source code as ast nodes"""
+    if source[:1].isspace(): ## i.e. methods are indented ##
+        source="if 1:\n"+source
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node,(ast.FunctionDef,ast.AsyncFunctionDef)):
+            return node.body
+    raise SyntaxError("Unexpected format encountered")
+
+def source_segment(node,source_lines=None):
+    """
+    Gets the source code of an ast node from the source lines it was 
+    parsed from if it's on a single line (ast.unparse otherwise)
+
+    Note: slicing the line is much faster than unparsing the node. The 
+    col offsets are of the utf-8 encoded line
+    """
+    if source_lines is not None and node.lineno==node.end_lineno:
+        line=source_lines[node.lineno-1]
+        if line.isascii():
+            return line[node.col_offset:node.end_col_offset]
+        return line.encode()[node.col_offset:node.end_col_offset].decode()
+    return ast.unparse(node)
+
+def assignment_source(node,value,source_lines=None):
+    """Gets the source code of an assignment ast node with the source code value as its value"""
+    if isinstance(node,ast.Assign):
+        return "".join(source_segment(target,source_lines)+" = " for target in node.targets)+value
+    node.value=ast.Name(id=value,ctx=ast.Load())
+    return ast.unparse(node)
+
+def ast_statement_adjust(node,indent,source_lines=None):
+    """The same adjustments as Generator._custom_adjustment but on a simple statements ast node"""
+    if isinstance(node,ast.Return):
+        ## close the generator then return ##
+        return [indent+close_line,indent+source_segment(node,source_lines)]
+    value=getattr(node,"value",None)
+    if isinstance(value,ast.Yield):
+        line=indent+"return"
+        if value.value:
+            line+=" "+source_segment(value.value,source_lines)
+        if isinstance(node,ast.Expr):
+            return [line]
+        ## handles the .send method (the assignment gets the sent value instead) ##
+        return [line,indent+assignment_source(node,"__hidden__['.send']",source_lines)]
+    if isinstance(value,ast.YieldFrom):
+        expr=source_segment(value.value,source_lines)
+        if isinstance(node,ast.Expr):
+            return yield_from_adjust(indent,expr)
+        return yield_from_adjust(indent,expr,assignment_source(node,"",source_lines))
+    return [indent+source_segment(node,source_lines)]
+
+def ast_block_adjust(body,lines,jump_positions,indent=4,source_lines=None):
+    """
+    Adds a block of statements to lines as one statement per line
+    (compound statements have their body indented on the lines after)
+    recording the (lineno,end_lineno) of the loops in jump_positions
+
+    Note: the source lines (if given) are the lines the nodes were parsed
+    from so that the code of a node can be taken from them as is
+    """
+    prefix=" "*indent
+    for node in body:
+        if isinstance(node,(ast.For,ast.AsyncFor,ast.While)):
+            pos=[len(lines)+1,None] ## has to be a list since we're assigning ##
+            jump_positions+=[pos]
+            if isinstance(node,ast.While):
+                lines+=[prefix+"while %s:" % source_segment(node.test,source_lines)]
+            else:
+                lines+=[prefix+"%sfor %s in %s:" % ("async " if isinstance(node,ast.AsyncFor) else "",
+                                                      source_segment(node.target,source_lines),source_segment(node.iter,source_lines))]
+            ast_block_adjust(node.body,lines,jump_positions,indent+4,source_lines)
+            pos[1]=len(lines)+1 ## +1 assuming exclusion slicing on the stop index ##
+            ast_else_adjust(node.orelse,lines,jump_positions,indent,source_lines)
+        elif isinstance(node,ast.If):
+            lines+=[prefix+"if %s:" % source_segment(node.test,source_lines)]
+            ast_block_adjust(node.body,lines,jump_positions,indent+4,source_lines)
+            ## elif chains are nested as the only statement in the orelse ##
+            while len(node.orelse)==1 and isinstance(node.orelse[0],ast.If):
+                node=node.orelse[0]
+                lines+=[prefix+"elif %s:" % source_segment(node.test,source_lines)]
+                ast_block_adjust(node.body,lines,jump_positions,indent+4,source_lines)
+            ast_else_adjust(node.orelse,lines,jump_positions,indent,source_lines)
+        elif isinstance(node,(ast.With,ast.AsyncWith)):
+            lines+=[prefix+"%swith %s:" % ("async " if isinstance(node,ast.AsyncWith) else "",
+                                            ", ".join(ast.unparse(item) for item in node.items))]
+            ast_block_adjust(node.body,lines,jump_positions,indent+4,source_lines)
+        elif isinstance(node,ast.Try) or type(node).__name__=="TryStar": ## TryStar was introduced in python 3.11 ##
+            lines+=[prefix+"try:"]
+            ast_block_adjust(node.body,lines,jump_positions,indent+4,source_lines)
+            keyword="except*" if type(node).__name__=="TryStar" else "except"
+            for handler in node.handlers:
+                line=prefix+keyword
+                if handler.type:
+                    line+=" "+source_segment(handler.type,source_lines)
+                    if handler.name:
+                        line+=" as "+handler.name
+                lines+=[line+":"]
+                ast_block_adjust(handler.body,lines,jump_positions,indent+4,source_lines)
+            ast_else_adjust(node.orelse,lines,jump_positions,indent,source_lines)
+            if node.finalbody:
+                lines+=[prefix+"finally:"]
+                ast_block_adjust(node.finalbody,lines,jump_positions,indent+4,source_lines)
+        elif type(node).__name__=="Match": ## match case was introduced in python 3.10 ##
+            lines+=[prefix+"match %s:" % source_segment(node.subject,source_lines)]
+            for case in node.cases:
+                line=prefix+"    case "+source_segment(case.pattern,source_lines)
+                if case.guard:
+                    line+=" if "+source_segment(case.guard,source_lines)
+                lines+=[line+":"]
+                ast_block_adjust(case.body,lines,jump_positions,indent+8,source_lines)
+        ## definitions are not adjusted ##
+        elif isinstance(node,(ast.FunctionDef,ast.AsyncFunctionDef,ast.ClassDef)):
+            if node.decorator_list: ## i.e. the decorators are on the lines before node.lineno ##
+                lines+=indent_lines(ast.unparse(node).split("\n"),indent)
+            else:
+                lines+=indent_lines(source_segment(node,source_lines).split("\n"),indent)
+        else:
+            adjusted=ast_statement_adjust(node,prefix,source_lines)
+            if isinstance(getattr(node,"value",None),ast.YieldFrom):
+                ## the for loop of the yield from (see yield_from_adjust) ##
+                jump_positions+=[[len(lines)+2,len(lines)+len(adjusted)+1]]
+            lines+=adjusted
+    return lines
+
+def ast_else_adjust(orelse,lines,jump_positions,indent,source_lines=None):
+    """Adds an else block (if there is one) to lines"""
+    if orelse:
+        lines+=[" "*indent+"else:"]
+        ast_block_adjust(orelse,lines,jump_positions,indent+4,source_lines)
+
 def code_attrs():
     """
     all the attrs used by a CodeType object in 
@@ -389,7 +773,7 @@ def code_attrs():
         attrs+=("co_posonlyargcount",)
     attrs+=("co_kwonlyargcount","co_nlocals","co_stacksize","co_flags","co_code",
             "co_consts", "co_names", "co_varnames", "co_filename", "co_name")
-    if (3,3) <= version_info:
+    if (3,11) <= version_info:
         attrs+=("co_qualname",)
     attrs+=("co_firstlineno",)
     if (3,10) <= version_info:
@@ -422,11 +806,130 @@ def getframe(obj):
             return getattr(obj,attr)
     raise AttributeError("frame object not found")
 
+def code_span(code_obj):
+    """
+    Gets the widest non-empty span of a code objects positions (3.11+) e.g. 
+    (lineno,col_offset,end_lineno,end_col_offset) where the columns are utf-8
+    byte offsets (as with ast); for a lambda it's its body and for a generator
+    expression it's the whole expression
+    """
+    positions=[pos for pos in code_obj.co_positions() if not None in pos and (pos[0],pos[2])!=(pos[1],pos[3])]
+    start=min((pos[0],pos[2]) for pos in positions)
+    end=max((pos[1],pos[3]) for pos in positions)
+    return start+end
+
+def yield_offsets(code_obj):
+    """
+    Gets the ordinal of each yield instruction of a generators code object 
+    by its offset where the ordinals are in the order the yields are in the 
+    source code (e.g. the copies of a yield in a finally block share one)
+
+    Note: before python 3.11 a frame suspended in a yield from is left at
+    the instruction before its YIELD_FROM so that offset is included too
+    """
+    positions,line,rank={},None,0
+    for instruction in get_instructions(code_obj):
+        if instruction.starts_line:
+            line,rank=instruction.starts_line,0
+        if instruction.opname in ("YIELD_VALUE","YIELD_FROM"):
+            ## the end positions since a yield ends before the yield it's in (e.g. yield (yield)) ##
+            position=getattr(instruction,"positions",None)
+            if position and position.end_lineno is not None:
+                key=(position.end_lineno,position.end_col_offset)
+            else:
+                key,rank=(line,rank),rank+1
+            positions[instruction.offset]=key
+            if instruction.opname=="YIELD_FROM":
+                positions[instruction.offset-2]=key
+    ordinals=dict((key,ordinal) for ordinal,key in enumerate(sorted(set(positions.values()))))
+    return dict((offset,ordinals[key]) for offset,key in positions.items())
+
+def expr_consts(node):
+    """
+    Gets the reprs of the constants a lambda or generator expression's own
+    code object is compiled with (nested scopes and the first iterable of 
+    a generator expression belong to other code objects)
+    """
+    if isinstance(node,ast.Lambda):
+        nodes=[node.body]
+    else:
+        nodes=[node.elt,node.generators[0].target]+node.generators[0].ifs+node.generators[1:]
+    consts=set()
+    while nodes:
+        child=nodes.pop()
+        if isinstance(child,ast.Constant):
+            consts.add(repr(child.value))
+        elif not isinstance(child,(ast.Lambda,ast.GeneratorExp,ast.ListComp,ast.SetComp,ast.DictComp)):
+            nodes+=ast.iter_child_nodes(child)
+    return consts
+
+def source_index(filename):
+    """
+    Gets the index of the lambdas and generator expressions in a source file 
+    e.g. {(lineno,co_name):[(source,consts,span)]} (see expr_consts and code_span)
+
+    Note: the file is only parsed once per modification (cached by filename and mtime)
+    """
+    entry=sources.get(filename)
+    if entry:
+        key=(filename,"registry",entry[1])
+    else:
+        try:
+            key=(filename,os.stat(filename).st_mtime)
+        except OSError: ## i.e. only in the linecache e.g. an interactive session ##
+            key=(filename,None)
+    index=index_cache.get(key)
+    if index is None:
+        if entry:
+            lines=entry[0]
+        else:
+            linecache.checkcache(filename)
+            lines=linecache.getlines(filename)
+        source,index="".join(lines),{}
+        for node in ast.walk(ast.parse(source)):
+            if isinstance(node,ast.Lambda):
+                span=node.body
+                entry=index.setdefault((node.lineno,"<lambda>"),[])
+            elif isinstance(node,ast.GeneratorExp):
+                span=node
+                entry=index.setdefault((node.lineno,"<genexpr>"),[])
+            else:
+                continue
+            entry+=[(ast.get_source_segment(source,node),expr_consts(node),
+                     (span.lineno,span.col_offset,span.end_lineno,span.end_col_offset))]
+        index_cache.set(key,index)
+    return index
+
+class SourceNotFoundError(ValueError):
+    """Raised when the source code of a lambda or generator expression can't be found"""
+    pass
+
 def expr_getsource(FUNC):
     """
-    Uses co_positions or otherwise goes through the source code 
-    extracting expressions until a match is found on a code object 
-    basis to get the source
+    Gets the source code of a lambda or generator expression from the
+    index of its file (see source_index) by its first line and name and
+    if there's more than one there by its span (3.11+) or its constants
+    """
+    code_obj=getcode(FUNC)
+    if version_info < (3,8): ## i.e. ast has no end positions ##
+        return eval_getsource(FUNC)
+    matches=source_index(code_obj.co_filename).get((code_obj.co_firstlineno,code_obj.co_name),[])
+    if len(matches) > 1:
+        if (3,11) <= version_info:
+            span=code_span(code_obj)
+            matches=[match for match in matches if match[2]==span]
+        else:
+            consts=set(repr(const) for const in code_obj.co_consts if not hasattr(const,"co_code"))
+            ## the one with the most constants in common in case the others' are a subset ##
+            matches=sorted((match for match in matches if match[1] <= consts),key=lambda match:-len(match[1]))
+    if not matches:
+        raise SourceNotFoundError("No matches to the original source code found")
+    return matches[0][0]
+
+def eval_getsource(FUNC):
+    """
+    Goes through the source code extracting expressions until
+    a match is found on a code object basis to get the source
 
     Note:
     the extractor should return a string and if using a 
@@ -437,33 +940,14 @@ def expr_getsource(FUNC):
     code_obj=getcode(FUNC)
     if code_obj.co_name=="<lambda>":
         ## here source is a : str
-        source=getsource(code_obj)
+        source=sources.getsource(code_obj)
         extractor=extract_lambda
     else:
         lineno=getframe(FUNC).f_lineno-1
         ## here source is a : list[str]
-        source=findsource(code_obj)[0][lineno:]
+        source=sources.getlines(code_obj.co_filename)[lineno:]
         extractor=extract_genexpr
-    ## get the rest of the source ##
-    if (3,11) <= version_info:
-        # start_line, end_line, start_col, end_col
-        positions=code_obj.co_positions()
-        is_source_list=isinstance(source,list)
-        pos=next(positions,(None,None,None))[1:]
-        current_min,current_max=pos[2:]
-        if is_source_list:
-            current_max_lineno=pos[1]
-        for pos in positions:
-            if pos[-2] and pos[-2] < current_min:
-                current_min=pos[-2]
-            if pos[-1] and pos[-1] > current_max:
-                current_min=pos[-1]
-            if is_source_list and pos[1] and pos[1] > current_max_lineno:
-                current_max_lineno=pos[1]
-        if is_source_list:
-            source="\n".join(source[:current_max_lineno+1])
-        return source[current_min:current_max]
-    ## otherwise match with generator expressions in the original source to get the source code ##
+    ## match with the expressions in the original source to get the source code ##
     attrs=(attr for attr in code_attrs() if not attr in ('co_argcount','co_posonlyargcount','co_kwonlyargcount',
                                                          'co_filename','co_linetable','co_lnotab','co_exceptiontable'))
     for source in extractor(source):
@@ -473,7 +957,7 @@ def expr_getsource(FUNC):
                 return source
         except:
             pass
-    raise Exception("No matches to the original source code found")
+    raise SourceNotFoundError("No matches to the original source code found")
 ###############
 ### genexpr ###
 ###############
@@ -483,7 +967,7 @@ def extract_genexpr(source_lines):
     for line in source_lines:
         ## if it's a new_line and you're looking for the next genexpr then it's not found ##
         if number_of_expressions:
-            raise Exception("No matches to the original source code found")
+            raise SourceNotFoundError("No matches to the original source code found")
         line=enumerate(line)
         for index,char in line:
             ## skip all strings if not in depth
@@ -568,6 +1052,63 @@ def unpack_genexpr(source):
            [indent*(index)+line for index,line in enumerate(if_blocks,start=len(lines)+1)]+\
            [indent*(index)+'decref(".%s")' % (index-1) for index in range(len(lines),1,-1)]
            ## we don't need to do '.0' here since it will be the end of the function e.g. it'll get garbage collected
+
+def is_genexpr(FUNC):
+    """Checks if FUNC is a generator expression (and not i.e. a generator function or its generator)"""
+    return getattr(getattr(FUNC,"gi_code",None),"co_name",None)=="<genexpr>"
+
+def genexpr_node(source):
+    """Gets the ast node of the source code of a generator expression"""
+    node=ast.parse(source.strip(),mode="eval").body
+    if not isinstance(node,ast.GeneratorExp):
+        raise TypeError("'%s' is not a generator expression" % source)
+    for child in ast.walk(node):
+        if isinstance(child,ast.Await) or getattr(child,"is_async",False):
+            raise NotImplementedError("asynchronous generator expressions are not supported")
+    return node
+
+def genexpr_lines(source):
+    """
+    Gets the body of a function that runs a generator expression
+    from its iterators (one per for clause) held in __iters__
+
+    i.e. (x*y for x in a if x for y in b) becomes:
+
+        if not __iters__:
+            __iters__.append(iter(a))
+        if len(__iters__) > 1:
+            for y in __iters__[1]:
+                yield (x*y)
+            __iters__.pop()
+        for x in __iters__[0]:
+            if (x):
+                __iters__.append(iter(b))
+                for y in __iters__[1]:
+                    yield (x*y)
+                __iters__.pop()
+        __iters__.pop()
+
+    Since it only yields from its innermost for clause, wherever it's
+    suspended every clause has an iterator (and every target is bound)
+    so the iterators that are given get finished before any new ones
+    """
+    node=genexpr_node(source)
+    clauses,indent=node.generators," "*4
+    def loop(depth,indent):
+        clause,inner=clauses[depth],indent+" "*4
+        lines=[indent+"for %s in __iters__[%s]:" % (ast.unparse(clause.target),depth)]
+        if clause.ifs:
+            lines+=[inner+"if %s:" % " and ".join("(%s)" % ast.unparse(test) for test in clause.ifs)]
+            inner+=" "*4
+        if depth+1 < len(clauses):
+            lines+=[inner+"__iters__.append(iter(%s))" % ast.unparse(clauses[depth+1].iter)]+loop(depth+1,inner)
+        else:
+            lines+=[inner+"yield (%s)" % ast.unparse(node.elt)]
+        return lines+[indent+"__iters__.pop()"]
+    lines=[indent+"if not __iters__:",indent*2+"__iters__.append(iter(%s))" % ast.unparse(clauses[0].iter)]
+    for depth in range(len(clauses)-1,0,-1):
+        lines+=[indent+"if len(__iters__) > %s:" % depth]+loop(depth,indent*2)
+    return lines+loop(0,indent)
 ##############
 ### lambda ###
 ##############
@@ -613,22 +1154,644 @@ def extract_lambda(source_code):
     ## in case of a current match ending ##
     if is_lambda:
         yield source
+
+def lambda_definition(source):
+    """
+    Rewrites the source code of a lambda as a function definition so
+    that it gets cleaned like any other generator function e.g.
+    'lambda x: (yield x)' becomes 'def _lambda(x): yield x' (on two lines)
+    """
+    node=ast.parse(source.strip(),mode="eval").body
+    body=node.body
+    if isinstance(body,ast.YieldFrom):
+        line="yield from %s" % ast.unparse(body.value)
+    elif isinstance(body,ast.Yield):
+        line="yield %s" % (None if body.value is None else ast.unparse(body.value))
+    else:
+        line="return %s" % ast.unparse(body)
+    return "def _lambda(%s):\n    %s\n" % (ast.unparse(node.args),line)
+################
+### bytecode ###
+################
+class Null(object):
+    """Represents a NULL entry on a frames value stack (copied and pickled as the NULL singleton)"""
+    def __reduce__(self):
+        return "NULL"
+
+NULL=Null()
+
+## the frame layout read and the bytecode written here are CPython 3.11's ##
+cpython=python_implementation()=="CPython"
+cpython_311=version_info[:2]==(3,11) and cpython
+
+def code_key(code_obj):
+    """Gets a hashable key identifying a code object (or code wrapper) by its attrs"""
+    return (code_obj.co_filename,code_obj.co_name,code_obj.co_firstlineno,code_obj.co_code,
+            code_obj.co_consts,code_obj.co_names,code_obj.co_varnames)
+
+def local_names(code_obj):
+    """
+    Gets the names of the local variables (including cell variables) 
+    in the order they're stored in the frame (CPython 3.11)
+    """
+    return code_obj.co_varnames+tuple(name for name in code_obj.co_cellvars if not name in code_obj.co_varnames)
+
+def async_generator_created(native):
+    """Checks if a native async generator hasn't been started"""
+    if native.ag_frame is None or native.ag_running:
+        return False
+    ## inspect.getasyncgenstate was introduced in python 3.12 ##
+    if "RETURN_GENERATOR" in opmap: ## i.e. python 3.11+ ##
+        return native.ag_frame.f_lasti==start_lasti(native.ag_code)
+    return native.ag_frame.f_lasti < 0
+
+def start_lasti(code_obj):
+    """Gets the offset of the RETURN_GENERATOR instruction e.g. where an unstarted generator is"""
+    co_code=code_obj.co_code
+    for index in range(0,len(co_code),2):
+        if co_code[index]==opmap["RETURN_GENERATOR"]:
+            return index
+    raise TypeError("code object is not a generator")
+
+def emit(opname,arg=0):
+    """Gets the bytecode for an instruction (with EXTENDED_ARGs if needed)"""
+    instruction=bytes((opmap[opname],arg & 255))
+    arg>>=8
+    while arg:
+        instruction=bytes((opmap["EXTENDED_ARG"],arg & 255))+instruction
+        arg>>=8
+    return instruction
+
+def varint(value):
+    """Encodes a value as a varint of 6 bit chunks as used in exception tables"""
+    chunks=[value & 63]
+    value>>=6
+    while value:
+        chunks+=[64 | (value & 63)]
+        value>>=6
+    return chunks[::-1]
+
+def shift_exception_table(exceptiontable,n):
+    """
+    Shifts the start and target offsets (in code units) of 
+    every entry of an exception table by n code units
+    """
+    entries,entry,value=[],[],0
+    for byte in exceptiontable:
+        value=(value << 6) | (byte & 63)
+        if not byte & 64: ## end of the varint ##
+            entry+=[value]
+            value=0
+            if len(entry)==4: ## start, length, target, depth_lasti ##
+                entries+=[entry]
+                entry=[]
+    new_table=[]
+    for start,length,target,depth_lasti in entries:
+        start=varint(start+n)
+        start[0]|=128 ## marks the start of an entry ##
+        new_table+=start+varint(length)+varint(target+n)+varint(depth_lasti)
+    return bytes(new_table)
+
+def resume_code(code_obj,lasti,unbound=(),stack=0,nulls=()):
+    """
+    Creates a generator code object that resumes code_obj from 
+    after the instruction at lasti (e.g. a YIELD_VALUE) (CPython 3.11)
+
+    It works by prepending a prologue to the original bytecode 
+    that takes every local variable as a positional arguement
+    followed by the sent value and the value stack items to restore:
+
+    1. makes the cells and copies the free variables
+    2. deletes the unbound locals
+    3. pushes the value stack items (NULLs are at the indexes in nulls)
+    4. returns the generator
+    5. pushes the sent value and jumps to after lasti
+
+    returns the code object and the length of the prologue in bytes
+    """
+    if not cpython_311:
+        raise NotImplementedError("resume_code is only implemented for CPython 3.11")
+    names=local_names(code_obj)
+    hidden=(".send",)+tuple(".stack%s" % index for index in range(stack) if not index in nulls)
+    varnames=names+hidden
+    ## free variables come after the locals in the frame so they get shifted along ##
+    co_code,free_start,extended=bytearray(code_obj.co_code),len(names),0
+    for index in range(0,len(co_code),2):
+        if co_code[index] in hasfree and (extended << 8 | co_code[index+1]) >= free_start:
+            if extended or co_code[index+1]+len(hidden) > 255:
+                raise NotImplementedError("too many local variables to resume from bytecode")
+            co_code[index+1]+=len(hidden)
+        extended=co_code[index+1] if co_code[index]==opmap["EXTENDED_ARG"] else 0
+    start=start_lasti(code_obj)
+    prologue=bytes(co_code[:start]) ## COPY_FREE_VARS and MAKE_CELL ##
+    for name in unbound:
+        prologue+=emit("DELETE_DEREF" if name in code_obj.co_cellvars else "DELETE_FAST",varnames.index(name))
+    for index in range(stack):
+        if index in nulls:
+            prologue+=emit("PUSH_NULL")
+        else:
+            prologue+=emit("LOAD_FAST",varnames.index(".stack%s" % index))
+    for name in hidden[1:]:
+        prologue+=emit("DELETE_FAST",varnames.index(name))
+    prologue+=emit("RETURN_GENERATOR")+emit("POP_TOP")+\
+              emit("LOAD_FAST",len(names))+emit("DELETE_FAST",len(names))
+    ## relative to the instruction after the jump which is where the original bytecode starts ##
+    prologue+=emit("JUMP_FORWARD",(lasti+2)//2)
+    units=len(prologue)//2
+    ## the prologue has no line numbers (code 15) in chunks of at most 8 code units ##
+    linetable=bytes(0xF8 | (min(8,units-index)-1) for index in range(0,units,8))
+    return code_obj.replace(co_code=prologue+bytes(co_code),co_argcount=len(varnames),co_posonlyargcount=0,
+                            co_kwonlyargcount=0,co_nlocals=len(varnames),co_varnames=varnames,
+                            co_flags=code_obj.co_flags & ~0x0C, ## no *args or **kwargs ##
+                            co_linetable=linetable+code_obj.co_linetable,
+                            co_exceptiontable=shift_exception_table(code_obj.co_exceptiontable,units)),len(prologue)
+
+def frame_stack(frame_obj):
+    """
+    Gets the value stack of a suspended frame (CPython 3.11)
+
+    The frame object holds a pointer to its _PyInterpreterFrame after 
+    its PyObject_HEAD and f_back; the _PyInterpreterFrame has 8 pointers 
+    then the stacktop (the number of localsplus entries including the 
+    stack) followed by the localsplus array at the next 8 byte boundary
+    """
+    ## checked here since reading another layout could crash the interpreter ##
+    if not cpython_311:
+        raise NotImplementedError("frame_stack is only implemented for CPython 3.11")
+    size=ctypes.sizeof(ctypes.c_void_p)
+    interpreter_frame=ctypes.c_void_p.from_address(id(frame_obj)+3*size).value
+    stacktop=ctypes.c_int.from_address(interpreter_frame+8*size).value
+    localsplus=interpreter_frame+8*size+8
+    code_obj,stack=frame_obj.f_code,[]
+    for index in range(len(local_names(code_obj))+len(code_obj.co_freevars),stacktop):
+        address=ctypes.c_void_p.from_address(localsplus+index*size).value
+        stack+=[ctypes.cast(address,ctypes.py_object).value if address else NULL]
+    return tuple(stack)
+###############
+### caching ###
+###############
+class Cache(object):
+    """
+    A thread-safe least recently used cache bounded by its number 
+    of entries (maxsize) and/or their total size in bytes (maxbytes)
+
+    Note: the size of an entry is determined by the sizeof function 
+    given (it defaults to 0 e.g. only the number of entries is bounded).
+    A bound of None means it's unbounded
+    """
+    def __init__(self,maxsize=None,maxbytes=None,sizeof=None):
+        self.maxsize,self.maxbytes,self.sizeof=maxsize,maxbytes,sizeof
+        self.hits,self.misses,self.nbytes=0,0,0
+        self._entries,self._lock=OrderedDict(),Lock()
+
+    def get(self,key,default=None):
+        """Gets the value for key marking it as the most recently used"""
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is not None:
+                self.hits+=1
+                self._entries.move_to_end(key)
+                return entry[0]
+            self.misses+=1
+            return default
+
+    def set(self,key,value):
+        """Sets the value for key evicting the least recently used entries if out of bounds"""
+        size=self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._entries:
+                self.nbytes-=self._entries.pop(key)[1]
+            self._entries[key]=(value,size)
+            self.nbytes+=size
+            self._evict()
+
+    def _evict(self):
+        """evicts the least recently used entries until within bounds (assumes the lock is held)"""
+        while self._entries and ((self.maxsize is not None and len(self._entries) > self.maxsize) or\
+                                 (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            self.nbytes-=self._entries.popitem(last=False)[1][1]
+
+    def resize(self,maxsize=None,maxbytes=None):
+        """Sets new bounds on the cache evicting any entries out of bounds"""
+        with self._lock:
+            self.maxsize,self.maxbytes=maxsize,maxbytes
+            self._evict()
+
+    def clear(self):
+        """Removes all entries and resets the hit/miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits,self.misses,self.nbytes=0,0,0
+
+    def info(self):
+        """Gets the current statistics of the cache"""
+        with self._lock:
+            return {"hits":self.hits,"misses":self.misses,"entries":len(self._entries),
+                    "bytes":self.nbytes,"maxsize":self.maxsize,"maxbytes":self.maxbytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self,key):
+        return key in self._entries
+
+def state_sizeof(entry):
+    """Gets the size in bytes of a state cache entry e.g. its source and compiled code"""
+    return len(marshal.dumps(entry))
+
+## process-wide cache of the compiled states keyed by (engine,source,lineno) ##
+## e.g. the states source code and therefore its compiled code are ##
+## fully determined by the generators source code and resume line ##
+state_cache=Cache(maxsize=4096,maxbytes=64*1024*1024,sizeof=state_sizeof)
+## process-wide cache of the transformed source e.g. (source,_source_lines,jump_positions,gi_code) ##
+## keyed by (co_filename,code object) or the source code string if initialized with a string ##
+source_cache=Cache(maxsize=1024)
+## code objects -> code (wrappers) e.g. one code record is shared per code object ##
+code_cache=Cache(maxsize=1024)
+## (filename,mtime) -> the index of its lambdas and generator expressions (see source_index) ##
+index_cache=Cache(maxsize=256)
+## (engine,source) -> the block tree of its transformed source lines (see block_tree) ##
+block_cache=Cache(maxsize=1024)
+## (engine,source) -> the lineno to resume from at each yields f_lasti (see Generator._adopt) ##
+lasti_cache=Cache(maxsize=1024)
+
+def code_record(code_obj):
+    """Gets the code wrapper of a code object (shared by everything that wraps the same code object)"""
+    record=code_cache.get(code_obj)
+    if record is None:
+        record=code(code_obj)
+        code_cache.set(code_obj,record)
+    return record
+
+class DiskCache(object):
+    """
+    An opt-in on-disk cache (like __pycache__) of the transformed 
+    source code and compiled states of generators so that new 
+    processes can load them with a single read of a marshal file
+
+    There's one file per (engine,source) named after the hash of 
+    them and tagged with the python implementation/version and the
+    version of this module; files with a different tag are stale 
+    and get removed on prune
+
+    The compiled states are appended to the file as they're added
+    (after the record of the transformed source code) so that adding
+    a state doesn't rewrite the states before it. A record is only
+    written if there's no file for it yet (it's the same in every 
+    process) so that the file's never replaced while another process
+    appends to it
+
+    It's disabled until it has a directory (set via set_directory 
+    or the CUSTOM_GENERATOR_CACHE environment variable)
+    """
+    ## bumped when the compiled states change e.g. the arguements of next_state (see Generator.init) ##
+    states_version=3
+    ## sys.implementation was introduced in python 3.3 ##
+    if (3,3) <= version_info:
+        from sys import implementation
+        tag="%s-%s-%s" % (implementation.cache_tag,__version__,states_version)
+        del implementation
+    else:
+        tag="python-%s%s-%s-%s" % (version_info[0],version_info[1],__version__,states_version)
+    suffix=".marshal"
+
+    def __init__(self,directory=None):
+        self._records,self._lock={},Lock()
+        self.directory=None
+        if directory:
+            self.set_directory(directory)
+
+    def set_directory(self,directory):
+        """Sets the cache directory (None disables the cache)"""
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._lock:
+            self.directory=directory
+            self._records.clear()
+
+    def _path(self,engine,source):
+        """Gets the file path of a record"""
+        name=sha256(("%s\0%s" % (engine,source)).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory,"%s.%s%s" % (name,self.tag,self.suffix))
+
+    def load(self,engine,source):
+        """
+        Loads the (_source_lines,jump_positions) of the source code 
+        and adds its compiled states to the state cache
+
+        returns None if there's no record (or it's stale or corrupted)
+        """
+        if not self.directory:
+            return None
+        path=self._path(engine,source)
+        try:
+            with open(path,"rb") as file:
+                try:
+                    record=marshal.load(file)
+                    states=self._read_states(file)
+                except (EOFError,ValueError,TypeError): ## i.e. it's corrupted (records are never partially written) ##
+                    record=None
+        except (IOError,OSError):
+            return None
+        if not (isinstance(record,dict) and record.get("tag")==self.tag and record.get("source")==source):
+            self._remove(path)
+            return None
+        record["states"].update(states)
+        with self._lock:
+            self._records[(engine,source)]=record
+        for position,entry in record["states"].items():
+            state_cache.set((engine,source)+position,entry)
+        return record["lines"],record["jump_positions"]
+
+    def save(self,engine,source,lines,jump_positions):
+        """Saves the transformed source code (unless another process already has)"""
+        if self.directory:
+            record={"tag":self.tag,"engine":engine,"source":source,"lines":lines,
+                    "jump_positions":jump_positions,"states":{}}
+            with self._lock:
+                self._records[(engine,source)]=record
+                self._write(self._path(engine,source),record)
+
+    def add_state(self,engine,source,lineno,names,entry):
+        """Adds a compiled state to the record of the source code"""
+        if self.directory:
+            with self._lock:
+                record=self._records.get((engine,source))
+                if record is not None and not (lineno,names) in record["states"]:
+                    record["states"][(lineno,names)]=entry
+                    self._append(self._path(engine,source),((lineno,names),entry))
+
+    def _read_states(self,file):
+        """reads the states appended after the record (see add_state)"""
+        states={}
+        while True:
+            try:
+                position,entry=marshal.load(file)
+            except (EOFError,ValueError,TypeError): ## i.e. the end of the file or a partially written state ##
+                return states
+            states[position]=entry
+
+    def _write(self,path,record):
+        """
+        writes a record atomically if there's no file for it so that other 
+        processes never read a partial file nor lose the states they append
+
+        Note: the file is created by hard linking to a temporary file since
+        linking fails if the file exists whereas os.replace replaces it
+        """
+        descriptor,temp_path=mkstemp(dir=self.directory,suffix=".tmp")
+        try:
+            with os.fdopen(descriptor,"wb") as file:
+                marshal.dump(record,file)
+            os.link(temp_path,path)
+        except (IOError,OSError): ## i.e. it exists (or hard links aren't supported) ##
+            pass
+        self._remove(temp_path)
+
+    def _append(self,path,state):
+        """appends a state to a record in one write so that other processes only read whole states"""
+        try:
+            with open(path,"ab") as file:
+                file.write(marshal.dumps(state))
+        except (IOError,OSError):
+            pass
+
+    def _remove(self,path):
+        """removes a file if it exists"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """Removes the stale records e.g. those from other python or module versions"""
+        if self.directory:
+            current=".%s%s" % (self.tag,self.suffix)
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix) and not name.endswith(current):
+                    self._remove(os.path.join(self.directory,name))
+
+    def clear(self):
+        """Removes all the records"""
+        if self.directory:
+            with self._lock:
+                self._records.clear()
+                for name in os.listdir(self.directory):
+                    if name.endswith(self.suffix):
+                        self._remove(os.path.join(self.directory,name))
+
+## process-wide on-disk cache (disabled unless a directory is set) ##
+disk_cache=DiskCache(environ.get("CUSTOM_GENERATOR_CACHE"))
+#############
+### stats ###
+#############
+class Stats(object):
+    """
+    A thread-safe registry of runtime statistics recorded per generator
+    function (see Generator._stats_name) e.g. the number of steps, state
+    rebuilds, transformations and snapshots, the time spent on each and
+    the bytes pickled (by dump_many, checkpoint_delta and pickle.dumps)
+
+    Note: it's opt-in (via enable or the CUSTOM_GENERATOR_STATS environment
+    variable); when disabled the instrumented code only checks stats.enabled
+    """
+    fields=("steps","step_seconds","state_rebuilds","rebuild_seconds","compile_seconds","transforms",
+            "transform_seconds","snapshots","snapshot_seconds","pickled_bytes")
+
+    def __init__(self,enabled=False):
+        self.enabled=enabled
+        self._records,self._lock={},Lock()
+
+    def enable(self):
+        self.enabled=True
+
+    def disable(self):
+        self.enabled=False
+
+    def add(self,name,**values):
+        """Adds the values to the fields of the record of name"""
+        with self._lock:
+            record=self._records.get(name)
+            if record is None:
+                record=self._records[name]=dict.fromkeys(self.fields,0)
+            for field,value in values.items():
+                record[field]+=value
+
+    def get(self,name):
+        """Gets a copy of the record of name (all zeros if nothing's been recorded)"""
+        with self._lock:
+            return dict(self._records.get(name) or dict.fromkeys(self.fields,0))
+
+    def clear(self):
+        """Removes all the records"""
+        with self._lock:
+            self._records.clear()
+
+    def info(self):
+        """Gets a copy of all the records with their totals e.g. for exporting"""
+        with self._lock:
+            records=dict((name,dict(record)) for name,record in self._records.items())
+        totals=dict.fromkeys(self.fields,0)
+        for record in records.values():
+            for field,value in record.items():
+                totals[field]+=value
+        return {"enabled":self.enabled,"functions":records,"totals":totals}
+
+## process-wide stats (disabled unless enabled) ##
+stats=Stats(bool(environ.get("CUSTOM_GENERATOR_STATS")))
+## set while a reduction is pickled for the stats so the generators nested in it aren't counted twice ##
+measuring=local()
+###############
+### sources ###
+###############
+class SourceRegistry(object):
+    """
+    An in-memory registry of source files (filename -> lines) that's
+    used before falling back to inspect/linecache when getting the
+    source code of generator functions, lambdas and generator expressions
+    so that they can be wrapped without reading any files (or where
+    there are no files e.g. zipapps, exec'd strings or frozen bundles)
+
+    It's populated via add (e.g. for exec'd strings), register (a decorator
+    that adds the file of a function or module at import time) or load (a
+    bundle file written by dump or set via the CUSTOM_GENERATOR_SOURCES
+    environment variable)
+    """
+    def __init__(self,bundle=None):
+        self._files,self._version,self._lock={},0,Lock()
+        if bundle:
+            self.load(bundle)
+
+    def add(self,filename,source):
+        """Adds the source code of a file (replacing it if it's already been added)"""
+        lines=tuple(source.splitlines(True))
+        with self._lock:
+            ## the version is for anything cached from the previous lines (see source_index) ##
+            self._version+=1
+            self._files[filename]=(lines,self._version)
+
+    def register(self,obj):
+        """Adds the file of a function, code object or module e.g. as a decorator"""
+        if hasattr(obj,"__file__"): ## module ##
+            filename,module_globals=obj.__file__,obj.__dict__
+        else:
+            filename,module_globals=getcode(obj).co_filename,getattr(obj,"__globals__",None)
+        if not filename in self._files:
+            ## the module globals are for the loader e.g. of a zipapp ##
+            self.add(filename,"".join(linecache.getlines(filename,module_globals)))
+        return obj
+
+    def get(self,filename):
+        """Gets the (lines,version) of a file if it's been added"""
+        return self._files.get(filename)
+
+    def getlines(self,filename):
+        """Gets the lines of a file from the registry or otherwise the linecache"""
+        entry=self._files.get(filename)
+        if entry is None:
+            return linecache.getlines(filename)
+        return list(entry[0])
+
+    def getsource(self,obj):
+        """Gets the source code of a function (or its code object) as with inspect.getsource"""
+        code_obj=obj if isinstance(obj,CodeType) else getcode(obj)
+        entry=self._files.get(code_obj.co_filename)
+        if entry is None:
+            return getsource(obj)
+        return "".join(getblock(entry[0][code_obj.co_firstlineno-1:]))
+
+    def dump(self,path):
+        """Writes the registry to a bundle file"""
+        with self._lock:
+            files=dict((filename,"".join(lines)) for filename,(lines,version) in self._files.items())
+        with open(path,"wb") as file:
+            marshal.dump(files,file)
+
+    def load(self,path):
+        """Adds the files of a bundle file"""
+        with open(path,"rb") as file:
+            files=marshal.load(file)
+        for filename,source in files.items():
+            self.add(filename,source)
+
+    def clear(self):
+        """Removes all the files"""
+        with self._lock:
+            self._files.clear()
+
+    def __contains__(self,filename):
+        return filename in self._files
+
+## process-wide source registry (empty unless a bundle is given) ##
+sources=SourceRegistry(environ.get("CUSTOM_GENERATOR_SOURCES"))
 ########################
 ### pickling/copying ###
 ########################
+def source_hash(source):
+    """Gets a hash of the source code (str or bytes) that is stable across processes"""
+    if not isinstance(source,bytes):
+        source=source.encode("utf-8")
+    return sha256(source).hexdigest()[:16]
+
+def code_hash(code_obj):
+    """Gets a hash of a code object (or code wrapper) that is stable across processes"""
+    parts=[code_obj.co_code]
+    for const in code_obj.co_consts:
+        if hasattr(const,"co_code"):
+            const=code_hash(const)
+        elif isinstance(const,frozenset): ## the order of a set can change with the hash seed ##
+            const=sorted(repr(item) for item in const)
+        parts+=[repr(const).encode("utf-8")]
+    parts+=[repr((code_obj.co_names,code_obj.co_varnames,code_obj.co_freevars,code_obj.co_cellvars)).encode("utf-8")]
+    return source_hash(b"\0".join(parts))
+
+def load_compact(cls,reference,position,f_locals):
+    """
+    Rebuilds a Generator from a compact pickle e.g. by fetching 
+    (or transforming) the function from its reference and then
+    restoring the position and locals
+
+    Raises an UnpicklingError if the functions source code has 
+    changed since it was pickled
+    """
+    module,qualname,digest,engine=reference
+    if module is None: ## source code strings are their own reference ##
+        FUNC=qualname
+    else:
+        __import__(module)
+        FUNC=modules[module]
+        for name in qualname.split("."):
+            FUNC=getattr(FUNC,name)
+    ## the engine is set before initializing since not all Generator types take it as an arguement ##
+    self=cls.__new__(cls)
+    self.engine=engine
+    self.__init__(FUNC)
+    if module is not None and self._hash()!=digest:
+        raise UnpicklingError("the source code of '%s.%s' has changed since it was pickled" % (module,qualname))
+    self._restore(position,f_locals)
+    return self
+
 class Pickler(object):
-    """class for allowing general copying and pickling of some otherwise uncopyable or unpicklable objects"""
+    """
+    class for allowing general copying and pickling of some otherwise uncopyable or unpicklable objects
+
+    Note: subclasses use __slots__ (set to their _attrs) to avoid a __dict__ per instance
+    """
+    __slots__=()
     _not_allowed=tuple()
+    ## attrs that never change after initialization and are therefore shared by reference in copies ##
+    _shared=tuple()
     def _copier(self,FUNC):
         """copying will create a new generator object but the copier will determine it's depth"""
-        items=((attr,FUNC(getattr(self,attr))) for attr in self._attrs if hasattr(self,attr))
+        items=((attr,getattr(self,attr) if attr in self._shared else FUNC(getattr(self,attr)))
+               for attr in self._attrs if hasattr(self,attr))
         return type(self)(dict(items))
     ## for copying ##
     def __copy__(self):
         return self._copier(copy)
 
     def __deepcopy__(self,memo):
-        return self._copier(deepcopy)
+        return self._copier(lambda obj:deepcopy(obj,memo))
     ## for pickling ##
     def __getstate__(self):
         """Serializing pickle (what object you want serialized)"""
@@ -649,24 +1812,39 @@ class frame(Pickler):
     """
     _attrs=('f_back','f_code','f_lasti','f_lineno','f_locals',
             'f_trace','f_trace_lines','f_trace_opcodes')
+    __slots__=_attrs
     _not_allowed=("f_globals")
-    f_locals={".send":None}
-    f_lineno=0
+    _shared=('f_back','f_code')
     f_globals=globals()
     f_builtins=__builtins__
 
     def __init__(self,frame=None):
-        if frame:
+        if frame is None:
+            ## a new dict per frame since f_locals gets written to in place (e.g. via gi_frame.f_locals) ##
+            self.f_lineno,self.f_locals=0,{".send":None}
+        elif isinstance(frame,dict):
+            for attr,value in frame.items():
+                setattr(self,attr,value)
+        elif frame:
             if hasattr(frame,"f_back"): ## make sure all other frames are the custom type as well ##
                 self.f_back=type(self)(frame.f_back)
             if hasattr(frame,"f_code"): ## make sure it can be pickled
-                self.f_code=code(frame.f_code)
+                self.f_code=code_record(frame.f_code)
             for attr in self._attrs[2:]:
                 setattr(self,attr,getattr(frame,attr))
     
     def clear(self):
         """clears f_locals e.g. 'most references held by the frame'"""
         self.f_locals={}
+
+    def __reduce_ex__(self,protocol):
+        """With protocol 5 the large buffers in f_locals are pickled as PickleBuffers (see pickle_buffers)"""
+        reduction=super().__reduce_ex__(protocol)
+        if protocol >= 5 and "f_locals" in reduction[2]:
+            state=dict(reduction[2])
+            state["f_locals"]=pickle_buffers(state["f_locals"])
+            reduction=reduction[:2]+(state,)+reduction[3:]
+        return reduction
     
     ## we have to implement this if I'm going to go 'if frame:' (i.e. in frame.__init__) ##
     def __bool__(self):
@@ -676,16 +1854,41 @@ class frame(Pickler):
                 return False
         return True
 
-class code(Pickler):
+class frame_state(Pickler):
+    """
+    A minimal record of what's needed to resume a Generator e.g. 
+    its locals, lineno and lasti (f_back and f_code aren't wrapped)
+
+    Note: the full frame is only created when gi_frame is inspected
+    """
+    _attrs=('f_lasti','f_lineno','f_locals')
+    __slots__=_attrs
+
+    def __init__(self,frame=None):
+        if isinstance(frame,dict):
+            for attr,value in frame.items():
+                setattr(self,attr,value)
+        elif frame:
+            self.f_lasti,self.f_lineno,self.f_locals=frame.f_lasti,frame.f_lineno,frame.f_locals
+
+class code(Pickler):
     """For pickling and copying code objects"""
 
     _attrs=code_attrs()
+    __slots__=_attrs
 
     def __init__(self,code_obj=None):
-        if code_obj:
+        if isinstance(code_obj,dict):
+            for attr,value in code_obj.items():
+                setattr(self,attr,value)
+        elif code_obj:
             for attr in self._attrs:
                 setattr(self,attr,getattr(code_obj,attr))
 
+    def to_code(self):
+        """Creates a CodeType object from the attrs"""
+        return CodeType(*(getattr(self,attr) for attr in self._attrs))
+
     def __bool__(self):
         """Used on i.e. if frame:"""
         for attr in self._attrs:
@@ -714,9 +1917,8 @@ general testing to make sure everything works before any more changes are made
 control_flow_adjust - test to see if except does get included as a first line of a state (it shouldn't)
 need to test what happens when there are no lines e.g. empty lines or no state / EOF
 
-4. make an asynchronous verion? async generators have different attrs i.e. gi_frame is ag_frame
- - maybe make a preprocessor to rewrite some of the functions in Generator for ease of development
- - use getcode and getframe for more generalizability
+4. AsyncGenerator is the asynchronous version (its ag_ attrs are properties over the gi_ attrs)
+ - initializing from running async generators (e.g. via getcode and getframe for more generalizability)
    also consider coroutines e.g. cr_code, cr_frame, etc.
 
 """
@@ -755,6 +1957,19 @@ class Generator(Pickler):
     You can use inspect.getsource to get the source code
     on either its gi_code or gi_frame but you need to know
     it's current col position as well.
+
+    Performance limits:
+
+    Each step calls the compiled state with the locals as its
+    arguements (see state_args) so a warm step costs O(number of
+    locals) on top of a fixed overhead of a few microseconds e.g.
+    it's nowhere near a native generator (about 5us vs 0.03us per
+    step for a few locals and about 30us for 200 locals). Each state
+    is the rest of the function from its yield (resuming the loops
+    it's in) so the cost of compiling them and the size of the state
+    cache grow with the length of the function times its number of
+    yields (and states are per set of bound locals as well). bench.py
+    checks that the cost per step grows at most linearly
     """
 
     def _custom_adjustment(self,line,lineno):
@@ -770,18 +1985,16 @@ class Generator(Pickler):
         temp_line=line[number_of_indents:]
         indent=" "*number_of_indents
         if temp_line.startswith("yield from "):
-            return [indent+"currentframe().f_back.f_locals['.yieldfrom']="+temp_line[11:],
-                    indent+"for currentframe().f_back.f_locals['.i'] in currentframe().f_back.f_locals['.yieldfrom']:",
-                    indent+"    return currentframe().f_back.f_locals['.i']"]
+            return self._yield_from_adjust(indent,temp_line[11:],lineno)
         if temp_line.startswith("yield "):
             return [indent+"return"+temp_line[5:]] ## 5 to retain the whitespace ##
-        if temp_line.startswith("for ") or temp_line.startswith("while "):
+        if temp_line.startswith("for ") or temp_line.startswith("async for ") or temp_line.startswith("while "):
             self.jump_positions+=[[lineno,None]] ## has to be a list since we're assigning ##
             self._jump_stack+=[(number_of_indents,len(self.jump_positions)-1)] ## doesn't have to be a list since it'll get popped e.g. it's not really meant to be modified as is ##
             return [line]
-        if temp_line.startswith("return "):
+        if temp_line=="return" or temp_line.startswith("return "):
             ## close the generator then return ##
-            return [indent+"currentframe().f_back.f_locals['self'].close()",line]
+            return [indent+close_line,line]
         ## handles the .send method ##
         flag,adjustment=send_adjust(temp_line)
         if flag:
@@ -791,12 +2004,15 @@ class Generator(Pickler):
                         indent+adjustment[1]]
             else:
                 ## 11: to get past the 'yield from'
-                return [indent+"currentframe().f_back.f_locals['.yieldfrom']="+adjustment[0][11:],
-                        indent+"for currentframe().f_back.f_locals['.i'] in currentframe().f_back.f_locals['.yieldfrom']:",
-                        indent+"    return currentframe().f_back.f_locals['.i']",
-                        indent+"    %scurrentframe().f_back.f_locals['.yieldfrom'].send(currentframe().f_back.f_locals['.send'])" % adjustment[1]]
+                return self._yield_from_adjust(indent,adjustment[0][11:],lineno,adjustment[1])
         return [line]
 
+    def _yield_from_adjust(self,indent,expr,lineno,reciever=""):
+        """yield_from_adjust recording the jump position of its for loop (so that it gets resumed)"""
+        lines=yield_from_adjust(indent,expr,reciever)
+        self.jump_positions+=[[lineno+1,lineno+len(lines)]]
+        return lines
+
     def _clean_source_lines(self):
         """
         source: str
@@ -864,8 +2080,8 @@ class Generator(Pickler):
                         index,char,lineno,lines=collect_definition(line,lines,lineno,source,source_iter,reference_indent,prev)
                     else:
                         lineno+=1
-                        lines+=self._custom_adjustment(line,lineno)
-                    print(line)
+                        ## the lineno of the first adjusted line (adjustments can be more than one line) ##
+                        lines+=self._custom_adjustment(line,len(lines)+1)
                 ## start a new line ##
                 if char in ":;":
                     # just in case
@@ -885,6 +2101,25 @@ class Generator(Pickler):
         del self._jump_stack
         return lines
 
+    def _ast_clean_source_lines(self):
+        """
+        source: str
+
+        returns source_lines: list[str]
+
+        The same as _clean_source_lines but done on the ast of the source
+        in a single pass over its statements rather than by character 
+        (statements on one line keep their formatting and the rest are
+        formatted by ast.unparse)
+
+        Note: ast.unparse was introduced in python 3.9
+        """
+        self.jump_positions=[]
+        source_lines=self.source.split("\n")
+        if self.source[:1].isspace(): ## i.e. the 'if 1:' line function_body adds for methods ##
+            source_lines=[""]+source_lines
+        return ast_block_adjust(function_body(self.source),[],self.jump_positions,4,source_lines)
+
     def _create_state(self):
         """
         creates a section of modified source code to be used in a 
@@ -907,42 +2142,103 @@ class Generator(Pickler):
         also contains the rest of the source lines as well
         """
         temp_lineno=self.lineno-1 ## for 0 based indexing ##
-        loops=get_loops(temp_lineno,self.jump_positions)
+        ## the loops are of the line that was yielded from (e.g. before the lineno) since ##
+        ## the lineno after the last line of a loops body is the lineno after the loop ##
+        tree=self._get_blocks()
+        loops=get_loops(self.lineno-2,tree)
         if loops:
             linetable=[]
-            blocks=""
+            blocks=[]
             while loops:
-                start_pos,end_pos=loops.pop()
-                reference_indent=get_indent(self._source_lines[start_pos])
-                temp_block=self._source_lines[temp_lineno:end_pos]
-                indexes=list(range(temp_lineno,end_pos))
-                if get_indent(self._source_lines[temp_lineno]) - reference_indent > 4:
-                    flag,temp_block,indexes=control_flow_adjust(temp_block,indexes,reference_indent)
-                    if flag: ## indicates if any of the lines were equal to the reference indent ##
-                        temp_block,indexes=temporary_loop_adjust(temp_block,indexes,self._source_lines[start_pos:end_pos],*(start_pos,end_pos))
-                else: ## we shouldn't get an empty line otherwise this would be an error ##
-                    temp_block,indexes=temporary_loop_adjust(temp_block,indexes,self._source_lines[start_pos:end_pos],*(start_pos,end_pos))
+                ## the loops are 0 based e.g. (header index,index after the body) ##
+                loop=loops.pop()
+                start_pos,end_pos,reference_indent=loop.start,loop.end,loop.indent
+                ## the rest of the current iteration (moved to the functions indent) ##
+                temp_block,indexes=[],[]
+                if temp_lineno < end_pos:
+                    flag,temp_block,indexes=control_flow_adjust(list(self._source_lines[temp_lineno:end_pos]),list(range(temp_lineno,end_pos)),
+                                                                reference_indent,tree)
+                ## followed by the rest of the loop (resumed from its tracked iterator) ##
+                outer_loop=indent_lines([resume_loop(self._source_lines[start_pos])]+list(self._source_lines[start_pos+1:end_pos]),4-reference_indent)
+                temp_block,indexes=temporary_loop_adjust(temp_block,indexes,outer_loop,*(start_pos,end_pos))
                 ## add the new source lines and corresponding indexes and move the lineno forwards ##
                 blocks+=temp_block
                 linetable+=indexes
                 temp_lineno=end_pos
-            self.state="\n".join(blocks+self._source_lines[end_pos:]) ## end_pos: is not in the loop so we have to add it
-            self.linetable=linetable
+            ## end_pos: is not in the loop so we have to add it ##
+            flag,block,indexes=control_flow_adjust(list(self._source_lines[end_pos:]),list(range(end_pos,len(self._source_lines))),4,tree)
+            self.state="\n".join(blocks+block)
+            self.linetable=linetable+indexes
             return
         ## doesn't need a reference indent since no loops therefore it'll be set to 4 automatically ##
         indexes=list(range(temp_lineno,len(self._source_lines)))
-        flag,block,indexes=control_flow_adjust(self._source_lines[temp_lineno:],indexes)
+        flag,block,indexes=control_flow_adjust(list(self._source_lines[temp_lineno:]),indexes,4,tree)
         self.state="\n".join(block)
         self.linetable=indexes
 
+    def _get_blocks(self):
+        """Gets the block tree of the source lines (built when they're transformed; see block_tree)"""
+        key=(self.engine,self.source)
+        blocks=block_cache.get(key)
+        if blocks is None: ## i.e. evicted or the generator was unpickled ##
+            blocks=block_tree(self._source_lines)
+            block_cache.set(key,blocks)
+        return blocks
+
     ## try not to use variables here (otherwise it can mess with the state) ##
-    init="""def next_state():
-    locals().update(currentframe().f_back.f_locals['self'].gi_frame.f_locals)
-    currentframe().f_back.f_locals['self'].gi_frame=currentframe()
-    ctypes.pythonapi.PyFrame_LocalsToFast(ctypes.py_object(currentframe().f_back), ctypes.c_int(0))
+    ## the locals are passed in as arguements by position (the hidden (dotted) names go into __hidden__) ##
+    ## and the frame is added to __state__ so that the locals can be retrieved after it's returned ##
+    init="""def next_state(__state__,__hidden__%s):
+    __state__+=[_getframe()]
 """
     init_len=init.count("\n")
 
+    def _load_state(self):
+        """
+        Sets the current state, its linetable and the compiled 
+        code of its next_state function from the state cache 
+        (creating and compiling them on a cache miss)
+
+        Note: next_state takes the bound locals as its arguements 
+        so they're part of the key as well
+        """
+        names=tuple(filter(str.isidentifier,self._frame.f_locals))
+        key=(self.engine,self.source,self.lineno,names)
+        entry=state_cache.get(key)
+        if entry is None:
+            start=stats.enabled and default_timer()
+            self._create_state()
+            created=start and default_timer()
+            entry=(self.state,tuple(self.linetable),compile_state(self.init % "".join(","+name for name in names)+self.state))
+            if start:
+                stats.add(self._stats_name(),state_rebuilds=1,rebuild_seconds=created-start,compile_seconds=default_timer()-created)
+            state_cache.set(key,entry)
+            disk_cache.add_state(*key+(entry,))
+        self.state,self.linetable,self._state_code=entry
+
+    ## the same as init but with __push__ for the states used by next_n (see batch_adjust) ##
+    batch_init="""def next_state(__state__,__push__,__hidden__%s):
+    __state__+=[_getframe()]
+"""
+
+    def _load_batch_state(self):
+        """
+        Gets the compiled code of the current state where 
+        the yields are pushed to a buffer (see batch_adjust)
+        """
+        names=tuple(filter(str.isidentifier,self._frame.f_locals))
+        key=(self.engine,self.source,self.lineno,names,"batch")
+        entry=state_cache.get(key)
+        if entry is None:
+            start=stats.enabled and default_timer()
+            state="\n".join(batch_adjust(self.state.split("\n")))
+            created=start and default_timer()
+            entry=(state,self.linetable,compile_state(self.batch_init % "".join(","+name for name in names)+state))
+            if start:
+                stats.add(self._stats_name(),state_rebuilds=1,rebuild_seconds=created-start,compile_seconds=default_timer()-created)
+            state_cache.set(key,entry)
+        return entry[2]
+
     def init_states(self):
         """
         Initializes the state generation
@@ -951,14 +2247,68 @@ class Generator(Pickler):
         lines that have the yield statements
         """
         ## since self.state starts as 'None' ##
-        yield self._create_state()
-        while self.state and len(self.linetable) > 1:
-            yield self._create_state()
+        yield self._load_state()
+        while self.state and len(self.linetable) > 1 and self.lineno <= len(self._source_lines):
+            yield self._load_state()
+
+    def _init_source(self,key,get_source,get_code,unpack=None):
+        """
+        Sets the source, _source_lines, jump_positions and gi_code from 
+        the source cache so that the same function (or source code string) 
+        only gets transformed once; on a cache miss get_source and get_code 
+        are called and the source is cleaned (or unpacked via unpack)
+
+        Note: the cached _source_lines and jump_positions are tuples since 
+        they're shared across all the instances transformed from the same key
+        (the transformation is also loaded from/saved to the disk cache if enabled)
+        """
+        key=(self.engine,key)
+        entry=source_cache.get(key)
+        start=entry is None and stats.enabled and default_timer()
+        if entry is None:
+            self.source=get_source()
+            if unpack:
+                lines,jump_positions=unpack(self.source),()
+            else:
+                transformed=disk_cache.load(self.engine,self.source)
+                if transformed:
+                    lines,jump_positions=transformed
+                else:
+                    if self.engine=="ast":
+                        lines=self._ast_clean_source_lines()
+                    else:
+                        lines=self._clean_source_lines()
+                    jump_positions=tuple(tuple(pos) for pos in self.jump_positions)
+                    ## close the generator at the end of the function (e.g. as with a bare return) ##
+                    lines=tuple(track_loops(lines,jump_positions))+(" "*4+close_line,)
+                    disk_cache.save(self.engine,self.source,lines,jump_positions)
+            entry=(self.source,tuple(lines),jump_positions,code_record(get_code()))
+            source_cache.set(key,entry)
+            if not unpack:
+                block_cache.set((self.engine,self.source),block_tree(entry[1]))
+        self.source,self._source_lines,self.jump_positions,self.gi_code=entry
+        if start:
+            stats.add(self._stats_name(),transforms=1,transform_seconds=default_timer()-start)
 
-    _attrs=('_source_lines','gi_code','gi_frame','gi_running',
+    _attrs=('_module','_source_lines','engine','gi_code','gi_frame','gi_running',
             'gi_suspended','gi_yieldfrom','jump_positions','lineno','source')
+    ## the transformation is shared across copies (the states are shared via the state cache) ##
+    _shared=('_module','_source_lines','engine','gi_code','jump_positions','source')
+    ## gi_frame is a property over _frame ##
+    __slots__=('_dirty','_fingerprints','_frame','_jump_stack','_module','_source_lines','_state_code','engine','gi_code','gi_running','gi_suspended',
+               'gi_yieldfrom','jump_positions','lineno','linetable','source','state','state_generator','__weakref__')
+    ## the transformation engine used on the source code ('source' or 'ast') ##
+    default_engine="source"
+    ## pickle as a reference to the function with the position and locals only (see __reduce_ex__) ##
+    compact_pickle=False
 
-    def __init__(self,FUNC,overwrite=False):
+    def __new__(cls,FUNC=None,*args,**kwargs):
+        """Generator expressions (or their source code) are given the dedicated GenexprGenerator"""
+        if cls is Generator and (isinstance(FUNC,str) or is_genexpr(FUNC)):
+            cls=GenexprGenerator
+        return super().__new__(cls)
+
+    def __init__(self,FUNC,overwrite=False,engine=None):
         """
         Takes in a function or its source code as the first arguement
 
@@ -967,65 +2317,63 @@ class Generator(Pickler):
         Note:
          - gi_running: is the generator currently being executed
          - gi_suspended: is the generator currently paused e.g. state is saved
+         - engine: 'source' cleans the source code by character and 'ast' 
+           transforms its ast instead (defaults to Generator.default_engine);
+           'ast' handles bare yields and 'x = yield from ...' but takes about
+           20% longer per line to transform (only done once per function)
         """
+        if engine:
+            self.engine=engine
+        elif not hasattr(self,"engine"): ## i.e. load_compact sets it beforehand ##
+            self.engine=self.default_engine
         ## dict ##
         if isinstance(FUNC,dict):
             for attr in self._attrs:
                 setattr(self,attr,FUNC[attr])
         ## running generator ##
         elif hasattr(FUNC,"gi_code"):
+            if FUNC.gi_frame is None:
+                raise ValueError("can't adopt a generator that's exhausted")
+            self._module=FUNC.gi_frame.f_globals.get("__name__")
+            key=(FUNC.gi_code.co_filename,FUNC.gi_code)
             if FUNC.gi_code.co_name=="<genexpr>": ## co_name is readonly e.g. can't be changed by user ##
-                self.source=expr_getsource(FUNC)
                 ## cleaning the expression ##
-                self._source_lines=unpack_genexpr(self.source)
+                self._init_source(key,lambda:expr_getsource(FUNC),lambda:FUNC.gi_code,unpack_genexpr)
                 self.lineno=len(self._source_lines)
+                ## 'gi_yieldfrom' was introduced in python version 3.5 and yield from ... in 3.3 ##
+                if hasattr(FUNC,"gi_yieldfrom"):
+                    self.gi_yieldfrom=FUNC.gi_yieldfrom
+                else:
+                    self.gi_yieldfrom=None
+                self.gi_suspended=True
+                self.gi_frame=frame(FUNC.gi_frame)
             else:
-                self.source=getsource(FUNC.gi_code)
-                self._source_lines=self._clean_source_lines()
-                """
-                TODO:
-                running function generators will need something in 
-                place for compound statements since only version
-                3.11 and higher has co_positions and there's no 
-                other way that I currently know how to get the 
-                col_offset
-                
-                Therefore, already running generators can skip
-                the ';' when cleaning source lines potentially
-                """
-                self.lineno=FUNC.gi_frame.f_lineno ## is incorrect but needs figuring out ##
-            self.gi_code=code(FUNC.gi_code)
-            ## 'gi_yieldfrom' was introduced in python version 3.5 and yield from ... in 3.3 ##
-            if hasattr(FUNC,"gi_yieldfrom"):
-                self.gi_yieldfrom=FUNC.gi_yieldfrom
-            else:
-                self.gi_yieldfrom=None
-            self.gi_suspended=True
-            self.gi_frame=frame(FUNC.gi_frame)
+                self._init_source(key,lambda:sources.getsource(FUNC.gi_code),lambda:FUNC.gi_code)
+                self._adopt(FUNC)
         ## uninitialized generator ##
         else:
+            ## make sure the source code is standardized and usable by this generator ##
             ## source code string ##
             if isinstance(FUNC,str):
-                self.source=FUNC
-                self.gi_code=code(compile(FUNC,"","eval"))
+                self._module=None
+                self._init_source(FUNC,lambda:FUNC,lambda:compile(FUNC,"","eval"))
             ## generator function ##
             elif isinstance(FUNC,FunctionType):
+                self._module=FUNC.__module__
                 if FUNC.__code__.co_name=="<lambda>":
-                    self.source=expr_getsource(FUNC)
+                    get_source=lambda:lambda_definition(expr_getsource(FUNC))
                 else:
-                    self.source=getsource(FUNC)
-                self.gi_code=code(FUNC.__code__)
+                    get_source=lambda:sources.getsource(FUNC)
+                self._init_source((FUNC.__code__.co_filename,FUNC.__code__),get_source,lambda:FUNC.__code__)
             else:
                 raise TypeError("type '%s' is an invalid initializer for a Generator" % type(FUNC))
-            ## make sure the source code is standardized and usable by this generator ##
-            self._source_lines=self._clean_source_lines()
             ## create the states ##
             self.gi_frame=frame()
             self.gi_suspended=False
             self.gi_yieldfrom=None
             self.lineno=1 ## modified every time __next__ is called; always start at line 1 ##
         self.gi_running=False
-        self.state=None
+        self.state,self._dirty=None,None
         self.state_generator=self.init_states()
         if overwrite:
             if hasattr(FUNC,"__code__"):
@@ -1033,6 +2381,79 @@ class Generator(Pickler):
             else:
                 currentframe().f_back.f_locals[FUNC.gi_code.co_name]=self
 
+    def _adopt(self,native):
+        """
+        Sets the lineno, gi_frame, gi_suspended and gi_yieldfrom from a 
+        native generator so that it resumes exactly where it's suspended
+
+        The yield it's suspended at is found from its f_lasti (see 
+        yield_offsets) and matched to the yield in the cleaned source
+        lines of the same ordinal (see yield_indexes) then the iterators
+        of the for loops it's in are taken from its value stack (CPython
+        3.11) or its locals when the loop is over an iterator in them
+        """
+        native_frame=native.gi_frame
+        generator_state=getgeneratorstate(native)
+        if generator_state==GEN_RUNNING:
+            raise ValueError("can't adopt a generator that's running")
+        f_locals=dict(native_frame.f_locals)
+        f_locals[".send"]=None
+        self.gi_yieldfrom=getattr(native,"gi_yieldfrom",None)
+        if generator_state==GEN_CREATED:
+            self.lineno,self.gi_suspended=1,False
+        else:
+            self.lineno,self.gi_suspended=self._lasti_lineno(native.gi_code,native_frame.f_lasti),True
+            if self.gi_yieldfrom is not None: ## i.e. for the loop the ast engine makes of a yield from ##
+                f_locals[".yieldfrom"]=self.gi_yieldfrom
+            f_locals.update(self._loop_iterators(native,f_locals))
+        self.gi_frame=frame(dict(f_code=self.gi_code,f_lasti=native_frame.f_lasti,
+                                 f_lineno=native_frame.f_lineno,f_locals=f_locals))
+
+    def _lasti_lineno(self,code_obj,lasti):
+        """Gets the lineno to resume from after the yield at lasti of the generators native code object"""
+        key=(self.engine,self.source)
+        linenos=lasti_cache.get(key)
+        if linenos is None:
+            indexes,offsets=yield_indexes(self._source_lines,self._get_blocks()),yield_offsets(code_obj)
+            if len(set(offsets.values()))!=len(indexes):
+                raise NotImplementedError("the yields of '%s' can't be matched to its cleaned source lines" % code_obj.co_name)
+            ## +2 for the lineno after the yield (see _save_frame) ##
+            linenos=dict((offset,indexes[ordinal]+2) for offset,ordinal in offsets.items())
+            lasti_cache.set(key,linenos)
+        if not lasti in linenos:
+            raise ValueError("the generator is not suspended at a yield")
+        return linenos[lasti]
+
+    def _loop_iterators(self,native,f_locals):
+        """
+        Gets the iterators of the tracked for loops (see track_loops) that 
+        the yield before the lineno is in as a dict of the hidden locals
+        """
+        lines=self._source_lines
+        loops=[loop for loop in get_loops(self.lineno-2,self._get_blocks()) if " in track_iter(" in lines[loop.start]]
+        if not loops:
+            return {}
+        keys=[".%s" % (loop.start+1) for loop in loops]
+        if cpython_311:
+            ## the for loop iterators are on the stack outermost first (along with e.g. the exit of a with ##
+            ## statement or a caught exception) and a yield from's iterator is on top of them (which is ##
+            ## only a tracked loop's iterator when the source engine made the yield from into one) ##
+            stack=[value for value in frame_stack(native.gi_frame) if not value is NULL and hasattr(type(value),"__next__")]
+            if len(stack)==len(loops)+1 and stack[-1] is self.gi_yieldfrom:
+                stack.pop()
+            if len(stack)==len(loops):
+                return dict(zip(keys,stack))
+            raise NotImplementedError("the value stack of '%s' can't be matched to the for loops it's in" % native.gi_code.co_name)
+        iterators={}
+        for key,loop in zip(keys,loops):
+            line=lines[loop.start]
+            node=ast.parse(line[get_indent(line):]+"pass").body[0].iter.args[0]
+            value=f_locals.get(node.id) if isinstance(node,ast.Name) else None
+            if value is None or not hasattr(type(value),"__next__"):
+                raise NotImplementedError("adopting a generator suspended in a for loop that's not over an iterator in its locals is only implemented for CPython 3.11")
+            iterators[key]=value
+        return iterators
+
     def __len__(self):
         """
         Gets the number of states for generators with yield 
@@ -1054,41 +2475,138 @@ class Generator(Pickler):
         return sum(number_of_yields())
 
     def __iter__(self):
-        """Converts the generator function into an iterable"""
-        while True:
-            try:
-                yield next(self)
-            except StopIteration:
-                break
+        """
+        Generators are their own iterators (as native generators are)
+
+        Note: iter(generator) used to return a new python generator over 
+        __next__; it now returns the generator itself
+        """
+        return self
 
     def __next__(self):
         """updates the current state and returns the result"""
         # set the next state and setup the function
         next(self.state_generator) ## it will raise a StopIteration for us
-        ## update with the new state and get the frame ##
-        exec(self.init+self.state,globals(),locals())
+        ## update with the new state (compiled once per source and lineno in the state cache) ##
+        next_state=state_function(self._state_code,self._module)
+        ## restore the locals (the arguements of next_state) and the hidden names ##
+        state_frames=[]
         self.gi_running=True
+        start=stats.enabled and default_timer()
         ## if an error does occur it will be formatted correctly in cpython (just incorrect frame and line number) ##
         try:
-            return locals()["next_state"]()
+            value=next_state(state_frames,*state_args(self._frame.f_locals,self._state_code,1))
         finally:
             ## update the line position and frame ##
             self.gi_running=False
-            self.gi_frame.f_locals[".send"]=None
-            self.gi_frame=frame(self.gi_frame)
+            if start:
+                stats.add(self._stats_name(),steps=1,step_seconds=default_timer()-start)
+            self._save_frame(state_frames)
+        ## i.e. it returned or reached the end of the function ##
+        if self._frame is None:
+            raise StopIteration if value is None else StopIteration(value)
+        return value
+
+    def _save_frame(self,state_frames):
+        """
+        Saves the locals and the next lineno of the state 
+        that's just been ran (unless it's been closed)
+        """
+        if state_frames and self._frame is not None:
+            start=stats.enabled and default_timer()
+            ## only keep what's needed to resume e.g. not the f_back chain ##
+            ## the frame is popped since any reference to it left when returning makes cpython ##
+            ## create frame objects for the callers as well (e.g. of the whole f_back chain) ##
+            state_frame=state_frames.pop()
+            f_locals=state_frame.f_locals
+            if not isinstance(f_locals,dict): ## i.e. a write through proxy in python 3.13+ (PEP 667) ##
+                f_locals=dict(f_locals)
+            del f_locals["__state__"]
+            f_locals.pop("__push__",None) ## i.e. from next_n ##
+            ## the state_helpers it used (its free variables) ##
+            for name in state_frame.f_code.co_freevars:
+                del f_locals[name]
+            f_locals.update(f_locals.pop("__hidden__"))
+            f_locals[".send"]=None
+            if self._dirty is not None:
+                self._track(self._frame.f_locals,f_locals)
+            self._frame=frame_state()
+            self._frame.f_lasti,self._frame.f_lineno,self._frame.f_locals=state_frame.f_lasti,state_frame.f_lineno,f_locals
             if len(self.linetable) > 1:
-                self.lineno=self.linetable[self.gi_frame.f_lineno-self.init_len]+1 ## +1 to get the next lineno after returning ##
+                ## the linetable is 0 based so +2 to get the next lineno after returning ##
+                self.lineno=self.linetable[self._frame.f_lineno-self.init_len-1]+2
+            if start:
+                stats.add(self._stats_name(),snapshots=1,snapshot_seconds=default_timer()-start)
+
+    def _get_frame(self):
+        """Gets the frame (creating the full frame from the frame state if it's not been inspected yet)"""
+        if isinstance(self._frame,frame_state):
+            self._frame=frame(dict(f_code=self.gi_code,f_lasti=self._frame.f_lasti,
+                                   f_lineno=self._frame.f_lineno,f_locals=self._frame.f_locals))
+        return self._frame
+
+    def _set_frame(self,value):
+        self._frame=value
+
+    gi_frame=property(_get_frame,_set_frame)
 
     def send(self,arg):
         """
         Send takes exactly one arguement 'arg' that 
         is sent to the functions yield variable
         """
-        if not self.gi_running:
+        ## the lineno is only 1 before the first yield (e.g. state is None after unpickling or adopting as well) ##
+        if self.lineno==1 and arg is not None:
             raise TypeError("can't send non-None value to a just-started generator")
-        self.gi_frame.f_locals()[".send"]=arg
+        self._frame.f_locals[".send"]=arg
         return next(self)
 
+    def next_n(self,n):
+        """
+        Gets the next n values (or less if it's exhausted) as a list
+
+        The yields are pushed to a buffer instead of returning so that 
+        many of them can be ran within one activation of a state (e.g.
+        when the yield is in a loop) and the frame is only saved at the end
+        """
+        values=[]
+        def push(value):
+            values.append(value)
+            return len(values) >= n
+        while len(values) < n and self._frame is not None:
+            try:
+                next(self.state_generator)
+            except StopIteration:
+                break
+            code_obj=self._load_batch_state()
+            next_state=state_function(code_obj,self._module)
+            state_frames=[]
+            self.gi_running=True
+            start,count=stats.enabled and default_timer(),len(values)
+            try:
+                next_state(state_frames,push,*state_args(self._frame.f_locals,code_obj,2))
+            finally:
+                self.gi_running=False
+                if start:
+                    stats.add(self._stats_name(),steps=len(values)-count,step_seconds=default_timer()-start)
+                self._save_frame(state_frames)
+            ## the state only returns early when the buffer is full otherwise it's finished ##
+            if len(values) < n:
+                self.close()
+        return values
+
+    def drain(self,into=list):
+        """
+        Runs the generator until it's exhausted (see next_n) returning 
+        its values as into (a type e.g. list, tuple, etc.) or extends
+        into if it's a buffer and returns it
+        """
+        values=self.next_n(float("inf"))
+        if isinstance(into,type):
+            return values if into is list else into(values)
+        into.extend(values)
+        return into
+
     def close(self):
         """Creates a simple empty generator"""
         self.state_generator=iter(())
@@ -1103,10 +2621,151 @@ class Generator(Pickler):
         """
         raise exception
 
+    def _track(self,old,new):
+        """Adds the names of the locals that have been rebound or unbound (from old to new) to the dirty names"""
+        dirty=self._dirty
+        for name,value in new.items():
+            if not name in old or old[name] is not value:
+                dirty.add(name)
+        dirty.update(name for name in old if not name in new)
+
+    def mark_dirty(self,name):
+        """
+        Marks a local as changed for the next checkpoint_delta e.g. when 
+        something nested in it's been mutated in place (see fingerprint)
+        """
+        if self._dirty is not None:
+            self._dirty.add(name)
+
+    def checkpoint_delta(self,protocol=None):
+        """
+        Pickles the changes since the last checkpoint_delta e.g. the position,
+        the locals that have been rebound or mutated in place and the names 
+        that have been unbound (see DeltaPickler)
+
+        The first call pickles all the locals (i.e. the base snapshot) and 
+        starts the dirty tracking; the hidden locals (e.g. the iterators of
+        the loops) are always included since they change in place
+
+        Note: mutating a local in place is found by its fingerprint which is
+        shallow e.g. appending to a list that's in a dict local isn't a change
+        unless it's rebound or marked dirty (see mark_dirty)
+        """
+        if self.gi_frame is None:
+            self._dirty=None
+            delta,unchanged=(None,{},()),{}
+        else:
+            f_locals=self.gi_frame.f_locals
+            fingerprints=dict((name,fingerprint(value)) for name,value in f_locals.items() if name[:1]!=".")
+            if self._dirty is None:
+                changed,deleted=dict(f_locals),()
+            else:
+                dirty,old=self._dirty,self._fingerprints
+                changed=dict((name,value) for name,value in f_locals.items()
+                             if name in dirty or name[:1]=="." or fingerprints[name]!=old.get(name))
+                deleted=tuple(name for name in dirty if not name in f_locals)
+            self._dirty,self._fingerprints=set(),fingerprints
+            delta=(self._position(),changed,deleted)
+            unchanged=dict((name,value) for name,value in f_locals.items() if not name in changed)
+        file=BytesIO()
+        pickler=DeltaPickler(file,unchanged,protocol)
+        if self.gi_frame is not None:
+            pickler.share(f_locals.values())
+        pickler.dump(delta)
+        if stats.enabled:
+            stats.add(self._stats_name(),pickled_bytes=file.tell())
+        return file.getvalue()
+
+    def apply_delta(self,delta):
+        """
+        Applies a delta from checkpoint_delta e.g. to a generator restored 
+        from the base snapshot (the deltas need applying in order)
+        """
+        if self.gi_frame is None:
+            self.gi_frame=frame()
+        f_locals=dict(self.gi_frame.f_locals)
+        position,changed,deleted=DeltaUnpickler(BytesIO(delta),f_locals).load()
+        if position is None:
+            self.close()
+            return
+        f_locals.update(changed)
+        for name in deleted:
+            f_locals.pop(name,None)
+        self._restore(position,f_locals)
+        self.state_generator=self.init_states()
+
+    def __getstate__(self):
+        """Pickles the locals and gi_yieldfrom by their compact reducers (see Reducers)"""
+        state=super().__getstate__()
+        if state.get("gi_frame") is not None:
+            state["gi_frame"]=copy(state["gi_frame"])
+            state["gi_frame"].f_locals,state["gi_yieldfrom"]=reducers.compact(state["gi_frame"].f_locals,state.get("gi_yieldfrom"))
+        return state
+
     def __setstate__(self,state):
         super().__setstate__(state)
+        self.state,self._dirty=None,None
         self.state_generator=self.init_states()
 
+    def _hash(self):
+        """Gets the hash used to check the function hasn't changed between pickling and unpickling"""
+        return source_hash(self.source)
+
+    def _reference(self):
+        """Gets a stable reference to the generators function e.g. (module,qualname,hash,engine)"""
+        if self._module is None: ## source code strings are small enough to be their own reference ##
+            return (None,self.source,None,self.engine)
+        qualname=getattr(self.gi_code,"co_qualname",self.gi_code.co_name)
+        if "<" in qualname: ## i.e. <locals>, <lambda>, <genexpr> ##
+            raise PicklingError("'%s' can't be referenced by a compact pickle" % qualname)
+        return (self._module,qualname,self._hash(),self.engine)
+
+    def _position(self):
+        """Gets where the generator is for a compact pickle"""
+        return (self.lineno,)
+
+    def _stats_name(self):
+        """Gets the name the generators function is recorded under in the stats e.g. module.qualname"""
+        if self._module is None:
+            return self.source
+        return "%s.%s" % (self._module,getattr(self.gi_code,"co_qualname",self.gi_code.co_name))
+
+    def stats(self):
+        """Gets the stats recorded for the generators function (see Stats)"""
+        return stats.get(self._stats_name())
+
+    def _restore(self,position,f_locals):
+        """Restores the position and locals from a compact pickle"""
+        if f_locals is None:
+            self.close()
+        else:
+            self.lineno,=position
+            self.gi_frame.f_locals=f_locals
+            self.gi_suspended=True
+
+    def __reduce_ex__(self,protocol):
+        """
+        Pickles as (module,qualname,hash,engine), the position and the 
+        locals only if compact_pickle is set (the source code is then 
+        retrieved or transformed when unpickling)
+        """
+        if self.compact_pickle:
+            f_locals=None if self.gi_frame is None else reducers.compact(self.gi_frame.f_locals)[0]
+            if f_locals and protocol >= 5:
+                f_locals=pickle_buffers(f_locals)
+            reduction=(load_compact,(type(self),self._reference(),self._position(),f_locals))
+        else:
+            reduction=super().__reduce_ex__(protocol)
+        if stats.enabled and not getattr(measuring,"active",False):
+            ## the stream of pickle.dumps isn't exposed so the reduction is pickled on its own ##
+            ## (checkpoints are counted as they're written instead; see CheckpointPickler) ##
+            measuring.active=True
+            try:
+                stats.add(self._stats_name(),pickled_bytes=len(pickle.dumps(reduction[1:],protocol)))
+            finally:
+                measuring.active=False
+        return reduction
+
     ## type checking for later ##
 
     # def __instancecheck__(self, instance):
@@ -1115,12 +2774,1154 @@ class Generator(Pickler):
     # def __subclasscheck__(self, subclass):
     #     if subclass==
 
+class BytecodeGenerator(Generator):
+    """
+    A Generator that builds its states from the generators code 
+    object rather than its source code (no source code is needed)
+
+    How it works:
+
+    The generator is run natively until it needs to be copied or 
+    pickled where its frame is snapshotted (locals, f_lasti and 
+    the value stack e.g. the iterators of the for loops it's in).
+    Resuming from a snapshot creates a native generator from a 
+    state that is the original bytecode with a prologue that 
+    restores the snapshot and jumps to where it left off
+
+    Note: this is only implemented for CPython 3.11 and closure
+    variables are restored as new cells (e.g. they're no longer
+    shared with the enclosing function once resumed from a snapshot)
+    """
+    __slots__=('_native','_offset','_stale')
+    default_engine="bytecode"
+
+    def __init__(self,FUNC,overwrite=False):
+        """
+        Takes in a generator function (without arguements), a running 
+        generator or a dictionary of attributes as the first arguement
+        """
+        if not cpython_311:
+            raise NotImplementedError("BytecodeGenerator is only implemented for CPython 3.11")
+        self._native,self.engine,self._dirty=None,self.default_engine,None
+        ## dict ##
+        if isinstance(FUNC,dict):
+            for attr in self._attrs:
+                setattr(self,attr,FUNC[attr])
+        ## running generator ##
+        elif hasattr(FUNC,"gi_code"):
+            self._module=FUNC.gi_frame.f_globals.get("__name__")
+            self._init_code(FUNC.gi_code)
+            self.gi_yieldfrom=getattr(FUNC,"gi_yieldfrom",None)
+            self.gi_suspended=True
+            self._snapshot(FUNC)
+        ## uninitialized generator ##
+        elif isinstance(FUNC,FunctionType):
+            self._module=FUNC.__module__
+            self._init_code(FUNC.__code__)
+            self.gi_yieldfrom=None
+            self.gi_suspended=False
+            self.gi_frame=frame()
+            self.gi_frame.f_code=self.gi_code
+            self.gi_frame.f_lasti=start_lasti(FUNC.__code__)
+            self.gi_frame.f_lineno=self.lineno=FUNC.__code__.co_firstlineno
+            self.gi_frame.f_locals=dict(zip(FUNC.__code__.co_freevars,(cell.cell_contents for cell in FUNC.__closure__ or ())))
+        else:
+            raise TypeError("type '%s' is an invalid initializer for a BytecodeGenerator" % type(FUNC))
+        self.gi_running=False
+        self.state,self._dirty=None,None
+        if overwrite:
+            currentframe().f_back.f_locals[getcode(FUNC).co_name]=self
+
+    def _init_code(self,code_obj):
+        """Sets gi_code (shared via the source cache) without any source code"""
+        self._init_source((code_obj.co_filename,code_obj),lambda:None,lambda:code_obj,lambda source:[])
+
+    def _snapshot(self,native,offset=0):
+        """
+        Sets gi_frame to a snapshot of a suspended native generator
+        (offset is the length of the prologue of the state it's running)
+        """
+        start=stats.enabled and default_timer()
+        snapshot=frame()
+        snapshot.f_code=self.gi_code
+        snapshot.f_lasti=native.gi_frame.f_lasti-offset
+        snapshot.f_lineno=self.lineno=native.gi_frame.f_lineno
+        snapshot.f_locals=dict(native.gi_frame.f_locals)
+        stack=frame_stack(native.gi_frame)
+        if stack:
+            snapshot.f_locals[".stack"]=stack
+        if self._dirty is not None:
+            self._track(self._frame.f_locals,snapshot.f_locals)
+        self._frame,self._stale=snapshot,False
+        if start:
+            stats.add(self._stats_name(),snapshots=1,snapshot_seconds=default_timer()-start)
+
+    def _get_frame(self):
+        """gets the frame (snapshotting the native generator if it has moved on)"""
+        if self._stale and self._native.gi_frame is not None:
+            self._snapshot(self._native,self._offset)
+        return self._frame
+
+    def _set_frame(self,value):
+        self._frame,self._stale=value,False
+
+    gi_frame=property(_get_frame,_set_frame)
+
+    def _load_state(self):
+        """
+        Sets the current state e.g. the code object that resumes 
+        from gi_frame from the state cache (creating it on a miss)
+        """
+        f_locals,code_obj=self.gi_frame.f_locals,self.gi_code
+        unbound=tuple(name for name in local_names(code_obj) if not name in f_locals)
+        stack=f_locals.get(".stack",())
+        nulls=tuple(index for index,value in enumerate(stack) if value is NULL)
+        key=(self.engine,code_key(code_obj),self.gi_frame.f_lasti,unbound,len(stack),nulls)
+        entry=state_cache.get(key)
+        if entry is None:
+            start=stats.enabled and default_timer()
+            entry=resume_code(code_obj.to_code(),self.gi_frame.f_lasti,unbound,len(stack),nulls)
+            if start:
+                stats.add(self._stats_name(),state_rebuilds=1,compile_seconds=default_timer()-start)
+            state_cache.set(key,entry)
+        self._state_code,self._offset=entry
+
+    def _resume(self):
+        """Creates the native generator that resumes from gi_frame"""
+        self._load_state()
+        f_locals,code_obj=self.gi_frame.f_locals,self.gi_code
+        args=[f_locals.get(name) for name in local_names(code_obj)]+[f_locals.get(".send")]
+        args+=[value for value in f_locals.get(".stack",()) if not value is NULL]
+        ## the closure variables get new cells since only their values are snapshotted (and pickled) ##
+        ## e.g. they're no longer shared with the enclosing function (see the BytecodeGenerator note) ##
+        closure=tuple(CellType(f_locals.get(name)) for name in code_obj.co_freevars) or None
+        module=modules.get(self._module)
+        return FunctionType(self._state_code,module.__dict__ if module else globals(),code_obj.co_name,None,closure)(*args)
+
+    def __next__(self):
+        """resumes the native generator (creating it from gi_frame if needed)"""
+        if self._native is None:
+            self._native=self._resume()
+        self.gi_running=True
+        start=stats.enabled and default_timer()
+        try:
+            return next(self._native)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            self.gi_running,self._stale=False,self._native is not None
+            if start:
+                stats.add(self._stats_name(),steps=1,step_seconds=default_timer()-start)
+
+    def send(self,arg):
+        """
+        Send takes exactly one arguement 'arg' that 
+        is sent to the functions yield variable
+        """
+        if self._native is None:
+            self.gi_frame.f_locals[".send"]=arg
+            return next(self)
+        self.gi_running=True
+        try:
+            return self._native.send(arg)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            self.gi_running,self._stale=False,self._native is not None
+
+    def next_n(self,n):
+        """Gets the next n values (or less if it's exhausted) as a list (the native generator yields them)"""
+        values=[]
+        while len(values) < n:
+            try:
+                values.append(next(self))
+            except StopIteration:
+                break
+        return values
+
+    def throw(self,exception):
+        """Raises the exception where the generator is suspended"""
+        if self._native is None:
+            ## an unstarted generator raises the exception straight away otherwise the prologue needs to be run first ##
+            if self.gi_frame.f_lasti!=start_lasti(self.gi_code):
+                raise NotImplementedError("throw is only supported on a started generator once it has been resumed")
+            self._native=self._resume()
+        try:
+            return self._native.throw(exception)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            self._stale=self._native is not None
+
+    def close(self):
+        """Closes the native generator (if any) and creates a simple empty generator"""
+        if self._native is not None:
+            self._native.close()
+        self._native=None
+        super().close()
+
+    def apply_delta(self,delta):
+        """Applies a delta from checkpoint_delta (the native generator is resumed from it)"""
+        if self._native is not None:
+            self._native.close()
+            self._native=None
+        super().apply_delta(delta)
+
+    def __setstate__(self,state):
+        Pickler.__setstate__(self,state)
+        self._native,self.state,self._dirty=None,None,None
+
+    def _hash(self):
+        """Gets the hash used to check the function hasn't changed between pickling and unpickling"""
+        return code_hash(self.gi_code)
+
+    def _position(self):
+        """Gets where the generator is for a compact pickle"""
+        return (self.gi_frame.f_lineno,self.gi_frame.f_lasti)
+
+    def _restore(self,position,f_locals):
+        """Restores the position and locals from a compact pickle"""
+        if f_locals is None:
+            self.close()
+        else:
+            self.lineno,self.gi_frame.f_lasti=position
+            self.gi_frame.f_lineno,self.gi_frame.f_code=self.lineno,self.gi_code
+            self.gi_frame.f_locals=f_locals
+            self.gi_suspended=True
+
+if (3,8) <= version_info:
+    from types import CellType
+    ## the closure of the states (see state_function) ##
+    state_cells=dict((name,CellType(globals()[name])) for name in state_helpers)
+
+########################
+### GenexprGenerator ###
+########################
+class GenexprGenerator(Generator):
+    """
+    A Generator for generator expressions (Generator gives them this
+    type) that's compiled once into a generator function holding its
+    iterators in a list (see genexpr_lines) so that it's run natively
+
+    How it works:
+
+    The state of a generator expression is its iterators (one per for
+    clause; kept as the hidden locals '.0', '.1', ... in gi_frame) and
+    its locals. These are snapshotted from the native generator only
+    when needed (i.e. copying or pickling) and resuming creates a new
+    native generator from them
+
+    Note: adopting a started generator expression with more than one for
+    clause needs its value stack and is therefore only for CPython 3.11
+    """
+    __slots__=('_native','_stale')
+    default_engine="genexpr"
+    init="""def next_state(__iters__,%s):
+"""
+
+    def __init__(self,FUNC,overwrite=False,engine=None):
+        """
+        Takes in a generator expression (running or not), its source code
+        or a dictionary of attributes as the first arguement
+
+        Note: overwrite and engine are only accepted for compatibility with
+        Generator since generator expressions have no name and one engine
+        """
+        self._native,self._stale,self.engine=None,False,self.default_engine
+        ## dict ##
+        if isinstance(FUNC,dict):
+            for attr in self._attrs:
+                setattr(self,attr,FUNC[attr])
+        ## source code string ##
+        elif isinstance(FUNC,str):
+            self._module=None
+            ## gi_code is the generator expressions code object rather than the expressions ##
+            get_code=lambda:[const for const in compile(FUNC,"","eval").co_consts if hasattr(const,"co_code")][0]
+            self._init_source(FUNC,lambda:FUNC,get_code,genexpr_lines)
+            self.gi_frame=frame()
+            self.gi_suspended=False
+        ## generator expression ##
+        elif is_genexpr(FUNC):
+            if FUNC.gi_frame is None:
+                raise ValueError("can't adopt a generator expression that's exhausted")
+            self._module=FUNC.gi_frame.f_globals.get("__name__")
+            self._init_source((FUNC.gi_code.co_filename,FUNC.gi_code),lambda:expr_getsource(FUNC),lambda:FUNC.gi_code,genexpr_lines)
+            self._adopt(FUNC)
+        else:
+            raise TypeError("type '%s' is an invalid initializer for a GenexprGenerator" % type(FUNC))
+        self.gi_running,self.gi_yieldfrom,self.lineno=False,None,1
+        self.state,self._dirty=None,None
+
+    def _adopt(self,native):
+        """Sets gi_frame from a generator expression that's not been wrapped before"""
+        f_locals=dict(native.gi_frame.f_locals)
+        clauses=genexpr_node(self.source).generators
+        targets=[child.id for child in ast.walk(clauses[0].target) if isinstance(child,ast.Name)]
+        ## i.e. it's suspended at its yield (it only has '.0' beforehand) ##
+        self.gi_suspended=any(name in f_locals for name in targets)
+        if self.gi_suspended and len(clauses) > 1:
+            if not cpython_311:
+                raise NotImplementedError("adopting a started generator expression with more than one for clause is only implemented for CPython 3.11")
+            for depth,iterator in enumerate(frame_stack(native.gi_frame)[1:len(clauses)],start=1):
+                f_locals[".%s" % depth]=iterator
+        self.gi_frame=frame()
+        self.gi_frame.f_code,self.gi_frame.f_lasti,self.gi_frame.f_lineno,self.gi_frame.f_locals=self.gi_code,0,1,f_locals
+
+    def _snapshot(self,native):
+        """Sets gi_frame to a snapshot of the suspended native generator e.g. its iterators and locals"""
+        start=stats.enabled and default_timer()
+        f_locals=dict(native.gi_frame.f_locals)
+        for depth,iterator in enumerate(f_locals.pop("__iters__")):
+            f_locals[".%s" % depth]=iterator
+        snapshot=frame()
+        snapshot.f_code,snapshot.f_lasti,snapshot.f_lineno,snapshot.f_locals=self.gi_code,0,1,f_locals
+        if self._dirty is not None:
+            self._track(self._frame.f_locals,f_locals)
+        self._frame,self._stale=snapshot,False
+        if start:
+            stats.add(self._stats_name(),snapshots=1,snapshot_seconds=default_timer()-start)
+
+    def _get_frame(self):
+        """gets the frame (snapshotting the native generator if it has moved on)"""
+        if self._stale and self._native.gi_frame is not None:
+            self._snapshot(self._native)
+        return self._frame
+
+    def _set_frame(self,value):
+        self._frame,self._stale=value,False
+
+    gi_frame=property(_get_frame,_set_frame)
+
+    def _load_state(self):
+        """
+        Sets the compiled code of the generator function from the
+        state cache (the bound locals are its arguements so they're
+        part of the key as well)
+        """
+        names=tuple(filter(str.isidentifier,self.gi_frame.f_locals))
+        key=(self.engine,self.source,names)
+        entry=state_cache.get(key)
+        if entry is None:
+            start=stats.enabled and default_timer()
+            entry=compile_state(self.init % "".join(name+"," for name in names)+"\n".join(self._source_lines))
+            if start:
+                stats.add(self._stats_name(),state_rebuilds=1,compile_seconds=default_timer()-start)
+            state_cache.set(key,entry)
+        self._state_code=entry
+
+    def _resume(self):
+        """Creates the native generator that resumes from gi_frame"""
+        self._load_state()
+        f_locals,iterators=self.gi_frame.f_locals,[]
+        while ".%s" % len(iterators) in f_locals:
+            iterators+=[iter(f_locals[".%s" % len(iterators)])]
+        return state_function(self._state_code,self._module)(iterators,
+                                                             **dict((name,value) for name,value in f_locals.items() if name.isidentifier()))
+
+    def __next__(self):
+        """resumes the native generator (creating it from gi_frame if needed)"""
+        if self._native is None:
+            if self._frame is None:
+                raise StopIteration
+            self._native=self._resume()
+        self.gi_running=True
+        start=stats.enabled and default_timer()
+        try:
+            value=next(self._native)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            self.gi_running,self._stale=False,self._native is not None
+            if start:
+                stats.add(self._stats_name(),steps=1,step_seconds=default_timer()-start)
+        self.gi_suspended=True
+        return value
+
+    def send(self,arg):
+        """
+        Send takes exactly one arguement 'arg' (it's discarded
+        since generator expressions don't use what's sent)
+        """
+        if arg is not None and not self.gi_suspended:
+            raise TypeError("can't send non-None value to a just-started generator")
+        return next(self)
+
+    def next_n(self,n):
+        """Gets the next n values (or less if it's exhausted) as a list (the native generator yields them)"""
+        if self._native is None:
+            if self._frame is None:
+                return []
+            self._native=self._resume()
+        self.gi_running,values=True,[]
+        start=stats.enabled and default_timer()
+        try:
+            values=list(islice(self._native,None if n==float("inf") else int(n)))
+        finally:
+            self.gi_running,self._stale=False,True
+            if start:
+                stats.add(self._stats_name(),steps=len(values),step_seconds=default_timer()-start)
+        if len(values) < n:
+            self.close()
+        elif values:
+            self.gi_suspended=True
+        return values
+
+    def throw(self,exception):
+        """Raises the exception where the generator is suspended"""
+        if self._native is None:
+            if self._frame is None:
+                raise exception
+            self._native=self._resume()
+        try:
+            return self._native.throw(exception)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            self._stale=self._native is not None
+
+    def close(self):
+        """Closes the native generator (if any) and creates a simple empty generator"""
+        if self._native is not None:
+            self._native.close()
+        self._native=None
+        super().close()
+
+    def apply_delta(self,delta):
+        """Applies a delta from checkpoint_delta (the native generator is resumed from it)"""
+        if self._native is not None:
+            self._native.close()
+            self._native=None
+        super().apply_delta(delta)
+
+    def __setstate__(self,state):
+        Pickler.__setstate__(self,state)
+        self._native,self._stale,self.state,self._dirty=None,False,None,None
+
+######################
+### AsyncGenerator ###
+######################
+class AsyncState(object):
+    """
+    The awaitable of AsyncGenerator.__anext__ (and asend) that runs 
+    the next state (an async function) as a coroutine passing on what 
+    it awaits to the event loop and saves its frame once it's finished
+
+    Note: it's written as an awaitable rather than with async/await
+    so that this module can still be parsed by older versions of python
+    """
+    __slots__=('generator','coroutine','state_frames')
+
+    def __init__(self,generator):
+        self.generator,self.coroutine,self.state_frames=generator,None,[]
+
+    def __await__(self):
+        return self
+
+    __iter__=__await__
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self,value):
+        if self.coroutine is None:
+            self._start()
+            value=None
+        return self._step(self.coroutine.send,value)
+
+    def throw(self,*args):
+        if self.coroutine is None:
+            self._start()
+        return self._step(self.coroutine.throw,*args)
+
+    def close(self):
+        """Closes the coroutine (i.e. when whatever is awaiting this gets closed)"""
+        if self.coroutine is not None:
+            try:
+                self.coroutine.close()
+            finally:
+                self._finish()
+
+    def _start(self):
+        """updates the current state and creates the coroutine of its next_state function"""
+        generator=self.generator
+        if generator.gi_running:
+            raise RuntimeError("anext(): asynchronous generator is already running")
+        try:
+            next(generator.state_generator)
+        except StopIteration:
+            raise StopAsyncIteration
+        next_state=state_function(generator._state_code,generator._module)
+        generator.gi_running=True
+        self.coroutine=next_state(self.state_frames,*state_args(generator._frame.f_locals,generator._state_code,1))
+        if stats.enabled:
+            stats.add(generator._stats_name(),steps=1)
+
+    def _step(state,FUNC,*args):
+        ## the states close the generator via currentframe().f_back.f_locals['self'] ##
+        self=state.generator
+        try:
+            return FUNC(*args)
+        except StopIteration as error:
+            state._finish()
+            ## i.e. it returned or reached the end of the function ##
+            if self._frame is None:
+                raise StopAsyncIteration
+            raise StopIteration(error.value)
+        except BaseException:
+            state._finish()
+            raise
+
+    def _finish(self):
+        """updates the line position and frame"""
+        self.generator.gi_running=False
+        self.generator._save_frame(self.state_frames)
+
+class AsyncCall(object):
+    """An awaitable that calls FUNC(*args) when it's awaited e.g. for AsyncGenerator.athrow and aclose"""
+    __slots__=('FUNC','args')
+
+    def __init__(self,FUNC,*args):
+        self.FUNC,self.args=FUNC,args
+
+    def __await__(self):
+        return self
+
+    __iter__=__await__
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self,value):
+        raise StopIteration(self.FUNC(*self.args))
+
+class AsyncGenerator(Generator):
+    """
+    The asynchronous counterpart of Generator for async generator 
+    functions so that async streams can be copied and pickled (or 
+    checkpointed) between steps and resumed
+
+    The states are async functions (so that they can await) that
+    are ran by the awaitables of __anext__ and asend (see AsyncState)
+
+    Note: it's not an iterator e.g. send, next_n and drain raise TypeError
+    and athrow isn't implemented. Native async generators can only be 
+    adopted before they're started
+    """
+    __slots__=()
+    ## the same as Generator.init but async ##
+    init="""async def next_state(__state__,__hidden__%s):
+    __state__+=[_getframe()]
+"""
+    init_len=init.count("\n")
+    __iter__=__next__=None ## i.e. it's an async iterator instead ##
+    ## the async generator attrs ##
+    ag_code=property(lambda self:self.gi_code)
+    ag_frame=property(Generator._get_frame,Generator._set_frame)
+    ag_running=property(lambda self:self.gi_running)
+
+    def __init__(self,FUNC,overwrite=False,engine=None):
+        """
+        Takes in the same as Generator or a native async generator
+        that hasn't been started (its locals are its arguements)
+        """
+        ## native async generator ##
+        if hasattr(FUNC,"ag_code"):
+            native=FUNC
+            if not async_generator_created(native):
+                raise NotImplementedError("only async generators that haven't been started can be adopted")
+            f_locals=dict(native.ag_frame.f_locals)
+            ## a function of its code object to get its source code and module from ##
+            closure=tuple(CellType(f_locals.pop(name,None)) for name in native.ag_code.co_freevars) or None
+            FUNC=FunctionType(native.ag_code,native.ag_frame.f_globals,native.ag_code.co_name,None,closure)
+            super().__init__(FUNC,False,engine)
+            f_locals[".send"]=None
+            self._frame.f_locals=f_locals
+        else:
+            super().__init__(FUNC,False,engine)
+        if overwrite and hasattr(FUNC,"__code__"):
+            currentframe().f_back.f_locals[FUNC.__code__.co_name]=self
+
+    def __aiter__(self):
+        """Async generators are their own async iterators"""
+        return self
+
+    def __anext__(self):
+        """Returns an awaitable of the next value"""
+        return AsyncState(self)
+
+    def asend(self,arg):
+        """
+        Returns an awaitable of the next value where arg
+        is sent to the functions yield variable
+        """
+        if self.state is None and arg is not None:
+            raise TypeError("can't send non-None value to a just-started async generator")
+        self._frame.f_locals[".send"]=arg
+        return AsyncState(self)
+
+    def athrow(self,exception):
+        """
+        Not implemented since the states can't raise an exception at the
+        yield they resume from (e.g. the try blocks around it aren't kept)
+        """
+        raise NotImplementedError("athrow is not implemented for '%s'" % type(self).__name__)
+
+    def aclose(self):
+        """Returns an awaitable that closes the generator"""
+        return AsyncCall(self.close)
+
+    def send(self,arg):
+        """Not supported since the states have to be awaited (see asend)"""
+        raise TypeError("'%s' object has no synchronous send (use asend)" % type(self).__name__)
+
+    def next_n(self,n):
+        """Not supported since the states have to be awaited"""
+        raise TypeError("'%s' object doesn't support next_n" % type(self).__name__)
+
+    def drain(self,into=list):
+        """Not supported since the states have to be awaited"""
+        raise TypeError("'%s' object doesn't support drain" % type(self).__name__)
+
+    def checkpoint(self,file,protocol=None,executor=None):
+        """
+        Returns an awaitable that pickles the generator to file via
+        dump_many in the executor (the default executor if None) so 
+        that pickling large locals doesn't block the event loop
+
+        Note: the generator can't be stepped until it's finished and it
+        has to be called while the event loop is running
+        """
+        try:
+            from asyncio import get_running_loop
+        except ImportError: ## i.e. python < 3.7 ##
+            from asyncio import get_event_loop as get_running_loop
+        if self.gi_running:
+            raise RuntimeError("can't checkpoint an asynchronous generator that's running")
+        loop=get_running_loop()
+        self.gi_running=True
+        def dump():
+            try:
+                dump_many(self,file,protocol)
+            finally:
+                self.gi_running=False
+        return loop.run_in_executor(executor,dump)
+
+################
+### reducers ###
+################
+class reduced(object):
+    """Pickles as a reduction e.g. (callable,args) or (callable,args,state) (see Reducers)"""
+    __slots__=('reduction',)
+
+    def __init__(self,reduction):
+        self.reduction=reduction
+
+    def __reduce__(self):
+        return self.reduction
+
+class Reducers(object):
+    """
+    A registry of compact reducers by type for the objects held in the 
+    locals of generators (e.g. the iterators of the loops they're in)
+
+    A reducer takes the object, a function that compacts the objects 
+    it refers to (e.g. the iterator an enumerate object wraps) and the
+    ids of the objects whose content is pickled anyway (i.e. the locals)
+    and returns a reduction that encodes its position rather than what 
+    it has already been through where possible (None to pickle it as is)
+    """
+    def __init__(self):
+        self._reducers={}
+
+    def register(self,cls,reducer=None):
+        """Registers the reducer of cls (returns a decorator if reducer isn't given)"""
+        if reducer is None:
+            return lambda reducer:self.register(cls,reducer)
+        self._reducers[cls]=reducer
+        return reducer
+
+    def unregister(self,cls):
+        """Removes the reducer of cls"""
+        self._reducers.pop(cls,None)
+
+    def reduce(self,obj,compact=None,shared=()):
+        """Gets the compact reduction of obj (None if it's to be pickled as is)"""
+        reducer=self._reducers.get(type(obj))
+        if reducer is None:
+            return None
+        return reducer(obj,compact or (lambda obj:obj),shared)
+
+    def compact(self,f_locals,*objs):
+        """
+        Gets f_locals with its values replaced by their compact reductions 
+        followed by the same for objs (e.g. gi_yieldfrom) where an object 
+        that's in more than one place is replaced by the same reduction
+        (i.e. so that it's still the same object once it's unpickled)
+        """
+        memo,shared={},set(id(value) for value in f_locals.values())
+        def compact(obj):
+            key=id(obj)
+            if not key in memo:
+                memo[key]=obj ## i.e. a reference cycle pickles it as is ##
+                reduction=self.reduce(obj,compact,shared)
+                if reduction is not None:
+                    memo[key]=reduced(reduction)
+            return memo[key]
+        ## the value stack of a BytecodeGenerator holds the iterators of its loops ##
+        f_locals=dict((name,tuple(compact(value) for value in value) if name==".stack" else compact(value))
+                      for name,value in f_locals.items())
+        return (f_locals,)+tuple(compact(obj) for obj in objs)
+
+def reduce_sequence_iterator(obj,compact,shared):
+    """Iterators over a sequence e.g. range, list, tuple, str, bytes: the rest of the sequence"""
+    reduction=obj.__reduce__()
+    if len(reduction) < 3: ## i.e. exhausted ##
+        return reduction
+    FUNC,(sequence,),index=reduction
+    if id(sequence) in shared: ## its position since the sequence is pickled anyway ##
+        return reduction
+    return (FUNC,(sequence[index:],))
+
+def reduce_reversed_iterator(obj,compact,shared):
+    """Reversed list iterators: the rest of the list e.g. what's before its position"""
+    reduction=obj.__reduce__()
+    if len(reduction) < 3:
+        return reduction
+    FUNC,(sequence,),index=reduction
+    if id(sequence) in shared:
+        return reduction
+    return (FUNC,(sequence[:index+1],))
+
+def reduce_nested(obj,compact,shared):
+    """Iterators over iterators e.g. enumerate, zip, map, itertools: compacts the iterators they're over"""
+    try:
+        reduction=obj.__reduce__()
+    except TypeError: ## i.e. not picklable (e.g. itertools in python 3.14+) ##
+        return None
+    FUNC,args=reduction[:2]
+    reduction=(FUNC,tuple(compact(arg) for arg in args))+reduction[2:]
+    if len(reduction) > 2 and isinstance(reduction[2],tuple):
+        reduction=reduction[:2]+(tuple(compact(item) for item in reduction[2]),)+reduction[3:]
+    return reduction
+
+def reduce_generator(obj,compact,shared):
+    """Native generators: adopted as a Generator (see Generator._adopt) or an empty iterator once exhausted"""
+    if obj.gi_frame is None:
+        return (iter,((),))
+    try:
+        generator=Generator(obj)
+    except (NotImplementedError,ValueError,TypeError,OSError,SyntaxError): ## i.e. it can't be adopted ##
+        return None
+    ## the same as copying it (see Pickler._copier) ##
+    return (type(generator),(generator.__getstate__(),))
+
+## process-wide registry of the compact reducers used when pickling the locals of generators ##
+reducers=Reducers()
+for cls in (type(iter(range(0))),type(iter(range(1 << 64))),type(iter([])),type(iter(())),
+            type(iter("")),type(iter(u"\u0100")),type(iter(b"")),type(iter(bytearray()))):
+    reducers.register(cls,reduce_sequence_iterator)
+reducers.register(type(reversed([])),reduce_reversed_iterator)
+for cls in (enumerate,zip,map,filter,itertools.accumulate,itertools.chain,itertools.compress,itertools.count,
+            itertools.cycle,itertools.dropwhile,itertools.filterfalse,itertools.groupby,itertools.islice,
+            itertools.repeat,itertools.starmap,itertools.takewhile,itertools.zip_longest):
+    reducers.register(cls,reduce_nested)
+reducers.register(GeneratorType,reduce_generator)
+
+## the size in bytes from which bytes, bytearrays and memoryviews in the locals of generators are pickled ##
+## as PickleBuffers with protocol 5 (i.e. so they can be out-of-band) and written out-of-band by dump_mapped ##
+buffer_threshold=int(environ.get("CUSTOM_GENERATOR_BUFFER_THRESHOLD",64*1024))
+
+## the formats memoryview.cast supports (e.g. not the struct formats with a byte order) ##
+native_formats=set("cbBhHiIlLqQnNfde?P")
+
+class Py_buffer(ctypes.Structure):
+    """The C struct that PyObject_GetBuffer fills (e.g. for buffer_address)"""
+    _fields_=[("buf",ctypes.c_void_p),("obj",ctypes.c_void_p),("len",ctypes.c_ssize_t),("itemsize",ctypes.c_ssize_t),
+              ("readonly",ctypes.c_int),("ndim",ctypes.c_int),("format",ctypes.c_char_p),("shape",ctypes.c_void_p),
+              ("strides",ctypes.c_void_p),("suboffsets",ctypes.c_void_p),("internal",ctypes.c_void_p)]
+
+def buffer_address(obj):
+    """Gets the address of the start of a C contiguous buffer (e.g. to get the offset of a view into its exporter)"""
+    buffer=Py_buffer()
+    ctypes.pythonapi.PyObject_GetBuffer(ctypes.py_object(obj),ctypes.byref(buffer),0)
+    try:
+        return buffer.buf
+    finally:
+        ctypes.pythonapi.PyBuffer_Release(ctypes.byref(buffer))
+
+def load_buffer(cls,buffer,format="B",shape=None):
+    """
+    Rebuilds a bytes, bytearray or memoryview from its pickled buffer (see
+    pickle_buffers) where an out-of-band buffer (e.g. a view of a memory 
+    map) is only copied for bytes and bytearrays since they own their data
+    """
+    if cls is memoryview:
+        view=memoryview(buffer)
+        return view if shape is None else view.cast("B").cast(format,shape)
+    if type(buffer) is cls: ## i.e. it was in-band ##
+        return buffer
+    return cls(buffer)
+
+def load_view(obj,offset,nbytes,format,shape):
+    """Rebuilds a memoryview of a bytes or bytearray (see pickle_buffers) as a slice and cast of it"""
+    view=memoryview(obj)[offset:offset+nbytes]
+    return view if (format,shape)==("B",(nbytes,)) else view.cast(format,shape)
+
+def pickle_buffers(f_locals):
+    """
+    Gets f_locals with its bytes, bytearrays and C contiguous memoryviews of 
+    at least buffer_threshold bytes replaced by reductions of PickleBuffers
+    of them (pickled in-band unless the pickler has a buffer_callback)
+
+    The memoryviews of a bytes or bytearray are reduced to a slice and cast
+    of their exporter which is pickled once (e.g. so that after loading 
+    them view.obj is the bytearray local and writing to one is seen by both)
+
+    Note: memoryviews with formats that can't be cast to (e.g. '<i') are 
+    left as they are
+    """
+    if PickleBuffer is None:
+        return f_locals
+    memo={}
+    def wrap_base(value):
+        key=id(value)
+        if not key in memo:
+            memo[key]=reduced((load_buffer,(type(value),PickleBuffer(value))))
+        return memo[key]
+    def wrap(value):
+        cls=type(value)
+        if cls is memoryview:
+            if not value.c_contiguous or not value.format.lstrip("@") in native_formats:
+                return value
+            base=value.obj
+            if type(base) in (bytes,bytearray) and cpython:
+                if len(base) < buffer_threshold:
+                    return value
+                key=id(value)
+                if not key in memo:
+                    offset=buffer_address(value)-buffer_address(base)
+                    memo[key]=reduced((load_view,(wrap_base(base),offset,value.nbytes,value.format,value.shape)))
+                return memo[key]
+            if value.nbytes < buffer_threshold:
+                return value
+            key=id(value)
+            if not key in memo:
+                memo[key]=reduced((load_buffer,(cls,PickleBuffer(value),value.format,value.shape)))
+            return memo[key]
+        if not cls in (bytes,bytearray) or len(value) < buffer_threshold:
+            return value
+        return wrap_base(value)
+    return dict((name,wrap(value)) for name,value in f_locals.items())
+
+class CompactPickler(pickle.Pickler):
+    """Pickles the objects that have a compact reducer by it (see Reducers)"""
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self._shared=set()
+        ## the protocol isn't exposed by the pickler (it's for pickle_buffers) ##
+        protocol=args[1] if len(args) > 1 else kwargs.get("protocol")
+        if protocol is None:
+            protocol=pickle.DEFAULT_PROTOCOL
+        self._protocol=pickle.HIGHEST_PROTOCOL if protocol < 0 else protocol
+
+    def share(self,objs):
+        """Marks objs as pickled in full (e.g. the locals) so the iterators over them only pickle their position"""
+        self._shared.update(id(obj) for obj in objs)
+
+    def reducer_override(self,obj):
+        reduction=reducers.reduce(obj,shared=self._shared)
+        return NotImplemented if reduction is None else reduction
+###################
+### checkpoints ###
+###################
+class CountingWriter(object):
+    """Wraps a file counting the bytes written to it (e.g. for the pickled_bytes stat)"""
+    __slots__=('file','count')
+
+    def __init__(self,file):
+        self.file,self.count=file,0
+
+    def write(self,data):
+        self.count+=memoryview(data).nbytes
+        return self.file.write(data)
+
+class CheckpointPickler(CompactPickler):
+    """
+    Pickles Generators as persistent ids that reference one record per
+    distinct transformation e.g. (engine,module,source,_source_lines,
+    jump_positions,marshalled gi_code,tag) that is written only once 
+    (via the pickle memo) followed by the generators own position, 
+    locals and whether it's suspended
+    """
+    def __init__(self,file,*args,**kwargs):
+        ## the bytes written are counted for the stats (the pickler buffers its output so it's per dump) ##
+        self._writer=CountingWriter(file) if stats.enabled else None
+        super().__init__(file if self._writer is None else self._writer,*args,**kwargs)
+        self._transformations,self._names={},[]
+
+    def dump(self,obj):
+        """Pickles obj adding the bytes written to the stats of the generators in it (split evenly)"""
+        if self._writer is None:
+            return super().dump(obj)
+        start,self._names=self._writer.count,[]
+        super().dump(obj)
+        size,names=self._writer.count-start,self._names
+        for index,name in enumerate(names):
+            stats.add(name,pickled_bytes=size*(index+1)//len(names)-size*index//len(names))
+
+    def _transformation(self,generator):
+        """Gets the record of a generators transformation (the same object for the same function)"""
+        key=(type(generator),generator.engine,generator.source or code_key(generator.gi_code))
+        transformation=self._transformations.get(key)
+        if transformation is None:
+            transformation=self._transformations[key]=(generator.engine,generator._module,generator.source,
+                                                        generator._source_lines,generator.jump_positions,
+                                                        marshal.dumps(generator.gi_code.to_code()),DiskCache.tag)
+        return transformation
+
+    def persistent_id(self,obj):
+        if isinstance(obj,Generator):
+            f_locals=None if obj.gi_frame is None else obj.gi_frame.f_locals
+            if f_locals:
+                self.share(f_locals.values())
+                if self._protocol >= 5:
+                    f_locals=pickle_buffers(f_locals)
+            pid=(type(obj),self._transformation(obj),obj._position(),f_locals,obj.gi_suspended)
+            if self._writer is not None:
+                self._names+=[obj._stats_name()]
+            return pid
+        return None
+
+class CheckpointUnpickler(pickle.Unpickler):
+    """Unpickles what's been pickled by CheckpointPickler"""
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self._shared={}
+
+    def persistent_load(self,pid):
+        cls,transformation,position,f_locals,suspended=pid
+        engine,module,source,lines,jump_positions,gi_code,tag=transformation
+        ## the transformation is the same object for the same function so its code only needs to be loaded once ##
+        if not id(transformation) in self._shared:
+            if tag!=DiskCache.tag:
+                raise UnpicklingError("checkpoint was made with '%s' but this is '%s'" % (tag,DiskCache.tag))
+            self._shared[id(transformation)]=(transformation,code_record(marshal.loads(gi_code)))
+        gi_code=self._shared[id(transformation)][1]
+        self=cls(dict(_module=module,_source_lines=lines,engine=engine,gi_code=gi_code,gi_frame=frame(),gi_running=False,
+                      gi_suspended=suspended,gi_yieldfrom=None,jump_positions=jump_positions,lineno=None,source=source))
+        self._restore(position,f_locals)
+        self.gi_suspended=suspended
+        return self
+
+def dump_many(obj,file,protocol=None):
+    """
+    Pickles obj (i.e. a list of Generators) to file where the transformation 
+    of every distinct function is only written once; the generators in obj
+    then only write their position and locals
+    """
+    CheckpointPickler(file,protocol).dump(obj)
+
+def load_many(file):
+    """Loads what was pickled by dump_many"""
+    return CheckpointUnpickler(file).load()
+
+def dump_mapped(obj,path,protocol=5):
+    """
+    Pickles obj (i.e. a list of Generators; see dump_many) to path with 
+    the large buffers (e.g. bytes, bytearrays, memoryviews and NumPy 
+    arrays in their locals) written out-of-band to a side file 
+    (path+'.buffers') that load_mapped memory maps instead of reading
+
+    path starts with a table of the (offset,size) of each buffer in the 
+    side file followed by the pickle itself
+    """
+    buffers=[]
+    def buffer_callback(buffer):
+        if buffer.raw().nbytes < buffer_threshold: ## i.e. in-band ##
+            return True
+        buffers.append(buffer)
+        return False
+    file=BytesIO()
+    CheckpointPickler(file,protocol,buffer_callback=buffer_callback).dump(obj)
+    table,offset=[],0
+    with open(path+".buffers","wb") as side_file:
+        for buffer in buffers:
+            data=buffer.raw()
+            offset+=-offset % 64 ## aligned e.g. for NumPy ##
+            side_file.seek(offset)
+            side_file.write(data)
+            table+=[(offset,data.nbytes)]
+            offset+=data.nbytes
+    with open(path,"wb") as main_file:
+        pickle.dump(table,main_file,protocol)
+        main_file.write(file.getbuffer())
+
+def load_mapped(path):
+    """
+    Loads what was pickled by dump_mapped where the out-of-band buffers are 
+    views of a copy on write memory map of the side file (e.g. they're only
+    read from disk once accessed and changing them doesn't change the file)
+    """
+    with open(path,"rb") as main_file:
+        table=pickle.load(main_file)
+        views=[]
+        if table:
+            with open(path+".buffers","rb") as side_file:
+                view=memoryview(mmap.mmap(side_file.fileno(),0,access=mmap.ACCESS_COPY))
+            views=[view[offset:offset+size] for offset,size in table]
+        return CheckpointUnpickler(main_file,buffers=views).load()
+
+## types whose identity is meaningless (e.g. small ints and interned strs are shared by unrelated locals) ##
+atomic_types=(type(None),bool,int,float,complex,str,bytes,type(Ellipsis))
+
+def fingerprint(value):
+    """
+    Gets a cheap fingerprint of a mutable container or writable buffer so 
+    that mutating it in place can be found by checkpoint_delta (None for
+    anything else e.g. immutable objects only change by being rebound)
+
+    Note: containers are fingerprinted shallowly by the ids of their items
+    and buffers by the crc32 of their bytes
+    """
+    if isinstance(value,dict):
+        return hash((tuple(map(id,value)),tuple(map(id,value.values()))))
+    if isinstance(value,(list,deque)):
+        return hash(tuple(map(id,value)))
+    if isinstance(value,set):
+        return hash(frozenset(map(id,value)))
+    if isinstance(value,atomic_types):
+        return None
+    try:
+        view=memoryview(value)
+    except TypeError:
+        return None
+    with view:
+        if view.readonly:
+            return None
+        return zlib.crc32(view if view.c_contiguous else view.tobytes())
+
+class DeltaPickler(CompactPickler):
+    """
+    Pickles the delta of Generator.checkpoint_delta where the values of
+    the unchanged locals are pickled as persistent ids of their names 
+    (i.e. so that the iterators of the loops don't pickle what they're
+    iterating over) which get resolved by the locals of the generator 
+    the delta gets applied to
+
+    Note: atomic values (see atomic_types) are always pickled by value
+    """
+    def __init__(self,file,unchanged,protocol=None):
+        super().__init__(file,protocol)
+        self._unchanged=dict((id(value),name) for name,value in unchanged.items() if not isinstance(value,atomic_types))
+
+    def persistent_id(self,obj):
+        return self._unchanged.get(id(obj))
+
+class DeltaUnpickler(pickle.Unpickler):
+    """Unpickles what's been pickled by DeltaPickler"""
+    def __init__(self,file,f_locals):
+        super().__init__(file)
+        self._f_locals=f_locals
+
+    def persistent_load(self,pid):
+        return self._f_locals[pid]
+
+################
+### parallel ###
+################
+def parallel_worker(payload,queue,chunksize):
+    """
+    Runs in a worker process of parallel_map; it loads its share of 
+    the generators (e.g. (index,generator) pairs pickled by dump_many) 
+    and puts their values on the queue in chunks of (index,values)
+
+    It puts (None,exception) if an exception is raised and None once it's finished
+
+    Note: the chunks are pickled here rather than by the queue's feeder 
+    thread (which only prints what it fails to pickle) so that an 
+    unpicklable value is raised as an exception in parallel_map
+    """
+    try:
+        for index,generator in load_many(BytesIO(payload)):
+            values=generator.next_n(chunksize)
+            while values:
+                queue.put(pickle.dumps((index,values),pickle.HIGHEST_PROTOCOL))
+                if len(values) < chunksize: ## i.e. it's exhausted ##
+                    break
+                values=generator.next_n(chunksize)
+    except Exception as error:
+        try:
+            item=pickle.dumps((None,error),pickle.HIGHEST_PROTOCOL)
+            pickle.loads(item) ## e.g. exceptions whose __init__ takes other arguements pickle but fail to unpickle ##
+        except Exception:
+            item=pickle.dumps((None,RuntimeError("%s\n(raised in a parallel_map worker)\n%s" % (repr(error),format_exc()))))
+        queue.put(item)
+    finally:
+        queue.put(None)
+
+def parallel_map(generators,workers=None,chunksize=1024):
+    """
+    Resumes the generators in worker processes yielding (index,values)
+    in chunks of up to chunksize values as they arrive where index is 
+    the position of the generator in generators (the chunks of each
+    generator arrive in order)
+
+    The generators are split round robin across the workers (defaults
+    to the number of cpus) and each workers share is pickled once via 
+    dump_many so that the transformations are only written once
+
+    Note: the generators in this process are not advanced
+    """
+    from multiprocessing import Process,Queue,cpu_count
+    try:
+        from queue import Empty
+    except ImportError: ## i.e. python 2 ##
+        from Queue import Empty
+    generators=list(generators)
+    workers=min(workers or cpu_count(),len(generators))
+    queue,processes=Queue(),[]
+    try:
+        for worker in range(workers):
+            file=BytesIO()
+            dump_many([(index,generators[index]) for index in range(worker,len(generators),workers)],file)
+            process=Process(target=parallel_worker,args=(file.getvalue(),queue,chunksize))
+            process.daemon=True
+            process.start()
+            processes+=[process]
+        while workers:
+            try:
+                item=queue.get(timeout=1)
+            except Empty:
+                ## a worker exits once its values are flushed so a failing exitcode means it crashed ##
+                for process in processes:
+                    if process.exitcode:
+                        raise RuntimeError("a parallel_map worker exited with exitcode %s" % process.exitcode)
+                continue
+            if item is None:
+                workers-=1
+                continue
+            item=pickle.loads(item)
+            if item[0] is None:
+                raise item[1]
+            yield item
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
 ## add the type annotations if the version is 3.5 or higher ##
 if (3,5) <= version_info:
-    from typing import Callable,Any,NoReturn,Iterable,Generator as builtin_Generator,AsyncGenerator,Coroutine
-    from types import CodeType,FrameType
+    from typing import Callable,Any,NoReturn,Iterable,Iterator,BinaryIO,Generator as builtin_Generator,AsyncGenerator as builtin_AsyncGenerator,Coroutine,Awaitable
+    from types import CodeType,FrameType,ModuleType
     ## tracking ##
-    track_iter.__annotations__={"obj":object,"return":Iterable}
+    track_iter.__annotations__={"obj":object,"hidden":dict|None,"key":str|None,"return":Iterable}
+    track_aiter.__annotations__={"obj":object,"hidden":dict,"key":str,"return":object}
     untrack_iters.__annotations__={"return":None}
     decref.__annotations__={"key":str,"return":None}
     ## cleaning source code ##
@@ -1131,25 +3932,105 @@ if (3,5) <= version_info:
     skip.__annotations__={"iter_val":Iterable,"n":int,"return":None}
     is_alternative_statement.__annotations__={"line":str,"return":bool}
     ## code adjustments ##
-    skip_alternative_statements.__annotations__={"line_iter":enumerate,"return":tuple[int,str,int]}
-    control_flow_adjust.__annotations__={"lines":list[str],"indexes":list[int],"return":tuple[bool,list[str],list[int]]}
+    skip_alternative_statements.__annotations__={"lines":list[str],"index":int,"blocks":tuple[Block|None,...]|None,"offset":int,"return":int}
+    control_flow_adjust.__annotations__={"lines":list[str],"indexes":list[int],"reference_indent":int,"blocks":tuple[Block|None,...]|None,"return":tuple[bool,list[str],list[int]]}
     indent_lines.__annotations__={"lines":list[str],"indent":int,"return":list[str]}
     temporary_loop_adjust.__annotations__={"lines":list[str],"indexes":list[int],"outer_loop":list[str],"pos":tuple[int,int],"return":tuple[list[str],list[int]]}
     has_node.__annotations__={"line":str,"node":str,"return":bool}
     send_adjust.__annotations__={"line":str,"return":tuple[None|int,None|list[str,str]]}
-    get_loops.__annotations__={"lineno":int,"jump_positions":list[tuple[int,int]],"return":list[tuple[int,int]]}
+    Block.__init__.__annotations__={"kind":str,"start":int,"end":int|None,"indent":int,"parent":Block|None,"return":None}
+    Block.__repr__.__annotations__={"return":str}
+    block_kind.__annotations__={"line":str,"return":str|None}
+    block_tree.__annotations__={"lines":list[str]|tuple[str,...],"return":tuple[Block|None,...]}
+    get_loops.__annotations__={"index":int,"blocks":tuple[Block|None,...],"return":list[Block]}
+    yield_indexes.__annotations__={"lines":list[str]|tuple[str,...],"blocks":tuple[Block|None,...],"return":tuple[int,...]}
+    batch_adjust.__annotations__={"lines":list[str],"return":list[str]}
+    state_args.__annotations__={"f_locals":dict,"code_obj":CodeType,"start":int,"return":list}
+    compile_state.__annotations__={"source":str,"return":CodeType}
+    state_function.__annotations__={"code_obj":CodeType,"module_name":str|None,"return":FunctionType}
+    yield_from_adjust.__annotations__={"indent":str,"expr":str,"reciever":str,"return":list[str]}
+    ## ast adjustments ##
+    function_body.__annotations__={"source":str,"return":list[ast.stmt]}
+    source_segment.__annotations__={"node":ast.AST,"source_lines":list[str]|None,"return":str}
+    assignment_source.__annotations__={"node":ast.stmt,"value":str,"source_lines":list[str]|None,"return":str}
+    ast_statement_adjust.__annotations__={"node":ast.stmt,"indent":str,"source_lines":list[str]|None,"return":list[str]}
+    ast_block_adjust.__annotations__={"body":list[ast.stmt],"lines":list[str],"jump_positions":list[list[int]],"indent":int,"source_lines":list[str]|None,"return":list[str]}
+    ast_else_adjust.__annotations__={"orelse":list[ast.stmt],"lines":list[str],"jump_positions":list[list[int]],"indent":int,"source_lines":list[str]|None,"return":None}
+    ## bytecode ##
+    Null.__reduce__.__annotations__={"return":str}
+    code_key.__annotations__={"code_obj":CodeType,"return":tuple}
+    local_names.__annotations__={"code_obj":CodeType,"return":tuple[str,...]}
+    async_generator_created.__annotations__={"native":builtin_AsyncGenerator,"return":bool}
+    start_lasti.__annotations__={"code_obj":CodeType,"return":int}
+    emit.__annotations__={"opname":str,"arg":int,"return":bytes}
+    varint.__annotations__={"value":int,"return":list[int]}
+    shift_exception_table.__annotations__={"exceptiontable":bytes,"n":int,"return":bytes}
+    resume_code.__annotations__={"code_obj":CodeType,"lasti":int,"unbound":tuple[str,...],"stack":int,"nulls":tuple[int,...],"return":tuple[CodeType,int]}
+    frame_stack.__annotations__={"frame_obj":FrameType,"return":tuple}
     ## expr_getsource ##
     code_attrs.__annotations__={"return":tuple[str,...]}
     attr_cmp.__annotations__={"obj1":object,"obj2":object,"attr":tuple[str,...],"return":bool}
-    getcode.__annotations__={"obj":FunctionType|builtin_Generator|AsyncGenerator|Coroutine,"return":CodeType}
-    getframe.__annotations__={"obj":FunctionType|builtin_Generator|AsyncGenerator|Coroutine,"return":FrameType}
-    expr_getsource.__annotations__={"FUNC":FunctionType|builtin_Generator|AsyncGenerator|Coroutine,"return":str}
+    getcode.__annotations__={"obj":FunctionType|builtin_Generator|builtin_AsyncGenerator|Coroutine,"return":CodeType}
+    getframe.__annotations__={"obj":FunctionType|builtin_Generator|builtin_AsyncGenerator|Coroutine,"return":FrameType}
+    code_span.__annotations__={"code_obj":CodeType,"return":tuple[int,int,int,int]}
+    yield_offsets.__annotations__={"code_obj":CodeType,"return":dict[int,int]}
+    expr_consts.__annotations__={"node":ast.Lambda|ast.GeneratorExp,"return":set[str]}
+    source_index.__annotations__={"filename":str,"return":dict[tuple[int,str],list[tuple[str,set[str],tuple[int,int,int,int]]]]}
+    expr_getsource.__annotations__={"FUNC":FunctionType|builtin_Generator|builtin_AsyncGenerator|Coroutine,"return":str}
+    eval_getsource.__annotations__={"FUNC":FunctionType|builtin_Generator|builtin_AsyncGenerator|Coroutine,"return":str}
     ## genexpr ##
     extract_genexpr.__annotations__={"source_lines":list[str],"return":builtin_Generator}
     unpack_genexpr.__annotations__={"source":str,"return":list[str]}
+    is_genexpr.__annotations__={"FUNC":object,"return":bool}
+    genexpr_node.__annotations__={"source":str,"return":ast.GeneratorExp}
+    genexpr_lines.__annotations__={"source":str,"return":list[str]}
     ## lambda ##
     extract_lambda.__annotations__={"source_code":str,"return":builtin_Generator}
+    lambda_definition.__annotations__={"source":str,"return":str}
+    ## caching ##
+    Cache.__init__.__annotations__={"maxsize":int|None,"maxbytes":int|None,"sizeof":Callable|None,"return":None}
+    Cache.get.__annotations__={"key":object,"default":Any,"return":Any}
+    Cache.set.__annotations__={"key":object,"value":Any,"return":None}
+    Cache._evict.__annotations__={"return":None}
+    Cache.resize.__annotations__={"maxsize":int|None,"maxbytes":int|None,"return":None}
+    Cache.clear.__annotations__={"return":None}
+    Cache.info.__annotations__={"return":dict}
+    Cache.__len__.__annotations__={"return":int}
+    Cache.__contains__.__annotations__={"key":object,"return":bool}
+    state_sizeof.__annotations__={"entry":tuple[str,tuple[int,...],CodeType],"return":int}
+    DiskCache.__init__.__annotations__={"directory":str|None,"return":None}
+    DiskCache.set_directory.__annotations__={"directory":str|None,"return":None}
+    DiskCache._path.__annotations__={"engine":str,"source":str,"return":str}
+    DiskCache.load.__annotations__={"engine":str,"source":str,"return":tuple[tuple[str,...],tuple[tuple[int,int],...]]|None}
+    DiskCache.save.__annotations__={"engine":str,"source":str,"lines":tuple[str,...],"jump_positions":tuple[tuple[int,int],...],"return":None}
+    DiskCache.add_state.__annotations__={"engine":str,"source":str,"lineno":int,"names":tuple[str,...],"entry":tuple[str,tuple[int,...],CodeType],"return":None}
+    DiskCache._read_states.__annotations__={"file":BinaryIO,"return":dict}
+    DiskCache._write.__annotations__={"path":str,"record":dict,"return":None}
+    DiskCache._append.__annotations__={"path":str,"state":tuple,"return":None}
+    DiskCache._remove.__annotations__={"path":str,"return":None}
+    DiskCache.prune.__annotations__={"return":None}
+    DiskCache.clear.__annotations__={"return":None}
+    Stats.__init__.__annotations__={"enabled":bool,"return":None}
+    Stats.enable.__annotations__={"return":None}
+    Stats.disable.__annotations__={"return":None}
+    Stats.add.__annotations__={"name":str,"values":int|float,"return":None}
+    Stats.get.__annotations__={"name":str,"return":dict}
+    Stats.clear.__annotations__={"return":None}
+    Stats.info.__annotations__={"return":dict}
+    SourceRegistry.__init__.__annotations__={"bundle":str|None,"return":None}
+    SourceRegistry.add.__annotations__={"filename":str,"source":str,"return":None}
+    SourceRegistry.register.__annotations__={"obj":FunctionType|CodeType|ModuleType,"return":FunctionType|CodeType|ModuleType}
+    SourceRegistry.get.__annotations__={"filename":str,"return":tuple[tuple[str,...],int]|None}
+    SourceRegistry.getlines.__annotations__={"filename":str,"return":list[str]}
+    SourceRegistry.getsource.__annotations__={"obj":FunctionType|CodeType,"return":str}
+    SourceRegistry.dump.__annotations__={"path":str,"return":None}
+    SourceRegistry.load.__annotations__={"path":str,"return":None}
+    SourceRegistry.clear.__annotations__={"return":None}
+    SourceRegistry.__contains__.__annotations__={"filename":str,"return":bool}
     ### utility functions ###
+    source_hash.__annotations__={"source":str|bytes,"return":str}
+    code_hash.__annotations__={"code_obj":CodeType,"return":str}
+    load_compact.__annotations__={"cls":type,"reference":tuple[str|None,str,str|None,str],"position":tuple[int,...],"f_locals":dict|None,"return":Generator}
     Pickler.__copy__.__annotations__={"return":Pickler}
     Pickler.__deepcopy__.__annotations__={"memo":dict,"return":Pickler}
     Pickler.__getstate__.__annotations__={"return":dict}
@@ -1157,22 +4038,144 @@ if (3,5) <= version_info:
     frame.__init__.__annotations__={"frame":FrameType|None,"return":None}
     frame.clear.__annotations__={"return":None}
     frame.__bool__.__annotations__={"return":bool}
+    frame.__reduce_ex__.__annotations__={"protocol":int,"return":tuple}
+    frame_state.__init__.__annotations__={"frame":FrameType|dict|None,"return":None}
     code.__init__.__annotations__={"code":CodeType|None,"return":None}
+    code.to_code.__annotations__={"return":CodeType}
     code.__bool__.__annotations__={"return":bool}
     ### Generator ###
     Generator._custom_adjustment.__annotations__={"line":str,"lineno":int,"return":list[str]}
+    Generator._yield_from_adjust.__annotations__={"indent":str,"expr":str,"lineno":int,"reciever":str,"return":list[str]}
     Generator._clean_source_lines.__annotations__={"return":list[str]}
+    Generator._ast_clean_source_lines.__annotations__={"return":list[str]}
     Generator._create_state.__annotations__={"return":None}
+    Generator._get_blocks.__annotations__={"return":tuple[Block|None,...]}
+    Generator._adopt.__annotations__={"native":builtin_Generator,"return":None}
+    Generator._lasti_lineno.__annotations__={"code_obj":CodeType,"lasti":int,"return":int}
+    Generator._loop_iterators.__annotations__={"native":builtin_Generator,"f_locals":dict,"return":dict[str,Iterator]}
+    Generator._load_state.__annotations__={"return":None}
+    Generator._load_batch_state.__annotations__={"return":CodeType}
     Generator.init_states.__annotations__={"return":Iterable}
-    Generator.__init__.__annotations__={"FUNC":Callable|str|builtin_Generator|dict,"return":None}
+    Generator._init_source.__annotations__={"key":object,"get_source":Callable,"get_code":Callable,"unpack":Callable|None,"return":None}
+    Generator.__new__.__annotations__={"FUNC":Callable|str|builtin_Generator|dict|None,"return":Generator}
+    Generator.__init__.__annotations__={"FUNC":Callable|str|builtin_Generator|dict,"overwrite":bool,"engine":str|None,"return":None}
     Generator.__len__.__annotations__={"return":int}
     Generator.__iter__.__annotations__={"return":Iterable}
     Generator.__next__.__annotations__={"return":Any}
+    Generator._save_frame.__annotations__={"state_frames":list[FrameType],"return":None}
+    Generator._get_frame.__annotations__={"return":frame|FrameType|None}
+    Generator._set_frame.__annotations__={"value":frame|frame_state|FrameType|None,"return":None}
     Generator.send.__annotations__={"arg":Any,"return":Any}
+    Generator.next_n.__annotations__={"n":int|float,"return":list}
+    Generator.drain.__annotations__={"into":type|list,"return":Iterable}
     Generator.close.__annotations__={"return":None}
     Generator.throw.__annotations__={"exception":Exception,"return":NoReturn}
     Generator._copier.__annotations__={"FUNC":Callable,"return":Generator}
     Generator.__copy__.__annotations__={"return":Generator}
     Generator.__deepcopy__.__annotations__={"memo":dict,"return":Generator}
     Generator.__getstate__.__annotations__={"return":dict}
+    Generator._track.__annotations__={"old":dict,"new":dict,"return":None}
+    Generator.mark_dirty.__annotations__={"name":str,"return":None}
+    Generator.checkpoint_delta.__annotations__={"protocol":int|None,"return":bytes}
+    Generator.apply_delta.__annotations__={"delta":bytes,"return":None}
     Generator.__setstate__.__annotations__={"state":dict,"return":None}
+    Generator._hash.__annotations__={"return":str}
+    Generator._reference.__annotations__={"return":tuple[str|None,str,str|None,str]}
+    Generator._position.__annotations__={"return":tuple[int,...]}
+    Generator._stats_name.__annotations__={"return":str}
+    Generator.stats.__annotations__={"return":dict}
+    Generator._restore.__annotations__={"position":tuple[int,...],"f_locals":dict|None,"return":None}
+    Generator.__reduce_ex__.__annotations__={"protocol":int,"return":tuple}
+    BytecodeGenerator.__init__.__annotations__={"FUNC":Callable|builtin_Generator|dict,"overwrite":bool,"return":None}
+    BytecodeGenerator._init_code.__annotations__={"code_obj":CodeType,"return":None}
+    BytecodeGenerator._snapshot.__annotations__={"native":builtin_Generator,"offset":int,"return":None}
+    BytecodeGenerator._get_frame.__annotations__={"return":frame}
+    BytecodeGenerator._set_frame.__annotations__={"value":frame|None,"return":None}
+    BytecodeGenerator._load_state.__annotations__={"return":None}
+    BytecodeGenerator._resume.__annotations__={"return":builtin_Generator}
+    BytecodeGenerator.__next__.__annotations__={"return":Any}
+    BytecodeGenerator.send.__annotations__={"arg":Any,"return":Any}
+    BytecodeGenerator.next_n.__annotations__={"n":int|float,"return":list}
+    BytecodeGenerator.throw.__annotations__={"exception":Exception,"return":Any}
+    BytecodeGenerator.close.__annotations__={"return":None}
+    BytecodeGenerator.apply_delta.__annotations__={"delta":bytes,"return":None}
+    BytecodeGenerator.__setstate__.__annotations__={"state":dict,"return":None}
+    BytecodeGenerator._hash.__annotations__={"return":str}
+    BytecodeGenerator._position.__annotations__={"return":tuple[int,int]}
+    BytecodeGenerator._restore.__annotations__={"position":tuple[int,int],"f_locals":dict|None,"return":None}
+    GenexprGenerator.__init__.__annotations__={"FUNC":str|builtin_Generator|dict,"overwrite":bool,"engine":str|None,"return":None}
+    GenexprGenerator._adopt.__annotations__={"native":builtin_Generator,"return":None}
+    GenexprGenerator._snapshot.__annotations__={"native":builtin_Generator,"return":None}
+    GenexprGenerator._get_frame.__annotations__={"return":frame|None}
+    GenexprGenerator._set_frame.__annotations__={"value":frame|None,"return":None}
+    GenexprGenerator._load_state.__annotations__={"return":None}
+    GenexprGenerator._resume.__annotations__={"return":builtin_Generator}
+    GenexprGenerator.__next__.__annotations__={"return":Any}
+    GenexprGenerator.send.__annotations__={"arg":Any,"return":Any}
+    GenexprGenerator.next_n.__annotations__={"n":int|float,"return":list}
+    GenexprGenerator.throw.__annotations__={"exception":Exception,"return":Any}
+    GenexprGenerator.close.__annotations__={"return":None}
+    GenexprGenerator.apply_delta.__annotations__={"delta":bytes,"return":None}
+    GenexprGenerator.__setstate__.__annotations__={"state":dict,"return":None}
+    ## AsyncGenerator ##
+    AsyncState.__init__.__annotations__={"generator":AsyncGenerator,"return":None}
+    AsyncState.__await__.__annotations__={"return":AsyncState}
+    AsyncState.__next__.__annotations__={"return":Any}
+    AsyncState.send.__annotations__={"value":Any,"return":Any}
+    AsyncState.throw.__annotations__={"return":Any}
+    AsyncState.close.__annotations__={"return":None}
+    AsyncState._start.__annotations__={"return":None}
+    AsyncState._step.__annotations__={"FUNC":Callable,"return":Any}
+    AsyncState._finish.__annotations__={"return":None}
+    AsyncCall.__init__.__annotations__={"FUNC":Callable,"return":None}
+    AsyncCall.__await__.__annotations__={"return":AsyncCall}
+    AsyncCall.__next__.__annotations__={"return":NoReturn}
+    AsyncCall.send.__annotations__={"value":Any,"return":NoReturn}
+    AsyncGenerator.__aiter__.__annotations__={"return":AsyncGenerator}
+    AsyncGenerator.__anext__.__annotations__={"return":AsyncState}
+    AsyncGenerator.asend.__annotations__={"arg":Any,"return":AsyncState}
+    AsyncGenerator.__init__.__annotations__={"FUNC":Callable|str|builtin_AsyncGenerator|dict,"overwrite":bool,"engine":str|None,"return":None}
+    AsyncGenerator.athrow.__annotations__={"exception":Exception,"return":NoReturn}
+    AsyncGenerator.aclose.__annotations__={"return":AsyncCall}
+    AsyncGenerator.send.__annotations__={"arg":Any,"return":NoReturn}
+    AsyncGenerator.next_n.__annotations__={"n":int|float,"return":NoReturn}
+    AsyncGenerator.drain.__annotations__={"into":type|list,"return":NoReturn}
+    AsyncGenerator.checkpoint.__annotations__={"file":BinaryIO,"protocol":int|None,"executor":object|None,"return":Awaitable}
+    code_record.__annotations__={"code_obj":CodeType,"return":code}
+    ### reducers ###
+    reduced.__init__.__annotations__={"reduction":tuple,"return":None}
+    reduced.__reduce__.__annotations__={"return":tuple}
+    Reducers.__init__.__annotations__={"return":None}
+    Reducers.register.__annotations__={"cls":type,"reducer":Callable|None,"return":Callable}
+    Reducers.unregister.__annotations__={"cls":type,"return":None}
+    Reducers.reduce.__annotations__={"obj":object,"compact":Callable|None,"shared":set[int]|tuple,"return":tuple|None}
+    Reducers.compact.__annotations__={"f_locals":dict,"objs":object,"return":tuple}
+    reduce_sequence_iterator.__annotations__={"obj":Iterator,"compact":Callable,"shared":set[int]|tuple,"return":tuple}
+    reduce_reversed_iterator.__annotations__={"obj":Iterator,"compact":Callable,"shared":set[int]|tuple,"return":tuple}
+    reduce_nested.__annotations__={"obj":Iterator,"compact":Callable,"shared":set[int]|tuple,"return":tuple|None}
+    reduce_generator.__annotations__={"obj":builtin_Generator,"compact":Callable,"shared":set[int]|tuple,"return":tuple|None}
+    load_buffer.__annotations__={"cls":type,"buffer":memoryview,"format":str,"shape":tuple|None,"return":bytes|bytearray|memoryview}
+    buffer_address.__annotations__={"obj":object,"return":int}
+    load_view.__annotations__={"obj":bytes|bytearray,"offset":int,"nbytes":int,"format":str,"shape":tuple[int,...],"return":memoryview}
+    pickle_buffers.__annotations__={"f_locals":dict,"return":dict}
+    CompactPickler.__init__.__annotations__={"return":None}
+    CompactPickler.share.__annotations__={"objs":Iterable,"return":None}
+    CompactPickler.reducer_override.__annotations__={"obj":object,"return":tuple}
+    ### checkpoints ###
+    CheckpointPickler.__init__.__annotations__={"file":BinaryIO,"return":None}
+    CheckpointPickler.dump.__annotations__={"obj":object,"return":None}
+    CheckpointPickler._transformation.__annotations__={"generator":Generator,"return":tuple}
+    CheckpointPickler.persistent_id.__annotations__={"obj":object,"return":tuple|None}
+    CheckpointUnpickler.persistent_load.__annotations__={"pid":tuple,"return":Generator}
+    dump_many.__annotations__={"obj":object,"file":BinaryIO,"protocol":int|None,"return":None}
+    load_many.__annotations__={"file":BinaryIO,"return":object}
+    dump_mapped.__annotations__={"obj":object,"path":str,"protocol":int,"return":None}
+    load_mapped.__annotations__={"path":str,"return":object}
+    fingerprint.__annotations__={"value":object,"return":int|None}
+    DeltaPickler.__init__.__annotations__={"file":BinaryIO,"unchanged":dict,"protocol":int|None,"return":None}
+    DeltaPickler.persistent_id.__annotations__={"obj":object,"return":str|None}
+    DeltaUnpickler.__init__.__annotations__={"file":BinaryIO,"f_locals":dict,"return":None}
+    DeltaUnpickler.persistent_load.__annotations__={"pid":str,"return":object}
+    ### parallel ###
+    parallel_worker.__annotations__={"payload":bytes,"queue":object,"chunksize":int,"return":None}
+    parallel_map.__annotations__={"generators":Iterable,"workers":int|None,"chunksize":int,"return":Iterable[tuple[int,list]]}
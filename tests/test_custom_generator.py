@@ -0,0 +1,699 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests for the custom_generator module
+
+Usage:
+
+python -m pytest tests
+"""
+import pickle
+import asyncio
+import io
+from copy import copy,deepcopy
+import sys
+import os
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import custom_generator
+from custom_generator import Generator,BytecodeGenerator,AsyncGenerator,Cache,DiskCache,reduce_generator,frame_stack,resume_code,load_many,dump_mapped,load_mapped
+
+def simple_loop(n):
+    for i in range(n):
+        yield i
+
+lambda_yield_from=lambda n: (yield from range(n))
+
+def returns_value():
+    yield 1
+    return 2
+
+def bare_return(n):
+    yield 1
+    if n:
+        return
+    yield 2
+
+def runs_off_the_end():
+    x=1
+    yield x
+
+def test_return_raises_stop_iteration_with_the_value():
+    gen=Generator(returns_value)
+    assert next(gen) == 1
+    try:
+        next(gen)
+    except StopIteration as error:
+        assert error.value == 2
+    else:
+        raise AssertionError("StopIteration was not raised")
+    assert gen.gi_frame is None
+
+def test_bare_return_closes_the_generator():
+    gen=Generator(bare_return)
+    gen._frame.f_locals=dict(n=1)
+    assert list(gen) == [1]
+    gen=Generator(bare_return)
+    gen._frame.f_locals=dict(n=0)
+    assert list(gen) == [1,2]
+
+def test_end_of_function_closes_the_generator():
+    gen=Generator(runs_off_the_end)
+    assert list(gen) == [1]
+    assert gen.gi_frame is None
+    assert list(gen) == []
+
+def genexpr_in_locals(x):
+    g=(i for i in x)
+    yield next(g)
+    yield next(g)
+
+def test_reduce_generator_falls_back_without_source():
+    ## a genexpr created in a state has no source to adopt it from ##
+    gen=Generator(genexpr_in_locals)
+    gen.gi_frame.f_locals["x"]=[1,2,3]
+    assert next(gen) == 1
+    g=gen.gi_frame.f_locals["g"]
+    assert reduce_generator(g,None,()) is None
+    ## it's left as is for the default reduction ##
+    assert custom_generator.reducers.compact(gen.gi_frame.f_locals)[0]["g"] is g
+    ## i.e. the default reduction's error and not the source lookup's ##
+    try:
+        custom_generator.CompactPickler(io.BytesIO()).dump(g)
+    except TypeError as error:
+        assert "cannot pickle 'generator' object" in str(error)
+    else:
+        raise AssertionError("TypeError was not raised")
+
+def test_bytecode_generator_pickle_round_trip():
+    assert list(pickle.loads(pickle.dumps(BytecodeGenerator(simple_loop(3))))) == [0,1,2]
+    gen=BytecodeGenerator(simple_loop(3))
+    assert next(gen) == 0
+    assert list(pickle.loads(pickle.dumps(gen))) == [1,2]
+
+def test_lambda_source():
+    gen=Generator(lambda_yield_from)
+    gen.gi_frame.f_locals["n"]=3
+    assert next(gen) == 0
+    assert list(pickle.loads(pickle.dumps(gen))) == [1,2]
+
+def ast_engine_shapes(n):
+    s="héllo"; t='wörld'
+    values=[i
+            for i in range(n)]
+    def one(y): return y
+    for i in values:
+        x=yield s[i]+t[i]
+        if x: yield one(x)
+    yield
+
+def test_ast_engine_matches_native():
+    gen=Generator(ast_engine_shapes(3),engine="ast")
+    assert [next(gen),next(gen),gen.send(7),next(gen),next(gen)] == ["hw","éö",7,"lr",None]
+    assert list(gen) == []
+    lines=Generator(ast_engine_shapes,engine="ast")._source_lines
+    ## single line statements are kept as is and the rest are unparsed ##
+    assert "    s=\"héllo\"; t='wörld'" not in lines and "    s=\"héllo\"" in lines
+    assert "    values = [i for i in range(n)]" in lines
+    assert "    def one(y): return y" in lines
+
+def module_helper(x):
+    return x*10
+
+def uses_module_globals(n):
+    for i in range(n):
+        yield module_helper(i)
+    yield sum(module_helper(i) for i in range(n))
+
+def test_states_use_the_module_globals():
+    gen=Generator(uses_module_globals(2))
+    assert list(gen) == [0,10,10]
+    gen=Generator(uses_module_globals(3))
+    assert next(gen) == 0
+    assert list(gen.next_n(3)) == [10,20,30]
+    ## the helpers of the states aren't saved as locals ##
+    assert not "track_iter" in gen.gi_frame.f_locals and not "currentframe" in gen.gi_frame.f_locals
+
+def test_fresh_frames_have_their_own_locals():
+    gen1,gen2=Generator(simple_loop),Generator(simple_loop)
+    gen1.gi_frame.f_locals["n"]=2
+    assert not "n" in gen2.gi_frame.f_locals
+    assert not "n" in Generator(simple_loop).gi_frame.f_locals
+    gen2.gi_frame.f_locals["n"]=3
+    assert (list(gen1),list(gen2)) == ([0,1],[0,1,2])
+
+async def async_loop(n):
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield i
+
+async def async_send():
+    x=yield 1
+    yield x
+
+async def collect(gen,n=None):
+    values=[]
+    async for value in gen:
+        values.append(value)
+        if len(values)==n:
+            break
+    return values
+
+def test_next_n_and_drain():
+    gen=Generator(simple_loop(5))
+    assert iter(gen) is gen
+    assert gen.next_n(2) == [0,1]
+    ## the generator stays copyable at the new position ##
+    copied=deepcopy(gen)
+    assert gen.drain() == [2,3,4]
+    assert copied.drain(tuple) == (2,3,4)
+    assert gen.next_n(1) == []
+    ## a return isn't one of the yields ##
+    assert Generator(returns_value).drain() == [1]
+
+def test_async_generator_is_not_an_iterator():
+    gen=AsyncGenerator(async_loop)
+    for FUNC,args in ((gen.next_n,(1,)),(gen.drain,()),(gen.send,(None,)),(iter,(gen,))):
+        try:
+            FUNC(*args)
+        except TypeError:
+            continue
+        raise AssertionError("TypeError was not raised")
+
+def test_disk_cache_keeps_the_states_of_other_processes(tmp_path):
+    entry=("    return 1",(0,),compile("1","<string>","eval"))
+    cache1,cache2=DiskCache(str(tmp_path)),DiskCache(str(tmp_path))
+    ## both miss then save the same record; the second save mustn't replace the first ##
+    assert cache1.load("source","def f(): yield 1") is None and cache2.load("source","def f(): yield 1") is None
+    cache1.save("source","def f(): yield 1",("    yield 1",),())
+    cache1.add_state("source","def f(): yield 1",1,(),entry)
+    cache2.save("source","def f(): yield 1",("    yield 1",),())
+    cache2.add_state("source","def f(): yield 1",2,("x",),entry)
+    cache3=DiskCache(str(tmp_path))
+    assert cache3.load("source","def f(): yield 1") == (("    yield 1",),())
+    assert sorted(cache3._records[("source","def f(): yield 1")]["states"]) == [(1,()),(2,("x",))]
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")] == []
+
+def test_disk_cache_removes_corrupted_records(tmp_path):
+    cache=DiskCache(str(tmp_path))
+    path=cache._path("source","def f(): yield 1")
+    with open(path,"wb") as file:
+        file.write(b"\xff")
+    assert cache.load("source","def f(): yield 1") is None
+    assert not os.path.exists(path)
+
+def enclosing(n):
+    def closure_loop():
+        for i in range(3):
+            yield n+i
+    def set_n(value):
+        nonlocal n
+        n=value
+    return closure_loop(),set_n
+
+def test_bytecode_generator_restores_closure_variables():
+    native,set_n=enclosing(5)
+    gen=BytecodeGenerator(native)
+    assert next(gen) == 5
+    resumed=pickle.loads(pickle.dumps(gen))
+    assert list(resumed) == [6,7]
+    ## resumed from a snapshot the closure variables are new cells (e.g. not shared) ##
+    set_n(100)
+    assert list(gen) == [6,7]
+
+def test_frame_internals_require_cpython_311(monkeypatch):
+    native=simple_loop(3)
+    next(native)
+    monkeypatch.setattr(custom_generator,"cpython_311",False)
+    for FUNC,args in ((frame_stack,(native.gi_frame,)),(resume_code,(native.gi_code,0)),(BytecodeGenerator,(native,))):
+        try:
+            FUNC(*args)
+        except NotImplementedError:
+            continue
+        raise AssertionError("NotImplementedError was not raised")
+
+def test_async_generator_steps_copies_and_pickles():
+    gen=AsyncGenerator(async_loop(4))
+    assert (gen.ag_code,gen.ag_running) == (gen.gi_code,False)
+    assert asyncio.run(collect(gen,2)) == [0,1]
+    copied,unpickled=deepcopy(gen),pickle.loads(pickle.dumps(gen))
+    assert asyncio.run(collect(gen)) == [2,3]
+    assert asyncio.run(collect(copied)) == asyncio.run(collect(unpickled)) == [2,3]
+    ## the end of the function closes it ##
+    assert gen.ag_frame is None
+
+def test_async_generator_asend_and_aclose():
+    async def run():
+        gen=AsyncGenerator(async_send)
+        values=[await gen.__anext__(),await gen.asend(5)]
+        await gen.aclose()
+        try:
+            await gen.__anext__()
+        except StopAsyncIteration:
+            return values
+    assert asyncio.run(run()) == [1,5]
+
+def test_async_generator_adopts_only_unstarted_native_generators():
+    native=async_loop(2)
+    gen=AsyncGenerator(native)
+    assert gen.ag_frame.f_locals["n"] == 2
+    assert asyncio.run(collect(gen)) == [0,1]
+    async def started():
+        await native.__anext__()
+        AsyncGenerator(native)
+    try:
+        asyncio.run(started())
+    except NotImplementedError:
+        pass
+    else:
+        raise AssertionError("NotImplementedError was not raised")
+    try:
+        AsyncGenerator(async_loop(2)).athrow(ValueError)
+    except NotImplementedError:
+        pass
+    else:
+        raise AssertionError("NotImplementedError was not raised")
+
+def test_async_generator_checkpoint():
+    async def run():
+        gen=AsyncGenerator(async_loop(3))
+        await gen.__anext__()
+        file=io.BytesIO()
+        await gen.checkpoint(file)
+        file.seek(0)
+        return load_many(file)
+    gen=asyncio.run(run())
+    assert asyncio.run(collect(gen)) == [1,2]
+
+def test_cache_evicts_least_recently_used():
+    cache=Cache(maxsize=2)
+    cache.set("a",1)
+    cache.set("b",2)
+    ## a hit makes 'a' the most recently used ##
+    assert cache.get("a") == 1
+    cache.set("c",3)
+    assert cache.get("b") is None
+    assert (cache.get("a"),cache.get("c")) == (1,3)
+    assert (cache.hits,cache.misses) == (3,1)
+
+def mutates_in_place(n):
+    counts={}; buf=bytearray(2); a=b=1; big=list(range(1000)); nested={"x":[]}
+    for i in range(n):
+        counts[i]=i; buf[i%2]=i+1
+        nested["x"].append(i)
+        yield i
+    del big
+    yield counts
+
+def test_checkpoint_delta_round_trip():
+    gen=Generator(mutates_in_place(3))
+    next(gen)
+    base=gen.checkpoint_delta()
+    next(gen)
+    gen.mark_dirty("nested")
+    deltas=[gen.checkpoint_delta()]
+    next(gen)
+    deltas.append(gen.checkpoint_delta())
+    ## the unchanged locals aren't pickled again ##
+    assert max(map(len,deltas)) < len(base)/4
+    assert next(gen) == {0:0,1:1,2:2}
+    deltas.append(gen.checkpoint_delta())
+    restored=Generator(mutates_in_place)
+    for delta in [base]+deltas:
+        restored.apply_delta(delta)
+    f_locals=restored.gi_frame.f_locals
+    ## in place mutations (found by their fingerprint) and unbound locals are applied ##
+    assert (f_locals["counts"],f_locals["buf"]) == ({0:0,1:1,2:2},bytearray(b"\x03\x02"))
+    assert not "big" in f_locals
+    ## nested mutations only when marked dirty ##
+    assert f_locals["nested"] == {"x":[0,1]}
+    ## atomic values aren't persistent references to other locals ##
+    assert f_locals["a"] == f_locals["b"] == 1
+    assert restored._position() == gen._position()
+    assert list(restored) == list(gen) == []
+
+def test_stats_count_the_bytes_pickled():
+    stats=custom_generator.stats
+    enabled=stats.enabled
+    stats.enable()
+    try:
+        stats.clear()
+        gens=[Generator(simple_loop(3)) for _ in range(3)]
+        name=gens[0]._stats_name()
+        file=io.BytesIO()
+        custom_generator.dump_many(gens,file)
+        ## what's written to the stream is split across the generators in it ##
+        assert stats.get(name)["pickled_bytes"] == len(file.getvalue())
+        stats.clear()
+        data=pickle.dumps(gens[0])
+        ## pickle.dumps is estimated by pickling the reduction on its own ##
+        assert abs(stats.get(name)["pickled_bytes"]-len(data)) < len(data)/10
+        stats.clear()
+        gens[0].checkpoint_delta()
+        assert stats.get(name)["pickled_bytes"] > 0
+    finally:
+        stats.enabled=enabled
+        stats.clear()
+
+def yields_a_lock():
+    yield 1
+    from threading import Lock
+    yield Lock()
+
+class KeywordError(Exception):
+    def __init__(self,*,reason):
+        super().__init__(reason)
+
+def raises_keyword_error():
+    yield 1
+    raise KeywordError(reason="failed")
+
+def test_parallel_map():
+    generators=[Generator(simple_loop(n)) for n in (3,5,0,2)]
+    chunks={}
+    for index,values in custom_generator.parallel_map(generators,workers=2,chunksize=2):
+        chunks.setdefault(index,[]).extend(values)
+    assert chunks == {0:[0,1,2],1:[0,1,2,3,4],3:[0,1]}
+    ## what fails to pickle or unpickle in a worker is raised here rather than dropped ##
+    for FUNC,message in ((yields_a_lock,"lock"),(raises_keyword_error,"KeywordError")):
+        try:
+            list(custom_generator.parallel_map([Generator(FUNC)],chunksize=1))
+        except Exception as error:
+            assert message in str(error)
+        else:
+            raise AssertionError("the worker's exception was not raised")
+
+def head(buf):
+    return bytes(buf[8:11])
+
+def holds_buffers(n):
+    buf,small=bytearray(n),b"small"
+    view=memoryview(buf)[8:]
+    for i in range(3):
+        view[i]=i+1
+        yield head(buf)+small
+
+def test_dump_mapped_round_trip(tmp_path):
+    size=custom_generator.buffer_threshold*2
+    gen=Generator(holds_buffers(size))
+    assert next(gen) == b"\x01\x00\x00small"
+    path=str(tmp_path/"checkpoint")
+    dump_mapped([gen],path)
+    ## the bytearray is written once to the side file and the view of it isn't written at all ##
+    assert size <= os.path.getsize(path+".buffers") < size*2
+    assert os.path.getsize(path) < size/10
+    loaded,=load_mapped(path)
+    f_locals=loaded.gi_frame.f_locals
+    ## the view is still of the bytearray (writing to it through the view changes the bytearray) ##
+    assert f_locals["view"].obj is f_locals["buf"]
+    assert list(loaded) == [b"\x01\x02\x00small",b"\x01\x02\x03small"]
+    ## changing the loaded buffers doesn't change the file ##
+    assert list(load_mapped(path)[0]) == [b"\x01\x02\x00small",b"\x01\x02\x03small"]
+
+def test_pickle_buffers_in_band():
+    gen=Generator(holds_buffers(custom_generator.buffer_threshold))
+    next(gen)
+    data=pickle.dumps(gen,5)
+    assert custom_generator.buffer_threshold < len(data) < custom_generator.buffer_threshold*2
+    loaded=pickle.loads(data)
+    assert loaded.gi_frame.f_locals["view"].obj is loaded.gi_frame.f_locals["buf"]
+    assert list(loaded) == list(gen)
+    ## memoryviews with a byte order aren't replaced (memoryview.cast doesn't support them) ##
+    import ctypes
+    view=memoryview((ctypes.c_int*4)())
+    assert custom_generator.pickle_buffers({"view":view})["view"] is view
+
+def test_states_are_compiled_once_per_function():
+    state_cache=custom_generator.state_cache
+    state_cache.clear()
+    assert list(Generator(simple_loop(3))) == [0,1,2]
+    misses=state_cache.misses
+    assert misses and len(state_cache) == misses
+    ## another instance of the same function only gets hits ##
+    gen=Generator(simple_loop(3))
+    assert list(gen) == [0,1,2]
+    assert state_cache.misses == misses and state_cache.hits >= 3
+    ## the cache is bounded by its number of entries ##
+    maxsize,maxbytes=state_cache.maxsize,state_cache.maxbytes
+    state_cache.resize(maxsize=1,maxbytes=maxbytes)
+    try:
+        assert len(state_cache) == 1
+        assert list(Generator(simple_loop(3))) == [0,1,2]
+    finally:
+        state_cache.resize(maxsize,maxbytes)
+
+def test_transformations_are_shared_across_instances():
+    stats=custom_generator.stats
+    enabled=stats.enabled
+    custom_generator.source_cache.clear()
+    stats.enable()
+    try:
+        stats.clear()
+        gen1,gen2=Generator(simple_loop(2)),Generator(simple_loop(3))
+        ## the function is only transformed once and both share the result ##
+        assert stats.get(gen1._stats_name())["transforms"] == 1
+        assert gen1._source_lines is gen2._source_lines and gen1.jump_positions is gen2.jump_positions
+        assert isinstance(gen1._source_lines,tuple)
+        ## each engine has its own transformation ##
+        assert Generator(simple_loop,engine="ast")._source_lines is not gen1._source_lines
+        assert (list(gen1),list(gen2)) == ([0,1],[0,1,2])
+    finally:
+        stats.enabled=enabled
+        stats.clear()
+
+def test_compact_pickle_references_the_function(monkeypatch):
+    gen=Generator(simple_loop(4))
+    next(gen)
+    full=pickle.dumps(gen)
+    monkeypatch.setattr(Generator,"compact_pickle",True)
+    compact=pickle.dumps(gen)
+    ## the source isn't embedded ##
+    assert len(compact) < len(full)/2 and not b"range(n)" in compact
+    assert list(pickle.loads(compact)) == [1,2,3]
+    module,qualname,digest,engine=gen._reference()
+    assert (module,qualname) == (__name__,"simple_loop")
+    try:
+        custom_generator.load_compact(Generator,(module,qualname,"changed",engine),gen._position(),{})
+    except pickle.UnpicklingError:
+        pass
+    else:
+        raise AssertionError("UnpicklingError was not raised")
+    ## lambdas, closures etc. can't be referenced ##
+    try:
+        pickle.dumps(Generator(lambda_yield_from))
+    except pickle.PicklingError:
+        pass
+    else:
+        raise AssertionError("PicklingError was not raised")
+
+def test_dump_many_writes_each_transformation_once():
+    gens=[Generator(simple_loop(n)) for n in range(2,22)]
+    for gen in gens:
+        next(gen)
+    shared=[1,2]
+    gens[0].gi_frame.f_locals["shared"]=gens[1].gi_frame.f_locals["shared"]=shared
+    file=io.BytesIO()
+    custom_generator.dump_many(gens,file)
+    assert len(file.getvalue()) < len(pickle.dumps(gens[0]))*3
+    file.seek(0)
+    loaded=load_many(file)
+    ## the transformation and what the generators share are loaded once ##
+    assert loaded[0]._source_lines is loaded[1]._source_lines and loaded[0].gi_code is loaded[1].gi_code
+    assert loaded[0].gi_frame.f_locals["shared"] is loaded[1].gi_frame.f_locals["shared"]
+    assert [list(gen) for gen in loaded] == [list(range(1,n)) for n in range(2,22)]
+
+def test_copies_share_the_immutable_parts():
+    gen=Generator(simple_loop(4))
+    next(gen)
+    gen.gi_frame.f_locals["items"]=[1]
+    for copied in (copy(gen),deepcopy(gen)):
+        for attr in Generator._shared:
+            assert getattr(copied,attr) is getattr(gen,attr)
+        assert copied.gi_frame is not gen.gi_frame
+    ## a deepcopy doesn't share the locals but a copy does ##
+    assert deepcopy(gen).gi_frame.f_locals["items"] is not gen.gi_frame.f_locals["items"]
+    assert copy(gen).gi_frame.f_locals["items"] is gen.gi_frame.f_locals["items"]
+    copied=deepcopy(gen)
+    assert (list(copied),list(gen)) == ([1,2,3],[1,2,3])
+
+def test_steps_save_a_frame_state():
+    gen=Generator(simple_loop(3))
+    next(gen)
+    ## only the locals and position are kept (e.g. no f_back chain) ##
+    assert type(gen._frame) is custom_generator.frame_state
+    assert set(gen._frame.f_locals) >= {"n","i"} and gen._frame.f_locals["i"] == 0
+    f_lineno=gen._frame.f_lineno
+    ## the full frame is created once inspected ##
+    gi_frame=gen.gi_frame
+    assert type(gi_frame) is custom_generator.frame and gen.gi_frame is gi_frame
+    assert (gi_frame.f_code,gi_frame.f_lineno,gi_frame.f_locals["i"]) == (gen.gi_code,f_lineno,0)
+    assert list(gen) == [1,2]
+
+def test_slots_instead_of_dicts():
+    native=simple_loop(3)
+    next(native)
+    for obj in (Generator(simple_loop),BytecodeGenerator(native),custom_generator.frame(),custom_generator.frame_state(),
+                custom_generator.code(simple_loop.__code__)):
+        assert not hasattr(obj,"__dict__")
+    ## the slots are still copied and pickled ##
+    record=pickle.loads(pickle.dumps(custom_generator.code(simple_loop.__code__)))
+    assert record.to_code() == simple_loop.__code__
+
+def rebinds(n):
+    total=0
+    for i in range(n):
+        x=yield total
+        total+=i if x is None else x
+    late=total*2
+    yield late
+
+def test_locals_are_restored_between_states():
+    gen=Generator(rebinds(3))
+    assert [next(gen),gen.send(10),next(gen),next(gen)] == [0,10,11,26]
+    f_locals=gen.gi_frame.f_locals
+    assert (f_locals["total"],f_locals["late"],f_locals["x"]) == (13,26,None)
+    ## the locals passed to a state are its arguements rather than written into its frame ##
+    assert gen._state_code.co_varnames[:3] == ("__state__","__hidden__","n")
+
+def nested_loops(rows):
+    for row in iter(rows):
+        for item in row:
+            yield item
+        yield "end"
+
+def test_loops_resume_from_their_iterators():
+    rows=[[1,2],[3]]
+    expected=list(nested_loops(rows))
+    gen,values=Generator(nested_loops(rows)),[]
+    ## pickled at every step the loops carry on from the same positions ##
+    while True:
+        gen=pickle.loads(pickle.dumps(gen))
+        try:
+            values.append(next(gen))
+        except StopIteration:
+            break
+    assert values == expected
+    ## the iterators of the loops are hidden locals ##
+    gen=Generator(nested_loops(rows))
+    next(gen)
+    hidden=[value for name,value in gen.gi_frame.f_locals.items() if name[:1]=="." and name!=".send"]
+    assert len(hidden) == 2 and all(iter(value) is value for value in hidden)
+
+def test_generator_expressions_run_natively():
+    stats=custom_generator.stats
+    enabled=stats.enabled
+    stats.enable()
+    try:
+        stats.clear()
+        gen=Generator(i*j for i in range(3) for j in range(1,3) if i)
+        assert type(gen) is custom_generator.GenexprGenerator
+        assert gen.next_n(2) == [1,2]
+        copied,unpickled=deepcopy(gen),pickle.loads(pickle.dumps(gen))
+        assert list(gen) == list(copied) == list(unpickled) == [2,4]
+        ## compiled once per set of bound locals (e.g. fresh and resumed from a snapshot) rather than per element ##
+        assert stats.get(gen._stats_name())["state_rebuilds"] <= 2 and stats.get(gen._stats_name())["steps"] >= 6
+    finally:
+        stats.enabled=enabled
+        stats.clear()
+
+def test_expr_getsource_uses_the_index_of_the_file():
+    first,second=lambda x: x+1,lambda x: (yield x*2)
+    custom_generator.index_cache.clear()
+    ## told apart on the same line by their spans (or constants) ##
+    assert custom_generator.expr_getsource(first) == "lambda x: x+1"
+    assert custom_generator.expr_getsource(second) == "lambda x: (yield x*2)"
+    gens=(i for i in "ab"),(j for j in "cd")
+    assert [custom_generator.expr_getsource(gen) for gen in gens] == ['(i for i in "ab")','(j for j in "cd")']
+    ## the file is parsed once ##
+    assert custom_generator.index_cache.misses == 1
+
+def test_source_registry_serves_exec_strings(tmp_path):
+    source="def counts(n):\n    for i in range(n):\n        yield i*3\n"
+    filename="<registered %s>" % tmp_path
+    namespace={}
+    exec(compile(source,filename,"exec"),namespace)
+    registry=custom_generator.SourceRegistry()
+    registry.add(filename,source)
+    assert registry.getsource(namespace["counts"]) == source
+    ## the process-wide registry is used when wrapping ##
+    custom_generator.sources.add(filename,source)
+    try:
+        assert list(Generator(namespace["counts"](3))) == [0,3,6]
+    finally:
+        custom_generator.sources._files.pop(filename)
+    ## bundles round trip ##
+    registry.dump(str(tmp_path/"bundle"))
+    assert custom_generator.SourceRegistry(str(tmp_path/"bundle")).getlines(filename) == source.splitlines(True)
+
+def test_block_tree_and_get_loops():
+    lines=["def f():",
+           "    for i in x:",
+           "        while y:",
+           "            if z:",
+           "                yield 1",
+           "        yield 2",
+           "    yield 3"]
+    blocks=custom_generator.block_tree(lines)
+    assert blocks[0] is None and blocks[1].kind == "def"
+    if_block=blocks[4]
+    assert (if_block.kind,if_block.start,if_block.end) == ("if",3,5)
+    assert [block.kind for block in (if_block.parent,if_block.parent.parent)] == ["while","for"]
+    ## the loops a line is in (outermost first) ##
+    assert [(loop.kind,loop.start) for loop in custom_generator.get_loops(4,blocks)] == [("for",1),("while",2)]
+    assert [loop.kind for loop in custom_generator.get_loops(5,blocks)] == ["for"]
+    assert custom_generator.get_loops(6,blocks) == [] and custom_generator.get_loops(99,blocks) == []
+
+def two_yields_per_loop(rows):
+    for row in rows:
+        for item in row:
+            yield item
+            yield -item
+    n=0
+    while n < 2:
+        n+=1
+        yield n*100
+
+def test_adopting_a_running_native_generator():
+    rows=[[1,2],[3]]
+    expected=list(two_yields_per_loop(rows))
+    for engine in ("source","ast"):
+        for steps in range(len(expected)):
+            native=two_yields_per_loop(rows)
+            values=[next(native) for _ in range(steps)]
+            ## resumes after the exact yield it's suspended at ##
+            assert values+list(Generator(native,engine=engine)) == expected
+    def adopts_itself():
+        yield Generator(native)
+    native=adopts_itself()
+    try:
+        next(native)
+    except ValueError as error:
+        assert "running" in str(error)
+    else:
+        raise AssertionError("ValueError was not raised")
+
+def test_reducers_pickle_iterators_by_their_position():
+    items=list(range(1000))
+    gen=Generator(simple_loop(3))
+    gen.gi_frame.f_locals.update(items=items,it=iter(items),pairs=enumerate(iter(items),1))
+    f_locals=gen.gi_frame.f_locals
+    for _ in range(10):
+        next(f_locals["it"])
+    next(f_locals["pairs"])
+    file=io.BytesIO()
+    pickler=custom_generator.CompactPickler(file)
+    pickler.share(f_locals.values())
+    pickler.dump(f_locals)
+    ## the list is only pickled once with the iterators referencing it ##
+    assert len(file.getvalue()) < len(pickle.dumps(items))+200
+    loaded=pickle.loads(file.getvalue())
+    assert next(loaded["it"]) == 10 and next(loaded["pairs"]) == (2,1)
+    assert loaded["it"].__reduce__()[1][0] is loaded["items"]
+    ## reducers can be registered for other types ##
+    class Countdown(object):
+        def __init__(self,n):
+            self.n=n
+    reducers=custom_generator.Reducers()
+    reducers.register(Countdown,lambda obj,compact,shared:(Countdown,(obj.n-1,)))
+    assert reducers.reduce(Countdown(3)) == (Countdown,(2,))
+    reducers.unregister(Countdown)
+    assert reducers.reduce(Countdown(3)) is None